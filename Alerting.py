@@ -1,84 +1,627 @@
 
-import time
-import requests
+import atexit
+import collections
+import hashlib
+import json
+import os
+import queue
+import random
 import smtplib
+import ssl
+import threading
+import time
+from datetime import datetime
 from email.message import EmailMessage
-from config import SLACK_WEBHOOK, TEAMS_WEBHOOK, EMAIL_SMTP, ALERT_COOLDOWN_SECONDS
+from typing import Callable, Dict, List, Optional
 
+import requests
 
-class Alerting:
-    def __init__(self):
-        self.last_alert_time = {}
+from config import (ALERT_BACKOFF_MAX_SECONDS, ALERT_BACKOFF_SECONDS, ALERT_CLOSE_TIMEOUT, ALERT_DIGEST_SECONDS, ALERT_EMAIL_TO,
+                    ALERT_HTTP_TIMEOUT, ALERT_MAX_GROUPS, ALERT_QUEUE_SIZE, ALERT_RETRIES, ALERT_SPIKE_FACTOR,
+                    ALERT_SPIKE_MIN, ALERT_SPILL_DIR, ALERT_SPILL_MAX, ALERT_WINDOW_SECONDS, EMAIL_SMTP, SLACK_WEBHOOK,
+                    SMTP_HOST, SMTP_PASSWORD, SMTP_PORT, SMTP_STARTTLS, SMTP_USER, TEAMS_WEBHOOK)
+from log_record import LogRecord, template_of
+from score_cache import ScoreCache
+
+
+class PermanentError(Exception):
+    """A send that retrying cannot fix (e.g. a 4xx from a webhook)."""
+
+
+class WebhookChannel:
+    """JSON POSTs to one URL over a pooled, keep-alive requests.Session."""
+
+    def __init__(self, url: str, timeout: float = ALERT_HTTP_TIMEOUT):
+        self.url = url
+        self.timeout = timeout
+        self.session = requests.Session()
+
+    def send(self, payload: dict):
+        resp = self.session.post(self.url, json=payload, timeout=self.timeout)
+        if 400 <= resp.status_code < 500 and resp.status_code != 429:
+            raise PermanentError(f"HTTP {resp.status_code}")
+        resp.raise_for_status()
+
+    def close(self):
+        self.session.close()
+
+
+class SmtpChannel:
+    """
+    Emails over one long-lived SMTP connection (STARTTLS and login once, not per
+    message). A connection the server has dropped is reopened and the message
+    resent once before the send counts as failed.
+    """
+
+    def __init__(self, host: str = SMTP_HOST, port: int = SMTP_PORT, user: str = SMTP_USER,
+                 password: str = SMTP_PASSWORD, starttls: bool = SMTP_STARTTLS, sender: str = EMAIL_SMTP,
+                 timeout: float = ALERT_HTTP_TIMEOUT):
+        self.host, self.port = host, port
+        self.user, self.password = user, password
+        self.starttls = starttls
+        self.sender = sender
+        self.timeout = timeout
+        self.conn = None
+        self.addr = None
+
+    def _connect(self, host: str, port: int):
+        self.close()
+        print(f"📧 Connecting to SMTP server at {host}:{port}...")
+        conn = smtplib.SMTP(host, port, timeout=self.timeout)
+        try:
+            if self.starttls:
+                conn.starttls()
+            if self.user:
+                conn.login(self.user, self.password)
+        except BaseException:
+            conn.close()
+            raise
+        self.conn, self.addr = conn, (host, port)
+
+    def send(self, payload: dict):
+        msg = EmailMessage()
+        msg["Subject"] = payload["subject"]
+        msg["From"] = self.sender
+        msg["To"] = payload["to"]
+        msg.set_content(payload["body"])
+        addr = (payload.get("host") or self.host, payload.get("port") or self.port)
+        for attempt in range(2):
+            try:
+                # connecting is classified too: a rejected login or missing STARTTLS won't fix itself
+                if self.conn is None or self.addr != addr:
+                    self._connect(*addr)
+                self.conn.send_message(msg)
+                return
+            except smtplib.SMTPServerDisconnected:
+                self.conn = None  # idle connection closed by the server; reconnect once
+                if attempt:
+                    raise
+            except smtplib.SMTPRecipientsRefused as e:
+                raise PermanentError(f"recipients refused: {list(e.recipients)}")
+            except smtplib.SMTPResponseException as e:
+                self.close()
+                if e.smtp_code >= 500:
+                    raise PermanentError(f"SMTP {e.smtp_code}: {e.smtp_error!r}")
+                raise  # 4xx is worth a retry, on a fresh connection
+            except (smtplib.SMTPNotSupportedError, ssl.SSLCertVerificationError) as e:
+                self.close()
+                raise PermanentError(f"{type(e).__name__}: {e}")
+            except OSError:
+                self.close()
+                raise
+
+    def close(self):
+        if self.conn is not None:
+            try:
+                self.conn.quit()
+            except (smtplib.SMTPException, OSError):
+                pass
+            self.conn = None
+
+
+def _percentile(values, q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
 
-    def _cooldown_ok(self, key):
-        now = time.time()
-        last = self.last_alert_time.get(key, 0)
-        if now - last < ALERT_COOLDOWN_SECONDS:
+
+class ChannelWorker:
+    """
+    Delivery thread for one channel.
+
+    send() only queues the alert. The thread delivers in order, retrying a
+    failed send with exponential backoff (the alert stays at the head, so a
+    down endpoint gets one probe per backoff step rather than a storm). When
+    the in-memory queue is full, or anything is already on disk, alerts are
+    appended to `<spill_dir>/<name>.jsonl` and read back as the queue drains;
+    alerts still pending at close() are written there too and delivered on the
+    next start. The spill file holds at most `spill_max` alerts.
+    """
+
+    def __init__(self, name: str, channel, queue_size: int = ALERT_QUEUE_SIZE, retries: int = ALERT_RETRIES,
+                 backoff: float = ALERT_BACKOFF_SECONDS, backoff_max: float = ALERT_BACKOFF_MAX_SECONDS,
+                 spill_dir: str = ALERT_SPILL_DIR, spill_max: int = ALERT_SPILL_MAX):
+        self.name = name
+        self.channel = channel
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.retries = retries
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self.spill_path = os.path.join(spill_dir, f"{name}.jsonl")
+        self.spill_max = spill_max
+        self.sent = self.failures = self.dropped = 0
+        self.enqueue_latency = collections.deque(maxlen=10000)   # seconds spent inside send()
+        self.delivery_latency = collections.deque(maxlen=10000)  # seconds from send() to delivered
+        self._lock = threading.Lock()
+        self._head = None  # alert being retried
+        self.spilled = self._read_spill_count()
+        self.pending = self.spilled  # accepted, not yet delivered or dropped
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f"alert-{name}", daemon=True)
+        self._thread.start()
+
+    def send(self, payload: dict) -> bool:
+        """Queue one alert; never blocks on the network. False if it had to be dropped."""
+        start = time.perf_counter()
+        item = {"payload": payload, "enqueued": time.time(), "attempts": 0}
+        with self._lock:
+            accepted = True
+            if self.spilled:
+                accepted = self._spill([item])  # stay behind what is already on disk
+            else:
+                try:
+                    self.queue.put_nowait(item)
+                except queue.Full:
+                    accepted = self._spill([item])
+            self.pending += accepted
+        self.enqueue_latency.append(time.perf_counter() - start)
+        return accepted
+
+    # spill file; callers hold self._lock
+    def _read_spill_count(self) -> int:
+        try:
+            with open(self.spill_path, encoding="utf-8") as f:
+                return sum(1 for _ in f)
+        except FileNotFoundError:
+            return 0
+
+    def _spill(self, items, front: bool = False) -> bool:
+        room = max(0, self.spill_max - self.spilled)
+        lines = [json.dumps(item) + "\n" for item in items]
+        if front and self.spilled:
+            # older than what is on disk: rewrite with them first, then cut the newest overflow
+            with open(self.spill_path, encoding="utf-8") as f:
+                lines += f.readlines()
+            kept = lines[:self.spill_max]
+            self._rewrite(kept)
+            self.dropped += len(lines) - len(kept)
+            self.spilled = len(kept)
+            return len(lines) == len(kept)
+        if lines[:room]:
+            os.makedirs(os.path.dirname(self.spill_path) or ".", exist_ok=True)
+            with open(self.spill_path, "a", encoding="utf-8") as f:
+                f.writelines(lines[:room])
+        self.spilled += len(lines[:room])
+        if len(lines) > room:
+            self.dropped += len(lines) - room
+            print(f"⚠️ {self.name} alert spill is full ({self.spill_max}); dropped {len(lines) - room} alert(s)")
             return False
-        self.last_alert_time[key] = now
         return True
 
+    def _rewrite(self, lines):
+        os.makedirs(os.path.dirname(self.spill_path) or ".", exist_ok=True)
+        tmp = self.spill_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.writelines(lines)
+        os.replace(tmp, self.spill_path)
 
-    def slack(self, text: str):
-        if not SLACK_WEBHOOK:
+    def _unspill(self):
+        with self._lock:
+            if not self.spilled:
+                return
+            with open(self.spill_path, encoding="utf-8") as f:
+                lines = f.readlines()
+            take = max(1, self.queue.maxsize - self.queue.qsize()) if self.queue.maxsize > 0 else len(lines)
+            for line in lines[:take]:
+                self.queue.put_nowait(json.loads(line))
+            self._rewrite(lines[take:])
+            self.spilled = len(lines) - len(lines[:take])
+
+    def _run(self):
+        while not self._stop.is_set():
+            item = self._head
+            if item is None:
+                if self.spilled and self.queue.empty():
+                    self._unspill()
+                try:
+                    item = self.queue.get(timeout=0.2)
+                except queue.Empty:
+                    continue
+            try:
+                self.channel.send(item["payload"])
+            except Exception as e:
+                item["attempts"] += 1
+                self.failures += 1
+                if isinstance(e, PermanentError) or item["attempts"] > self.retries:
+                    print(f"⚠️ {self.name} alert dropped after {item['attempts']} attempt(s): {e}")
+                    self._head = None
+                    with self._lock:
+                        self.dropped += 1
+                        self.pending -= 1
+                    continue
+                self._head = item
+                delay = min(self.backoff_max, self.backoff * 2 ** (item["attempts"] - 1))
+                self._stop.wait(delay * random.uniform(0.5, 1.0))  # jitter so channels don't retry in lockstep
+                continue
+            self._head = None
+            self.sent += 1
+            self.delivery_latency.append(time.time() - item["enqueued"])
+            with self._lock:
+                self.pending -= 1
+
+        # keep whatever is left for the next start
+        leftover = [self._head] if self._head is not None else []
+        while True:
+            try:
+                leftover.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        if leftover:
+            with self._lock:
+                self._spill(leftover, front=True)
+        self.channel.close()
+
+    def close(self):
+        self._stop.set()
+        self._thread.join()
+
+    def stats(self) -> dict:
+        return {
+            "sent": self.sent,
+            "failed_attempts": self.failures,
+            "dropped": self.dropped,
+            "queued": self.queue.qsize(),
+            "spilled": self.spilled,
+            "enqueue_p50_us": 1e6 * _percentile(self.enqueue_latency, 0.5),
+            "enqueue_p99_us": 1e6 * _percentile(self.enqueue_latency, 0.99),
+            "delivery_p50_ms": 1e3 * _percentile(self.delivery_latency, 0.5),
+            "delivery_p99_ms": 1e3 * _percentile(self.delivery_latency, 0.99),
+        }
+
+
+class AlertDispatcher:
+    """One ChannelWorker per configured channel, so a slow webhook never holds up the others."""
+
+    def __init__(self, channels: Dict[str, object], **worker_kwargs):
+        self.workers = {name: ChannelWorker(name, channel, **worker_kwargs) for name, channel in channels.items()}
+        atexit.register(self.close)
+
+    @classmethod
+    def from_config(cls, **worker_kwargs) -> "AlertDispatcher":
+        channels = {}
+        if SLACK_WEBHOOK:
+            channels["slack"] = WebhookChannel(SLACK_WEBHOOK)
+        if TEAMS_WEBHOOK:
+            channels["teams"] = WebhookChannel(TEAMS_WEBHOOK)
+        if EMAIL_SMTP:
+            channels["email"] = SmtpChannel()
+        return cls(channels, **worker_kwargs)
+
+    def send(self, channel: str, payload: dict) -> bool:
+        worker = self.workers.get(channel)
+        return worker.send(payload) if worker is not None else False
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Wait until every accepted alert is delivered or dropped. False on timeout."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while any(w.pending for w in self.workers.values()):
+            if deadline is not None and time.monotonic() > deadline:
+                return False
+            time.sleep(0.01)
+        return True
+
+    def close(self, timeout: Optional[float] = ALERT_CLOSE_TIMEOUT):
+        """Deliver what is queued for up to `timeout` seconds, then stop; the rest is spilled for the next start."""
+        atexit.unregister(self.close)
+        self.flush(timeout)
+        for worker in self.workers.values():
+            worker.close()
+
+    def stats(self) -> Dict[str, dict]:
+        return {name: worker.stats() for name, worker in self.workers.items()}
+
+
+def alert_fingerprint(sequence: List) -> str:
+    """
+    Grouping key of an anomalous window: the set of template IDs in it, so the
+    windows sliding over one incident share a key whatever their order. Raw
+    text windows fall back to the score cache's normalized-text fingerprint.
+    """
+    mined = [template_of(item) for item in sequence]
+    if mined and None not in mined:
+        key = "\x1f".join(sorted({str(tid) for tid, _ in mined}))
+        return "tids:" + hashlib.blake2b(key.encode("utf-8"), digest_size=16).hexdigest()
+    return ScoreCache.fingerprint(sequence)
+
+
+class AlertGroup:
+    """Running state of one (fingerprint, source) group between digests."""
+
+    __slots__ = ("fingerprint", "source", "first_seen", "last_seen", "total", "count", "max_score", "sample",
+                 "last_digest", "baseline", "escalated", "seconds", "window_count")
+
+    def __init__(self, fingerprint: str, source: str, now: float):
+        self.fingerprint = fingerprint
+        self.source = source
+        self.first_seen = self.last_seen = now
+        self.total = 0          # anomalies since first seen
+        self.count = 0          # anomalies since the last digest
+        self.max_score = 0.0    # since the last digest
+        self.sample = None      # text of the highest-scoring one since the last digest
+        self.last_digest = float("-inf")
+        self.baseline = 0.0     # usual window count (EWMA, updated per digest)
+        self.escalated = False
+        self.seconds = collections.deque()  # [second, n] per second inside the sliding window
+        self.window_count = 0
+
+    def slide(self, now: float, window: float):
+        while self.seconds and self.seconds[0][0] <= now - window:
+            self.window_count -= self.seconds.popleft()[1]
+
+
+class AlertAggregator:
+    """
+    Coalesces anomalies into digests per (template fingerprint, source).
+
+    A digest covers everything a group saw since its previous one: count,
+    running total, first/last seen, max score and the top-scoring sample.
+    Digests are batched, so the channels get at most one message per
+    `interval`: the first anomaly on a quiet system goes out within a second,
+    then whatever accumulated goes out when the interval is up. A group whose
+    count over the sliding `window` reaches `spike_factor` times its usual
+    count (and at least `spike_min`) is escalated on the next tick, in a
+    message of its own shared only with other groups spiking that second.
+    At most `max_groups` groups are tracked; the least recently seen is evicted
+    with its digest carried into the next batch, and idle groups expire once
+    their window is empty. Every anomaly is counted in exactly one digest.
+    """
+
+    def __init__(self, emit: Callable[[List[dict]], None], interval: float = ALERT_DIGEST_SECONDS,
+                 window: float = ALERT_WINDOW_SECONDS, max_groups: int = ALERT_MAX_GROUPS,
+                 spike_factor: float = ALERT_SPIKE_FACTOR, spike_min: int = ALERT_SPIKE_MIN, start: bool = True):
+        self.emit = emit
+        self.interval = interval
+        self.window = window
+        self.max_groups = max_groups
+        self.spike_factor = spike_factor
+        self.spike_min = spike_min
+        self.groups = collections.OrderedDict()  # (fingerprint, source) -> AlertGroup, least recently seen first
+        self.anomalies = self.digests = self.messages = self.evicted = 0
+        self._evicted = []  # digests of evicted groups, sent with the next batch
+        self._spiking = []  # groups escalated since the last tick
+        self._last_batch = float("-inf")
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        if start:
+            self._thread = threading.Thread(target=self._run, name="alert-digests", daemon=True)
+            self._thread.start()
+
+    def _threshold(self, group: AlertGroup) -> float:
+        return max(self.spike_min, self.spike_factor * group.baseline)
+
+    def add(self, fingerprint: str, source: str, score: float, text: Optional[str] = None,
+            now: Optional[float] = None):
+        now = time.time() if now is None else now
+        with self._lock:
+            self.anomalies += 1
+            key = (fingerprint, source or "")
+            group = self.groups.get(key)
+            if group is None:
+                group = self.groups[key] = AlertGroup(fingerprint, source or "", now)
+                if len(self.groups) > self.max_groups:
+                    _, oldest = self.groups.popitem(last=False)
+                    self.evicted += 1
+                    if oldest.count:
+                        self._carry(self._digest(oldest, now, "evicted"))
+            else:
+                self.groups.move_to_end(key)
+            group.last_seen = now
+            group.total += 1
+            group.count += 1
+            if group.sample is None or score > group.max_score:
+                group.max_score, group.sample = max(score, group.max_score), text
+            second = int(now)
+            if group.seconds and group.seconds[-1][0] == second:
+                group.seconds[-1][1] += 1
+            else:
+                group.seconds.append([second, 1])
+            group.window_count += 1
+            group.slide(now, self.window)
+            if not group.escalated and group.window_count >= self._threshold(group):
+                group.escalated = True
+                self._spiking.append(group)
+
+    def _carry(self, digest: dict):
+        # evicted digests wait for the next batch; past max_groups they fold into one "*" digest
+        if len(self._evicted) < self.max_groups:
+            self._evicted.append(digest)
             return
-        if not self._cooldown_ok("slack"):
+        other = self._evicted[-1]
+        if other["fingerprint"] != "*":
+            self._evicted.append(dict(digest, fingerprint="*", source="", new=False))
             return
-        payload = {"text": text}
-        try:
-            resp = requests.post(SLACK_WEBHOOK, json=payload, timeout=5)
-            resp.raise_for_status()
-        except Exception as e:
-            print("Slack alert failed:", e)
+        for field in ("count", "total", "window_count"):
+            other[field] += digest[field]
+        other["first_seen"] = min(other["first_seen"], digest["first_seen"])
+        other["last_seen"] = max(other["last_seen"], digest["last_seen"])
+        if digest["max_score"] > other["max_score"]:
+            other["max_score"], other["sample"] = digest["max_score"], digest["sample"]
 
+    def tick(self, now: Optional[float] = None):
+        """Send the batch of due digests if the interval is up, and drop idle groups; run every second."""
+        now = time.time() if now is None else now
+        batch = spikes = None
+        with self._lock:
+            if self._spiking:
+                spikes = [self._digest(g, now, "spike") for g in self._spiking if g.count]
+                self._spiking = []
+                self.messages += bool(spikes)
+            send = now - self._last_batch >= self.interval
+            due = []
+            for key, group in list(self.groups.items()):
+                group.slide(now, self.window)
+                if send and group.count and now - group.last_digest >= self.interval:
+                    group.baseline = (0.7 * group.baseline + 0.3 * group.window_count if group.baseline
+                                      else group.window_count)
+                    due.append(self._digest(group, now, "digest"))
+                if group.escalated and group.window_count < self._threshold(group):
+                    group.escalated = False
+                if not group.count and not group.window_count:
+                    del self.groups[key]
+            if send and (due or self._evicted):
+                batch, self._evicted = self._evicted + due, []
+                self._last_batch = now
+                self.messages += 1
+        if spikes:
+            self.emit(spikes)
+        if batch:
+            self.emit(batch)
 
-    def teams(self, text: str):
+    def flush(self, now: Optional[float] = None):
+        """Send everything not yet reported as one batch."""
+        now = time.time() if now is None else now
+        with self._lock:
+            batch = self._evicted + [self._digest(g, now, "digest") for g in self.groups.values() if g.count]
+            self._evicted, self._spiking = [], []
+            if batch:
+                self._last_batch = now
+                self.messages += 1
+        if batch:
+            self.emit(batch)
+
+    def _digest(self, group: AlertGroup, now: float, reason: str) -> dict:
+        digest = {
+            "reason": reason,
+            "new": group.count == group.total,
+            "fingerprint": group.fingerprint,
+            "source": group.source,
+            "count": group.count,
+            "total": group.total,
+            "window_count": group.window_count,
+            "window": self.window,
+            "first_seen": group.first_seen,
+            "last_seen": group.last_seen,
+            "max_score": group.max_score,
+            "sample": group.sample,
+        }
+        group.count, group.max_score, group.sample = 0, 0.0, None
+        group.last_digest = now
+        self.digests += 1
+        return digest
+
+    def _run(self):
+        while not self._stop.wait(1.0):
+            self.tick()
+
+    def close(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.flush()
+
+    def stats(self) -> dict:
+        return {"anomalies": self.anomalies, "digests": self.digests, "messages": self.messages,
+                "groups": len(self.groups), "evicted": self.evicted}
+
+
+def format_digests(digests: List[dict], max_groups: int = 10) -> str:
+    """One channel message for a batch of digests, largest groups first."""
+    seen = lambda ts: datetime.fromtimestamp(ts).strftime("%H:%M:%S")
+    spike = any(d["reason"] == "spike" for d in digests)
+    total = sum(d["count"] for d in digests)
+    lines = [f"{'📈 Anomaly spike' if spike else '🚨 Anomalies'}: {total} in {len(digests)} group(s)"]
+    ordered = sorted(digests, key=lambda d: d["count"], reverse=True)
+    for d in ordered[:max_groups]:
+        source = f" on {d['source']}" if d["source"] else ""
+        lines.append(
+            f"• {d['count']}{' (new)' if d['new'] else ''}{source}, {d['window_count']} in the last {d['window']:g}s, "
+            f"{d['total']} since {seen(d['first_seen'])}, last {seen(d['last_seen'])}, "
+            f"max score {d['max_score']:.3f} [{d['fingerprint']}]"
+        )
+        if d["sample"]:
+            lines.append(f"  {str(d['sample'])[:300]}")
+    if len(ordered) > max_groups:
+        rest = ordered[max_groups:]
+        lines.append(f"…and {len(rest)} more group(s) with {sum(d['count'] for d in rest)} anomalies")
+    return "\n".join(lines)
 
-        if not TEAMS_WEBHOOK:
+
+class Alerting:
+    def __init__(self, dispatcher: Optional[AlertDispatcher] = None, email_to: str = ALERT_EMAIL_TO,
+                 aggregator: Optional[AlertAggregator] = None):
+        self.dispatcher = dispatcher or AlertDispatcher.from_config()
+        self.email_to = email_to
+        self.aggregator = aggregator or AlertAggregator(self._send_digests)
+        atexit.register(self.close)  # runs before the dispatcher's, so the last digests are queued and delivered
+
+    def anomaly(self, sequence: List, score: float, source: Optional[str] = None, text: Optional[str] = None):
+        """Report one anomalous window; it reaches the channels as part of its group's digest."""
+        last = sequence[-1] if sequence else None
+        if isinstance(last, LogRecord):
+            source = last.source if source is None else source
+            text = last.message if text is None else text
+        elif text is None and last is not None:
+            text = str(last)
+        self.aggregator.add(alert_fingerprint(sequence), source or "", score, text)
+
+    def _send_digests(self, digests: List[dict]):
+        text = format_digests(digests)
+        self.slack(text)
+        self.teams(text)
+        if self.email_to:
+            self.email(text.split("\n", 1)[0], text, self.email_to)
+
+
+    def slack(self, text: str):
+        if "slack" not in self.dispatcher.workers:
             return
-        if not self._cooldown_ok("teams"):
+        self.dispatcher.send("slack", {"text": text})
+
+
+    def teams(self, text: str):
+
+        if "teams" not in self.dispatcher.workers:
             return
-        payload = {"text": text}
-        try:
-            resp = requests.post(TEAMS_WEBHOOK, json=payload, timeout=5)
-            resp.raise_for_status()
-        except Exception as e:
-            print("Teams alert failed:", e)
+        self.dispatcher.send("teams", {"text": text})
 
 
     def email(self, subject: str, body: str, to: str, smtp_server: str = None, smtp_port: int = None):
-        if not EMAIL_SMTP:
-            return
-        if not self._cooldown_ok("email"):
+        if "email" not in self.dispatcher.workers:
             return
-        msg = EmailMessage()
-        msg["Subject"] = subject
-        msg["From"] = EMAIL_SMTP
-        msg["To"] = to
-        msg.set_content(body)
-        try:
-            host = smtp_server or "localhost"
-            port = smtp_port or 25
-            print(f"📧 Connecting to SMTP server at {host}:{port}...")   
-            # with smtplib.SMTP(host, port) as s:                         #this was for testing  
-            #     s.send_message(msg)
-            # print("Email sent!")
-            with smtplib.SMTP("smtp.gmail.com", 587) as s:
-                s.starttls()
-                s.login("", "")
-                s.send_message(msg)
-        except Exception as e:
-            print("Email failed:", e)
+        # smtp_server/smtp_port override SMTP_HOST/SMTP_PORT for this message
+        self.dispatcher.send("email", {"subject": subject, "body": body, "to": to,
+                                       "host": smtp_server, "port": smtp_port})
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        self.aggregator.flush()
+        return self.dispatcher.flush(timeout)
+
+    def close(self, timeout: Optional[float] = ALERT_CLOSE_TIMEOUT):
+        atexit.unregister(self.close)
+        self.aggregator.close()
+        self.dispatcher.close(timeout)
 
 
 
 
 if __name__ == "__main__":                                              #this is for testing the file, comment this in actual pipeline implementation
     alerter = Alerting()
-    
+
     # # Test Teams
     # alerter.teams("🚨 Test Alert from LogBERT → Teams is working!")
-    
+
     # # Test Slack
     # alerter.slack("🚨 Test Alert from LogBERT → Slack is working!")
     alerter.email(
@@ -88,5 +631,6 @@ if __name__ == "__main__":                                              #this is
         smtp_server="localhost",
         smtp_port=1025
     )
-
-
+    alerter.flush(timeout=30)
+    print(alerter.dispatcher.stats())
+    alerter.close()
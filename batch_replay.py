@@ -0,0 +1,184 @@
+"""
+Batch replay of large historical log files.
+
+    python batch_replay.py synthetic_logs.jsonl --out replay_out --workers 8
+
+The file is memory-mapped and cut into newline-aligned byte ranges. Worker
+processes decode the ranges and parse every line into a LogRecord in
+parallel, a few chunks ahead of the parent. The parent mines templates (sharded over DRAIN_SHARDS processes when
+set) and builds windows in file order, so template IDs, windows and scores are
+identical to a sequential run whatever the chunk size or worker count. Drain's
+clusters depend on arrival order, which is why mining stays ordered.
+
+Each chunk's scores go to `<out>/chunk-NNNNN.jsonl`, and `manifest.json` records
+the completed chunks. A restarted replay re-parses and re-mines the completed
+chunks to rebuild Drain and window state, but does not score them again. (The
+embedding engine's running centroid only sees the chunks it scores.)
+"""
+import argparse
+import contextlib
+import json
+import mmap
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Tuple
+
+import config
+from log_record import LogRecord, parse_line
+from seq_generator import SequenceWindow
+from template_extracter import DrainWrapper
+
+
+def split_ranges(path: str, chunk_bytes: int = config.BATCH_CHUNK_BYTES) -> List[Tuple[int, int]]:
+    """Byte ranges of about `chunk_bytes` each, every one ending just after a newline."""
+    size = os.path.getsize(path)
+    if size == 0:
+        return []
+    ranges = []
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        start = 0
+        while start < size:
+            nl = mm.find(b"\n", min(start + chunk_bytes, size) - 1)
+            end = size if nl < 0 else nl + 1
+            ranges.append((start, end))
+            start = end
+    return ranges
+
+
+def parse_chunk(path: str, start: int, end: int) -> List[LogRecord]:
+    # runs in a worker process: map the file and parse only this byte range
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        text = mm[start:end].decode("utf-8", errors="replace")
+    return [parse_line(line, source=path) for line in text.splitlines() if line]
+
+
+class BatchReplay:
+    def __init__(self, path: str, out_dir: str, workers: int = config.BATCH_WORKERS,
+                 chunk_bytes: int = config.BATCH_CHUNK_BYTES, engine=None, score: bool = True):
+        self.path = path
+        self.out_dir = out_dir
+        self.workers = workers
+        self.chunk_bytes = chunk_bytes
+        self.engine = engine
+        self.score = score
+        self.manifest_path = os.path.join(out_dir, "manifest.json")
+
+    def _load_manifest(self) -> dict:
+        st = os.stat(self.path)
+        fresh = {"source": os.path.abspath(self.path), "size": st.st_size, "mtime": st.st_mtime,
+                 "chunk_bytes": self.chunk_bytes, "completed": []}
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path) as f:
+                manifest = json.load(f)
+            # only resume a run over the same file with the same chunking
+            if all(manifest.get(k) == fresh[k] for k in ("source", "size", "mtime", "chunk_bytes")):
+                return manifest
+        return fresh
+
+    def _save_manifest(self, manifest: dict):
+        tmp = f"{self.manifest_path}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(manifest, f)
+        os.replace(tmp, self.manifest_path)
+
+    def _score(self, windows: List[List]) -> List[float]:
+        if self.engine is None:
+            from embedding_engine import create_engine
+            self.engine = create_engine()
+        if hasattr(self.engine, "map"):  # worker_pool.InferencePool
+            return [r["score"] if r else None for r in self.engine.map("replay", windows)]
+        return [r["score"] for r in self.engine.infer_batch(windows, explain=False)]
+
+    def run(self) -> dict:
+        os.makedirs(self.out_dir, exist_ok=True)
+        manifest = self._load_manifest()
+        completed = set(manifest["completed"])
+        ranges = split_ranges(self.path, self.chunk_bytes)
+        # start from an empty miner: completed chunks are re-mined to rebuild state
+        drain = DrainWrapper(depth=config.DRAIN_DEPTH, sim_threshold=config.DRAIN_SIMILARITY, snapshot_path="")
+        window = SequenceWindow()
+
+        stats = {"chunks": len(ranges), "skipped": len(completed), "lines": 0, "windows": 0,
+                 "parse_s": 0.0, "mine_s": 0.0, "score_s": 0.0}
+        started = time.perf_counter()
+        line_no = 0
+        with ProcessPoolExecutor(max_workers=self.workers) as pool, contextlib.closing(drain):
+            # keep a bounded number of chunks parsing ahead of the ordered mining loop
+            ahead = max(2, 2 * self.workers)
+            futures = [pool.submit(parse_chunk, self.path, s, e) for s, e in ranges[:ahead]]
+            for idx in range(len(ranges)):
+                t0 = time.perf_counter()
+                records = futures[idx].result()
+                futures[idx] = None
+                if idx + ahead < len(ranges):
+                    futures.append(pool.submit(parse_chunk, self.path, *ranges[idx + ahead]))
+                t1 = time.perf_counter()
+
+                windows, ends = [], []
+                for record in drain.add_records(records):
+                    line_no += 1
+                    seq = window.add_log(record)
+                    if seq is not None:
+                        windows.append(seq)
+                        ends.append(line_no)
+                    for seq in window.pop_closed():  # session mode
+                        windows.append(seq)
+                        ends.append(line_no)
+                if idx == len(ranges) - 1:
+                    for seq in window.close():
+                        windows.append(seq)
+                        ends.append(line_no)
+                t2 = time.perf_counter()
+
+                stats["lines"] += len(records)
+                stats["windows"] += len(windows)
+                stats["parse_s"] += t1 - t0
+                stats["mine_s"] += t2 - t1
+                if idx in completed or not self.score:
+                    continue
+
+                scores = self._score(windows) if windows else []
+                stats["score_s"] += time.perf_counter() - t2
+                out = os.path.join(self.out_dir, f"chunk-{idx:05d}.jsonl")
+                with open(f"{out}.tmp", "w") as f:
+                    for end, score in zip(ends, scores):
+                        f.write(json.dumps({"line": end, "score": score}) + "\n")
+                os.replace(f"{out}.tmp", out)
+                manifest["completed"].append(idx)
+                self._save_manifest(manifest)
+
+        elapsed = time.perf_counter() - started
+        stats["seconds"] = elapsed
+        stats["lines_per_s"] = stats["lines"] / elapsed if elapsed else 0.0
+        return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("path")
+    parser.add_argument("--out", default=config.BATCH_OUTPUT_DIR)
+    parser.add_argument("--workers", type=int, default=config.BATCH_WORKERS)
+    parser.add_argument("--chunk-mb", type=float, default=config.BATCH_CHUNK_BYTES / 2**20)
+    parser.add_argument("--score-workers", type=int, default=1, help=">1 scores through worker_pool.InferencePool")
+    parser.add_argument("--no-score", action="store_true", help="parse and mine only")
+    args = parser.parse_args()
+
+    engine = None
+    if args.score_workers > 1 and not args.no_score:
+        from worker_pool import InferencePool
+        engine = InferencePool(n_workers=args.score_workers)
+    try:
+        stats = BatchReplay(args.path, args.out, workers=args.workers, chunk_bytes=int(args.chunk_mb * 2**20),
+                            engine=engine, score=not args.no_score).run()
+    finally:
+        if engine is not None:
+            engine.close()
+    print(f"{stats['lines']:,} lines, {stats['windows']:,} windows in {stats['seconds']:.1f} s "
+          f"({stats['lines_per_s']:,.0f} lines/s); parse {stats['parse_s']:.1f} s waiting, "
+          f"mine {stats['mine_s']:.1f} s, score {stats['score_s']:.1f} s; "
+          f"{stats['skipped']}/{stats['chunks']} chunks resumed from manifest")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,1163 @@
+"""
+Throughput benchmarks for the LogBERT pipeline.
+
+    python benchmark.py batch --windows 256 --log-file dynamic_logs.txt
+    python benchmark.py precision --mode int8
+    python benchmark.py pool --workers 1 2 4 8
+    python benchmark.py startup
+    python benchmark.py knn --vectors 100000
+    python benchmark.py tail
+    python benchmark.py drain --templates 500 --shards 2 4
+    python benchmark.py snapshot --clusters 20000
+    python benchmark.py window --lines 200000
+    python benchmark.py session --sessions 20000
+    python benchmark.py timewindow --hours 24
+    python benchmark.py parse --lines 200000
+    python benchmark.py threshold --rows 1000000
+    python benchmark.py feedback --rows 200000
+    python benchmark.py retention --days 21
+    python benchmark.py alerts --alerts 2000 --delay-ms 20
+    python benchmark.py coalesce --rate 10000
+"""
+import argparse
+import multiprocessing as mp
+import random
+import resource
+import statistics
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import List
+
+import config
+
+
+def load_windows(log_file: str, n_windows: int, seed: int = 0) -> List[List[str]]:
+    """Cut `n_windows` windows of random length (1..SEQUENCE_LENGTH) out of a log file."""
+    with open(log_file, "r") as f:
+        lines = [line.rstrip("\n") for line in f if line.strip()]
+    rng = random.Random(seed)
+    windows = []
+    for _ in range(n_windows):
+        length = rng.randint(1, config.SEQUENCE_LENGTH)
+        start = rng.randint(0, max(0, len(lines) - length))
+        windows.append(lines[start:start + length])
+    return windows
+
+
+def bench_batch(args):
+    from embedding_engine import create_engine
+
+    model = create_engine(args.engine)
+    if hasattr(model, "cache"):
+        model.cache = None  # measure the model, not the score cache
+    windows = load_windows(args.log_file, args.windows)
+    explain = not args.score_only
+    model.infer_batch(windows[:8])  # warm-up
+
+    print(f"{'batch':>6} {'windows/s':>10} {'ms/window':>10}")
+    for batch_size in args.batch_sizes:
+        start = time.perf_counter()
+        if batch_size == 1:
+            for w in windows:
+                model.infer(w, explain=explain)
+        else:
+            model.infer_batch(windows, batch_size=batch_size, explain=explain)
+        elapsed = time.perf_counter() - start
+        print(f"{batch_size:>6} {len(windows) / elapsed:>10.1f} {1000 * elapsed / len(windows):>10.2f}")
+
+
+def resident_mb() -> float:
+    """Current resident set size of this process, in MB."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _score_corpus(precision: str, windows: List[List[str]], batch_size: int) -> dict:
+    # runs in a fresh process so resident memory belongs to one model only
+    from infer import LogBERTInference
+
+    model = LogBERTInference(precision=precision)
+    model.cache = None
+    model.infer_batch(windows[:batch_size], batch_size=batch_size, explain=False)  # warm-up
+    start = time.perf_counter()
+    results = model.infer_batch(windows, batch_size=batch_size, explain=False)
+    elapsed = time.perf_counter() - start
+    return {
+        "precision": model.precision,
+        "scores": [r["score"] for r in results],
+        "seconds": elapsed,
+        "rss_mb": resident_mb(),
+    }
+
+
+def bench_precision(args):
+    windows = load_windows(args.log_file, args.windows)
+    runs = {}
+    for precision in ("fp32", args.mode):
+        with ProcessPoolExecutor(max_workers=1, mp_context=mp.get_context("spawn")) as pool:
+            runs[precision] = pool.submit(_score_corpus, precision, windows, args.batch_size).result()
+
+    print(f"{'mode':>6} {'loaded':>7} {'ms/window':>10} {'windows/s':>10} {'rss_mb':>8}")
+    for mode, run in runs.items():
+        print(f"{mode:>6} {run['precision']:>7} {1000 * run['seconds'] / len(windows):>10.2f} "
+              f"{len(windows) / run['seconds']:>10.1f} {run['rss_mb']:>8.0f}")
+
+    base, reduced = runs["fp32"]["scores"], runs[args.mode]["scores"]
+    drift = sorted(abs(a - b) for a, b in zip(base, reduced))
+    flips = sum((a > args.threshold) != (b > args.threshold) for a, b in zip(base, reduced))
+    print(f"score drift: mean {sum(drift) / len(drift):.5f}, p99 {drift[int(0.99 * (len(drift) - 1))]:.5f}, "
+          f"max {drift[-1]:.5f}")
+    print(f"decision flips at threshold {args.threshold:.3f}: {flips}/{len(windows)} "
+          f"({100 * flips / len(windows):.2f}%)")
+
+
+def bench_pool(args):
+    from infer import LogBERTInference
+    from worker_pool import InferencePool
+
+    windows = load_windows(args.log_file, args.windows)
+    model = LogBERTInference()
+    print(f"{'workers':>7} {'windows/s':>10} {'speedup':>8}")
+    base = None
+    for n_workers in args.workers:
+        with InferencePool(n_workers=n_workers, model=model, batch_size=args.batch_size) as pool:
+            pool.map("warmup", windows[:n_workers * args.batch_size], chunk_size=args.batch_size)
+            start = time.perf_counter()
+            pool.map("bench", windows, chunk_size=args.batch_size)
+            rate = len(windows) / (time.perf_counter() - start)
+        base = base or rate
+        print(f"{n_workers:>7} {rate:>10.1f} {rate / base:>7.2f}x")
+
+
+_FIRST_SCORE = """
+import time
+t0 = time.perf_counter()
+from infer import LogBERTInference
+t1 = time.perf_counter()
+model = LogBERTInference()
+t2 = time.perf_counter()
+model.infer(["[ERROR] timeout on db retry"], explain=False)
+t3 = time.perf_counter()
+print(t1 - t0, t2 - t1, t3 - t2)
+"""
+
+
+def _run_timed(code: str) -> List[float]:
+    # every measurement runs in a fresh interpreter, so nothing is warm
+    out = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True).stdout
+    return [float(x) for x in out.strip().splitlines()[-1].split()]
+
+
+def bench_startup(args):
+    print(f"{'import':>18} {'median_ms':>10} {'max_ms':>8}")
+    for module in args.modules:
+        code = f"import time; t = time.perf_counter(); import {module}; print(time.perf_counter() - t)"
+        times = [_run_timed(code)[0] for _ in range(args.repeat)]
+        print(f"{module:>18} {1000 * statistics.median(times):>10.1f} {1000 * max(times):>8.1f}")
+
+    runs = [_run_timed(_FIRST_SCORE) for _ in range(args.repeat)]
+    print(f"first score: import {1000 * statistics.median(r[0] for r in runs):.1f} ms, "
+          f"construct {1000 * statistics.median(r[1] for r in runs):.1f} ms, "
+          f"load + first infer {1000 * statistics.median(r[2] for r in runs):.1f} ms")
+
+
+def bench_knn(args):
+    import os
+    import tempfile
+    import numpy as np
+    from knn_scorer import NormalWindowIndex
+
+    # clustered synthetic embeddings: normal windows repeat a limited set of shapes
+    rng = np.random.default_rng(0)
+    centers = rng.standard_normal((args.clusters, args.dim)).astype(np.float32)
+    ref = centers[rng.integers(0, args.clusters, args.vectors)]
+    ref += 0.3 * rng.standard_normal(ref.shape).astype(np.float32)
+    queries = centers[rng.integers(0, args.clusters, args.queries)]
+    queries += 0.3 * rng.standard_normal(queries.shape).astype(np.float32)
+    outliers = rng.standard_normal((args.queries, args.dim)).astype(np.float32)
+
+    index = NormalWindowIndex(max_vectors=args.max_vectors)
+    start = time.perf_counter()
+    for chunk in np.array_split(ref, 10):
+        index.add(chunk)
+    index.calibrate()
+    print(f"build: {len(index)} vectors, {index.nbytes / 2**20:.1f} MB, {time.perf_counter() - start:.2f} s")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "knn.npy")
+        start = time.perf_counter()
+        index.save(path)
+        saved = time.perf_counter() - start
+        start = time.perf_counter()
+        loaded = NormalWindowIndex.load(path)
+        loaded.calibrate()
+        print(f"persist: save {1000 * saved:.1f} ms, load + calibrate {1000 * (time.perf_counter() - start):.1f} ms")
+
+    start = time.perf_counter()
+    for q in queries[:100]:
+        index.score(q[None, :])
+    single = (time.perf_counter() - start) / 100
+    start = time.perf_counter()
+    normal_scores = index.score(queries)
+    batched = (time.perf_counter() - start) / len(queries)
+    outlier_scores = index.score(outliers)
+    print(f"query: {1000 * single:.2f} ms single, {1000 * batched:.3f} ms/query batched")
+    print(f"score: normal median {np.median(normal_scores):.3f}, outlier median {np.median(outlier_scores):.3f}")
+
+    if not args.seed_lines:
+        return
+    # seeded from feedback, the very windows it was built from must score as normal
+    import json
+    from infer import LogBERTInference
+    from knn_scorer import build_from_feedback
+    from log_record import parse_line
+    from store_feedback import FeedbackStore
+
+    lines = [json.dumps({"timestamp": 1700000000 + i, "level": "INFO", "source": "app",
+                         "log": f"request {i} served in {i % 97} ms"}) for i in range(args.seed_lines)]
+    engine = LogBERTInference()
+    engine.cache = None
+    if engine.has_classifier:
+        print("seed: skipped, the model has a classifier head")
+        return
+    with tempfile.TemporaryDirectory() as tmp:
+        store = FeedbackStore(db_path=os.path.join(tmp, "feedback.db"))
+        for line in lines:
+            store.add_feedback(0, line, 0.0, False)
+        store.flush()
+        engine.knn_index = build_from_feedback(engine, store)
+        store.close()
+    scores = [r["score"] for r in engine.infer_batch([[parse_line(line)] for line in lines], explain=False)]
+    print(f"seed: {len(lines)} JSONL lines labelled normal, their own windows score median {np.median(scores):.3f}, "
+          f"max {max(scores):.3f}")
+
+
+def bench_tail(args):
+    import os
+    import tempfile
+    import threading
+    from fetch_logs import FileTailer
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "app.log")
+        with open(path, "w") as f:
+            for i in range(args.lines):
+                f.write(f"[INFO] request {i} served in {i % 97} ms\n")
+
+        # bulk throughput: read the whole file from the start
+        seen, start = 0, time.perf_counter()
+        for batch in FileTailer(path, from_start=True).batches():
+            seen += len(batch)
+            if seen >= args.lines:
+                break
+        elapsed = time.perf_counter() - start
+        print(f"bulk: {seen / elapsed:,.0f} lines/s")
+
+        # wake-up latency: time from append to the line being yielded
+        stamps = []
+
+        def writer():
+            time.sleep(0.2)
+            for _ in range(args.probes):
+                with open(path, "a") as f:
+                    f.write(f"probe {time.perf_counter()}\n")
+                time.sleep(0.05)
+
+        threading.Thread(target=writer, daemon=True).start()
+        for line in FileTailer(path, poll_interval=0.5).lines():
+            stamps.append(time.perf_counter() - float(line.split()[1]))
+            if len(stamps) >= args.probes:
+                break
+        print(f"latency: median {1000 * statistics.median(stamps):.2f} ms, max {1000 * max(stamps):.2f} ms")
+
+        # GlobSource: a file created between rescans and a restarted tailer must not lose lines
+        import asyncio
+        from ingest import GlobSource, Ingestor
+
+        first, later = os.path.join(tmp, "glob-a.log"), os.path.join(tmp, "glob-b.log")
+        open(first, "w").close()
+
+        async def rescans():
+            got = []
+            source = GlobSource(os.path.join(tmp, "glob-*.log"), rescan=0.2, poll_interval=0.05)
+
+            async def consume():
+                async for rec in Ingestor().add(source).stream():
+                    got.append(rec.line)
+
+            consumer = asyncio.create_task(consume())
+            await asyncio.sleep(0.1)
+            with open(later, "w") as f:
+                f.write("b 0\nb 1\nb 2\n")  # written before the next rescan finds the file
+            await asyncio.sleep(0.5)
+            with open(first, "a") as f:
+                f.write("a 0\n")
+            await asyncio.sleep(0.3)
+            source._tasks[first].cancel()  # the tailer dies; the next rescan restarts it
+            await asyncio.sleep(0.05)
+            with open(first, "a") as f:
+                f.write("a 1\n")
+            await asyncio.sleep(0.6)
+            consumer.cancel()
+            await asyncio.gather(consumer, return_exceptions=True)
+            return got
+
+        got = asyncio.run(rescans())
+        print(f"rescan: {sum(line.startswith('b') for line in got)}/3 lines of a file created between rescans, "
+              f"{sum(line.startswith('a') for line in got)}/2 lines around a tailer restart, "
+              f"{len(got) - len(set(got))} duplicates")
+
+
+def bench_drain(args):
+    from template_extracter import DrainWrapper
+
+    if args.log_file:
+        with open(args.log_file) as f:
+            lines = [line.rstrip("\n") for line in f if line.strip()]
+    else:
+        # a few hundred templates of 8-20 words, each with 1-3 numeric/IP/path fields
+        rng = random.Random(0)
+        words = [f"w{i}" for i in range(2000)]
+        fields = [lambda: str(rng.randint(0, 99999)), lambda: f"10.{rng.randint(0, 255)}.{rng.randint(0, 255)}.7",
+                  lambda: f"/var/data/{rng.randint(0, 999)}.log", lambda: f"{rng.random():.4f}"]
+        shapes = []
+        for _ in range(args.templates):
+            text = rng.sample(words, rng.randint(8, 20))
+            slots = rng.sample(range(1, len(text)), rng.randint(1, 3))
+            shapes.append((text, {i: rng.choice(fields) for i in slots}))
+        lines = []
+        for _ in range(args.lines):
+            text, slots = rng.choice(shapes)
+            lines.append(" ".join(slots[i]() if i in slots else w for i, w in enumerate(text)))
+
+    results = {}
+    for size in (0, args.cache_size):
+        drain = DrainWrapper(depth=config.DRAIN_DEPTH, sim_threshold=config.DRAIN_SIMILARITY, cache_size=size,
+                             snapshot_path="")
+        start = time.perf_counter()
+        results[size] = [drain.add_log_line(line) for line in lines]
+        elapsed = time.perf_counter() - start
+        label = "cache" if size else "drain only"
+        print(f"{label}: {len(lines) / elapsed:,.0f} lines/s, {len(drain.miner.drain.clusters)} clusters")
+        if drain.cache is not None:
+            print(f"  {drain.cache.stats()}")
+    diff = sum(a != b for a, b in zip(results[0], results[args.cache_size]))
+    print(f"lines with a different (template, id): {diff}")
+
+    # equivalence under churn: shapes over a small shared vocabulary, with numbers at any
+    # position (first token included) and a new shape every ~20 lines, so leaves keep
+    # gaining clusters and widening templates
+    rng = random.Random(1)
+    vocab = ["alpha", "beta", "gamma", "delta", "eps", "theta", "kappa", "lambda"]
+    churn_shapes, churn = [], []
+    for _ in range(args.churn_lines):
+        if not churn_shapes or rng.random() < 0.05:
+            text = [rng.choice(vocab) for _ in range(rng.randint(4, 7))]
+            churn_shapes.append((text, set(rng.sample(range(len(text)), rng.randint(1, 2)))))
+        text, slots = rng.choice(churn_shapes)
+        churn.append(" ".join(str(rng.randint(0, 999)) if i in slots else w for i, w in enumerate(text)))
+    churn += ["7 alpha eps delta 9 beta", "theta alpha eps delta eps beta"]
+    churned = {}
+    for size in (0, args.cache_size):
+        drain = DrainWrapper(depth=config.DRAIN_DEPTH, sim_threshold=config.DRAIN_SIMILARITY, cache_size=size,
+                             snapshot_path="")
+        churned[size] = [drain.add_log_line(line) for line in churn]
+    diff = sum(a != b for a, b in zip(churned[0], churned[args.cache_size]))
+    print(f"churn corpus ({len(churn):,} lines, {len(set(t for _, t in churned[0]))} clusters): "
+          f"{diff} lines differ from cache_size=0 with the cache")
+
+    for shards in args.shards:
+        drain = DrainWrapper(depth=config.DRAIN_DEPTH, sim_threshold=config.DRAIN_SIMILARITY,
+                             cache_size=args.cache_size, snapshot_path="", shards=shards)
+        start = time.perf_counter()
+        mined = []
+        for i in range(0, len(lines), args.batch):
+            mined.extend(drain.add_log_lines(lines[i:i + args.batch]))
+        elapsed = time.perf_counter() - start
+        drain.close()
+        drain = DrainWrapper(depth=config.DRAIN_DEPTH, sim_threshold=config.DRAIN_SIMILARITY,
+                             cache_size=args.cache_size, snapshot_path="", shards=shards)
+        churn_mined = []
+        for i in range(0, len(churn), args.batch):
+            churn_mined.extend(drain.add_log_lines(churn[i:i + args.batch]))
+        drain.close()
+        diff = sum(a[1] != b[1] for a, b in zip(mined, results[args.cache_size]))
+        churn_diff = sum(a != b for a, b in zip(churn_mined, churned[0]))
+        print(f"{shards} shards: {len(lines) / elapsed:,.0f} lines/s, {diff} lines with a different ID, "
+              f"{churn_diff} churn lines with a different (template, id)")
+
+
+def bench_snapshot(args):
+    import os
+    import tempfile
+    from drain3 import TemplateMiner
+    from template_extracter import AtomicFilePersistence, DrainWrapper
+
+    # Drain's leaves are keyed by (token count, first token); spreading lines over many leaves
+    # keeps building fast, and otherwise-unique words keep every line in its own cluster
+    def name(i):
+        out = ""
+        while True:
+            out += chr(97 + i % 26)
+            i //= 26
+            if not i:
+                return out
+
+    lines = []
+    for i in range(args.clusters):
+        length = 3 + i % 40
+        words = [name(i // 40 % 90)] + [name(1000 + i * 50 + j) for j in range(length - 1)]
+        lines.append(" ".join(words))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "drain.bin")
+        drain = DrainWrapper(cache_size=0, snapshot_path=path)
+        drain.miner.every_changes = len(lines) + 1  # one snapshot, taken below
+        ids = [drain.add_log_line(line)[1] for line in lines]
+        n = len(drain.miner.drain.clusters)
+
+        start = time.perf_counter()
+        drain.save_snapshot()
+        saved = time.perf_counter() - start
+        size = os.path.getsize(path)
+        start = time.perf_counter()
+        restored = DrainWrapper(cache_size=0, snapshot_path=path)
+        loaded = time.perf_counter() - start
+        same = sum(restored.add_log_line(line)[1] == tid for line, tid in zip(lines, ids))
+        print(f"snapshot: {n} clusters, {size / 2**20:.1f} MB, save {1000 * saved:.0f} ms, "
+              f"restore {1000 * loaded:.0f} ms, {same}/{len(lines)} IDs preserved")
+
+        # stock drain3 format (jsonpickle + base64) for comparison
+        stock_path = os.path.join(tmp, "drain.json")
+        drain.miner.persistence_handler = AtomicFilePersistence(stock_path)
+        drain.miner.config.snapshot_compress_state = True
+        start = time.perf_counter()
+        TemplateMiner.save_state(drain.miner, "benchmark")
+        saved = time.perf_counter() - start
+        size = os.path.getsize(stock_path)
+        start = time.perf_counter()
+        TemplateMiner(AtomicFilePersistence(stock_path), config=drain.miner.config)
+        loaded = time.perf_counter() - start
+        print(f"drain3 jsonpickle: {size / 2**20:.1f} MB, save {1000 * saved:.0f} ms, restore {1000 * loaded:.0f} ms")
+
+        # a few unsaved changes followed only by template cache hits must still be saved on time
+        path = os.path.join(tmp, "hits.bin")
+        drain = DrainWrapper(snapshot_path=path)
+        drain.miner.every_seconds = 0.2
+        for line in ("user 1 logged in", "user 2 logged in"):  # created, then widened to "user <*> logged in"
+            drain.add_log_line(line)
+        time.sleep(0.3)
+        for i in range(1000):
+            drain.add_log_line(f"user {i} logged in")
+        print(f"after {drain.cache.hits} cache hits past DRAIN_SNAPSHOT_SECONDS: "
+              f"snapshot {'written' if os.path.exists(path) else 'MISSING'}")
+
+
+def bench_window(args):
+    import gc
+    import tracemalloc
+    from collections import deque
+    from datetime import datetime, timedelta
+    from compact_window import CompactLog
+
+    # raw lines and templates exist either way; only the per-line and per-window structures are measured
+    base = datetime(2024, 1, 1)
+    templates = [f"template {i} <*>" for i in range(200)]
+    raw = [f"line {i}" for i in range(args.lines)]
+    mined = [(str(i % 200), templates[i % 200]) for i in range(args.lines)]
+    stamps = [(base + timedelta(seconds=i)).isoformat() for i in range(args.lines)]
+
+    def tuples_then_list(n):
+        # the previous layout: fresh (ts, template, "id", raw) tuples in a deque, copied out per window
+        buf, windows = deque(), []
+        for i in range(n):
+            tid, template = mined[i]
+            buf.append((stamps[i][:], template, str(int(tid)), raw[i]))
+            if len(buf) > config.SEQUENCE_LENGTH:
+                for _ in range(config.SLIDING_STEP):
+                    buf.popleft()
+            if len(buf) == config.SEQUENCE_LENGTH:
+                windows.append(list(buf))
+        return buf, windows
+
+    def compact(n):
+        log, fill, windows = CompactLog(config.SEQUENCE_LENGTH), 0, []
+        for i in range(n):
+            tid, template = mined[i]
+            log.append((stamps[i], template, tid, raw[i]))
+            fill += 1
+            if fill > config.SEQUENCE_LENGTH:
+                fill -= config.SLIDING_STEP
+            if fill == config.SEQUENCE_LENGTH:
+                windows.append(log.last(fill))
+        return log, windows
+
+    for name, fn in (("list of tuples", tuples_then_list), ("compact", compact)):
+        gc.collect()
+        tracemalloc.start()
+        store, windows = fn(args.lines)
+        total = tracemalloc.get_traced_memory()[0]
+        del windows
+        gc.collect()
+        buffered = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        per_line = buffered / (store.block_size if name == "compact" else config.SEQUENCE_LENGTH)
+        per_window = (total - buffered) / max(1, (args.lines - config.SEQUENCE_LENGTH) // config.SLIDING_STEP + 1)
+        del store
+        start = time.perf_counter()
+        fn(args.lines)
+        elapsed = time.perf_counter() - start
+        print(f"{name}: {per_line:,.1f} B per buffered line, {per_window:,.0f} B per retained window, "
+              f"{1e9 * elapsed / args.lines:,.0f} ns per line")
+
+
+def bench_session(args):
+    import tracemalloc
+    from collections import defaultdict, deque
+    from seq_generator import SessionWindows
+
+    # sessions arrive in overlapping waves and go quiet; time advances 1 ms per line
+    rng = random.Random(0)
+    lines = []
+    for i in range(args.lines):
+        wave = i * args.sessions // args.lines
+        lines.append((i / 1000.0, f"s{wave + rng.randint(0, 50)}"))
+
+    def unbounded():
+        # the previous behaviour: one deque per session, never pruned, re-emitted on every line
+        sessions, scored = defaultdict(deque), 0
+        for _, sid in lines:
+            sessions[sid].append(sid)
+            if len(sessions[sid]) >= config.SEQUENCE_LENGTH:
+                scored += len(sessions[sid])
+        return sessions, scored
+
+    def bounded():
+        tracker, scored = SessionWindows(idle_seconds=args.idle), 0
+        for now, sid in lines:
+            window = tracker.add(sid, sid, now)
+            scored += len(window) if window else 0
+            scored += sum(len(w) for w in tracker.pop_closed())
+        scored += sum(len(w) for w in tracker.close_all())
+        return tracker, scored
+
+    for name, fn in (("unbounded", unbounded), ("bounded", bounded)):
+        start = time.perf_counter()
+        _, scored = fn()
+        elapsed = time.perf_counter() - start
+        tracemalloc.start()
+        fn()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print(f"{name}: {scored / len(lines):,.1f} lines scored per input line, "
+              f"peak {peak / 2**20:,.1f} MB, {1e9 * elapsed / len(lines):,.0f} ns per line")
+
+    # one full SESSION_MAX_LENGTH segment must fit the model, or its last lines are never scored
+    from infer import LogBERTInference
+    from log_record import parse_line
+    from template_extracter import DrainWrapper
+
+    with open(args.log_file) as f:
+        records = [parse_line(line.strip()) for line in f if line.strip()]
+    records = DrainWrapper().add_records(records)
+    tracker, segment = SessionWindows(idle_seconds=float("inf")), None
+    for i, record in enumerate(records):
+        segment = tracker.add("s", record, float(i))
+        if segment:
+            break
+    model = LogBERTInference()
+    model.cache = None
+    result = model.infer_batch([segment], explain=False)[0]
+    seen = max(k for k in range(1, len(segment) + 1)
+               if len(model.tokenizer(model.sequence_to_text(segment[:k]))["input_ids"]) <= model.max_length)
+    print(f"full segment: {len(segment)} lines, {len(result['tokens'])} of max {model.max_length} tokens, "
+          f"{seen} lines fully seen by the model, score {result['score']:.3f}")
+
+
+def bench_timewindow(args):
+    from datetime import datetime, timedelta
+    from seq_generator import EventTimeWindows, SequenceWindow
+
+    # a replayed stretch of logs: ISO timestamps, arrivals shuffled by up to `--jitter` seconds
+    rng = random.Random(0)
+    start_ts = datetime(2024, 1, 1)
+    n = int(args.hours * 3600 * args.rate)
+    stamps = sorted(rng.uniform(0, args.hours * 3600) for _ in range(n))
+    arrival = sorted(range(n), key=lambda i: stamps[i] + rng.uniform(0, args.jitter))
+    records = [((start_ts + timedelta(seconds=stamps[i])).isoformat(), "template", "1", f"line {i}") for i in arrival]
+
+    config.WINDOW_TYPE = "time"
+    window = SequenceWindow()
+    window.times = EventTimeWindows(size=args.window, slide=args.slide, lateness=args.lateness)
+    emitted = 0
+    begin = time.perf_counter()
+    for rec in records:
+        emitted += window.add_log(rec) is not None
+        emitted += len(window.pop_closed())
+    emitted += len(window.close())
+    elapsed = time.perf_counter() - begin
+    print(f"{args.hours:g} h of logs ({n:,} lines) in {elapsed:.2f} s: {emitted:,} windows, "
+          f"{window.times.late:,} late lines dropped, {n / elapsed:,.0f} lines/s")
+
+
+def bench_parse(args):
+    import json
+    import re
+    from keyword_check import DEFAULT_KEYWORDS, RulesEngine
+    from infer import LogBERTInference
+    from log_record import parse_line, to_epoch
+
+    rng = random.Random(0)
+    levels = ["INFO", "WARN", "ERROR", "CRITICAL"]
+    lines = [json.dumps({"timestamp": f"2024-01-01T00:{i // 60 % 60:02d}:{i % 60:02d}",
+                         "session_id": f"s{rng.randint(0, 999)}",
+                         "log": f"[{rng.choice(levels)}] request {rng.randint(1, 10**6)} took {rng.randint(1, 900)} ms"})
+             for i in range(args.lines)]
+    encoder = LogBERTInference.__new__(LogBERTInference)  # sequence_to_text only, no model
+    rules = RulesEngine()
+
+    def old_session(line):
+        # the previous SequenceWindow.extract_session_id on the raw JSONL line
+        if line.strip().startswith("{"):
+            try:
+                return json.loads(line).get("session_id", "unknown")
+            except json.JSONDecodeError:
+                pass
+        match = re.search(r"session[_=]([A-Za-z0-9_-]+)", line)
+        return match.group(1) if match else "unknown"
+
+    def old_check(text):
+        text = text.lower()
+        return any(kw.lower() in text for kw in DEFAULT_KEYWORDS)
+
+    def per_line_parsing():
+        # every stage re-derives what it needs from the line
+        window, hits = [], 0
+        for line in lines:
+            obj = json.loads(line)
+            msg = obj.get("log", line)
+            ts = to_epoch(str(obj.get("timestamp", "")))
+            old_session(line)
+            hits += old_check(msg)
+            window.append(msg)
+            if len(window) == config.SEQUENCE_LENGTH:
+                encoder.sequence_to_text(window)
+                del window[:config.SLIDING_STEP]
+        return hits
+
+    def parse_once():
+        window, hits = [], 0
+        for line in lines:
+            record = parse_line(line)
+            record.session
+            hits += rules.check(record)
+            window.append(record)
+            if len(window) == config.SEQUENCE_LENGTH:
+                encoder.sequence_to_text(window)
+                del window[:config.SLIDING_STEP]
+        return hits
+
+    for name, fn in (("per-stage parsing", per_line_parsing), ("parse once", parse_once)):
+        start = time.perf_counter()
+        hits = fn()
+        elapsed = time.perf_counter() - start
+        print(f"{name}: {args.lines / elapsed:,.0f} lines/s ({1e9 * elapsed / args.lines:,.0f} ns per line), "
+              f"{hits:,} rule hits")
+
+
+def bench_threshold(args):
+    import contextlib
+    import io
+    import os
+    import sqlite3
+    import tempfile
+    from store_feedback import FeedbackStore
+
+    def old_compute(rows):
+        # the previous FeedbackStore.compute_threshold: every cut rescans every row
+        rows = sorted(rows)
+        best, best_j = config.ANOMALY_THRESHOLD, -1.0
+        for cut in set(r[0] for r in rows):
+            tp = sum(1 for s, l in rows if s >= cut and l == 1)
+            fn = sum(1 for s, l in rows if s < cut and l == 1)
+            fp = sum(1 for s, l in rows if s >= cut and l == 0)
+            tn = sum(1 for s, l in rows if s < cut and l == 0)
+            j = (tp / (tp + fn) if tp + fn else 0.0) - (fp / (fp + tn) if fp + tn else 0.0)
+            if j > best_j:
+                best_j, best = j, cut
+        return best
+
+    # anomalies score higher on average; scores rounded like a float32 softmax output would repeat
+    rng = random.Random(0)
+    rows = []
+    for _ in range(args.rows):
+        label = int(rng.random() < 0.05)
+        rows.append((round(min(1.0, max(0.0, rng.gauss(0.8 if label else 0.4, 0.15))), 6), label))
+
+    with tempfile.TemporaryDirectory() as tmp, contextlib.redirect_stdout(io.StringIO()):
+        path = os.path.join(tmp, "feedback.db")
+        FeedbackStore(path).close()
+        conn = sqlite3.connect(path)
+        conn.executemany("INSERT INTO feedback (timestamp, sequence_text, score, is_true_anomaly) VALUES (0, '', ?, ?)", rows)
+        conn.commit()
+        conn.close()
+
+        start = time.perf_counter()
+        store = FeedbackStore(path, bins=args.bins)
+        load_s = time.perf_counter() - start
+        start = time.perf_counter()
+        first = store.threshold()
+        first_s = time.perf_counter() - start
+        start = time.perf_counter()
+        for _ in range(args.updates):
+            store.youden.add(rng.random(), int(rng.random() < 0.05))
+            store.threshold()
+        update_s = (time.perf_counter() - start) / args.updates
+        start = time.perf_counter()
+        for _ in range(100000):
+            store.threshold()
+        read_s = (time.perf_counter() - start) / 100000
+
+        sample = rows[:args.old_rows]
+        start = time.perf_counter()
+        old = old_compute(sample)
+        old_s = time.perf_counter() - start
+        new = FeedbackStore(os.path.join(tmp, "sample.db"), bins=args.bins)
+        for score, label in sample:
+            new.youden.add(score, label)
+        same = new.threshold() == old
+
+        # per-template / per-source thresholds: the same rows spread over groups
+        path = os.path.join(tmp, "grouped.db")
+        FeedbackStore(path).close()
+        conn = sqlite3.connect(path)
+        conn.executemany("INSERT INTO feedback (timestamp, sequence_text, score, is_true_anomaly, template_id, source) "
+                         "VALUES (0, '', ?, ?, ?, ?)",
+                         ((s, l, str(rng.randint(1, args.templates)), f"src{rng.randint(1, args.sources)}") for s, l in rows))
+        conn.commit()
+        conn.close()
+        start = time.perf_counter()
+        grouped = FeedbackStore(path, bins=args.bins)
+        grouped_load_s = time.perf_counter() - start
+        start = time.perf_counter()
+        for _ in range(args.updates):
+            tid = str(rng.randint(1, args.templates))
+            grouped.add_feedback(0, "", rng.random(), rng.random() < 0.05, template_id=tid, source="src1")
+            grouped.threshold_for(tid, "src1")
+        grouped_update_s = (time.perf_counter() - start) / args.updates
+        start = time.perf_counter()
+        for i in range(100000):
+            grouped.threshold_for(str(i % args.templates), "src1")
+        lookup_s = (time.perf_counter() - start) / 100000
+        grouped.close()
+
+    print(f"{args.rows:,} labelled rows ({len(store.youden):,} distinct scores, bins={args.bins}): "
+          f"startup scan {load_s:.2f} s, first compute {1e3 * first_s:.0f} ms -> {first:.4f}")
+    print(f"recompute after one new label {1e3 * update_s:.1f} ms, cached read {1e9 * read_s:.0f} ns")
+    print(f"old compute_threshold on {len(sample):,} rows: {old_s:.2f} s "
+          f"(O(n*d), so about {old_s * (args.rows / len(sample)) ** 2 / 3600:,.0f} h at {args.rows:,})"
+          + (f"; same cut as the new one: {same}" if not args.bins else ""))
+    print(f"grouped over {args.templates} templates x {args.sources} sources: startup pass {grouped_load_s:.2f} s "
+          f"({len(grouped.group_thresholds):,} group thresholds), label + refresh of its groups "
+          f"{1e3 * grouped_update_s:.1f} ms, threshold_for {1e9 * lookup_s:.0f} ns")
+
+
+def bench_feedback(args):
+    import os
+    import sqlite3
+    import tempfile
+    from store_feedback import FeedbackStore
+
+    rng = random.Random(0)
+    rows = [(i, f"[TID:{rng.randint(1, 500)}] request took <*> ms", rng.random(), None) for i in range(args.rows)]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # the previous add_feedback: one INSERT and one commit per row, rollback journal
+        conn = sqlite3.connect(os.path.join(tmp, "sync.db"), check_same_thread=False)
+        conn.execute("CREATE TABLE feedback (id INTEGER PRIMARY KEY AUTOINCREMENT, timestamp INTEGER, "
+                     "sequence_text TEXT, score REAL, is_true_anomaly INTEGER)")
+        sync_rows = rows[:args.sync_rows]
+        start = time.perf_counter()
+        for ts, text, score, label in sync_rows:
+            conn.execute("INSERT INTO feedback (timestamp, sequence_text, score, is_true_anomaly) VALUES (?, ?, ?, ?)",
+                         (ts, text, score, int(bool(label))))
+            conn.commit()
+        sync_s = time.perf_counter() - start
+        conn.close()
+
+        store = FeedbackStore(os.path.join(tmp, "feedback.db"))
+        latencies = []
+        start = time.perf_counter()
+        for row in rows:
+            t0 = time.perf_counter()
+            store.add_feedback(*row)
+            latencies.append(time.perf_counter() - t0)
+        enqueue_s = time.perf_counter() - start
+        store.flush()
+        total_s = time.perf_counter() - start
+        stored = store.reader().execute("SELECT COUNT(*) FROM feedback").fetchone()[0]
+        store.close()
+
+    latencies.sort()
+    p50, p99 = latencies[len(latencies) // 2], latencies[int(len(latencies) * 0.99)]
+    print(f"commit per row: {len(sync_rows) / sync_s:,.0f} rows/s ({len(sync_rows):,} rows)")
+    print(f"write-behind:   {args.rows / total_s:,.0f} rows/s committed ({stored:,} rows in "
+          f"{store.writer.batches:,} transactions); add_feedback {args.rows / enqueue_s:,.0f} calls/s, "
+          f"p50 {1e6 * p50:.1f} us, p99 {1e6 * p99:.1f} us")
+
+
+def bench_retention(args):
+    import os
+    import tempfile
+    from store_feedback import FeedbackStore
+
+    # simulated days of traffic: windows from a pool of repeating texts, a few of them labelled
+    rng = random.Random(0)
+    texts = [f"[TID:{i}] request took <*> ms <sep> [TID:{i + 1}] cache miss for <*>" for i in range(args.texts)]
+    start_ts = 1_700_000_000
+
+    def run(retention: float):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "feedback.db")
+            store = FeedbackStore(path, retention=retention, prune_interval=1e9)
+            report = []
+            for day in range(args.days):
+                for i in range(args.rows_per_day):
+                    ts = start_ts + day * 86400 + i * 86400 / args.rows_per_day
+                    label = (rng.random() < 0.5) if rng.random() < args.labelled else None
+                    store.add_feedback(ts, rng.choice(texts), rng.random(), label, source=f"src{i % 4}")
+                now = start_ts + (day + 1) * 86400
+                store.flush()
+                prune_s = time.perf_counter()
+                if retention:
+                    store.retention.run_once(now=now)
+                    store.flush()
+                prune_s = time.perf_counter() - prune_s
+                if (day + 1) % 7 == 0 or day + 1 == args.days:
+                    size = sum(os.path.getsize(path + ext) for ext in ("", "-wal") if os.path.exists(path + ext))
+                    q = time.perf_counter()
+                    store.score_histogram(now - 3600, now)
+                    hist_ms = 1e3 * (time.perf_counter() - q)
+                    q = time.perf_counter()
+                    FeedbackStore(path, retention=0).close()
+                    open_s = time.perf_counter() - q
+                    rows = store.reader().execute("SELECT COUNT(*) FROM feedback").fetchone()[0]
+                    report.append((day + 1, size, rows, hist_ms, open_s, prune_s))
+            store.close()
+            return report
+
+    for name, retention in (("keep everything", 0), (f"retention {args.horizon_days:g} d", args.horizon_days * 86400)):
+        print(f"{name}:")
+        for day, size, rows, hist_ms, open_s, prune_s in run(retention):
+            print(f"  day {day:3d}: {size / 2**20:7.1f} MB, {rows:,} raw rows, last-hour histogram {hist_ms:.1f} ms, "
+                  f"store startup {open_s:.2f} s, day's prune {prune_s:.2f} s")
+
+
+def _standin_servers(delay: float, fail_rate: float):
+    """Local webhook (HTTP/1.1 keep-alive) and SMTP stand-ins that count connections and deliveries."""
+    import socketserver
+    import threading
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    counts = {"http_connections": 0, "http_requests": 0, "smtp_connections": 0, "smtp_messages": 0}
+    rng = random.Random(0)
+    lock = threading.Lock()
+
+    def bump(key):
+        with lock:
+            counts[key] += 1
+
+    class Webhook(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        wbufsize = 1 << 16  # headers and body in one write, or keep-alive clients stall on delayed ACKs
+        disable_nagle_algorithm = True
+
+        def setup(self):
+            super().setup()
+            bump("http_connections")
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            time.sleep(delay)
+            status = 503 if rng.random() < fail_rate else 200
+            if status == 200:
+                bump("http_requests")
+            self.send_response(status)
+            self.send_header("Content-Length", "2")
+            self.end_headers()
+            self.wfile.write(b"ok")
+
+        def log_message(self, *args):
+            pass
+
+    class Smtp(socketserver.StreamRequestHandler):
+        def handle(self):
+            bump("smtp_connections")
+            self.wfile.write(b"220 standin\r\n")
+            for line in self.rfile:
+                cmd = line[:4].upper()
+                if cmd == b"DATA":
+                    self.wfile.write(b"354 go ahead\r\n")
+                    for body in self.rfile:
+                        if body == b".\r\n":
+                            break
+                    time.sleep(delay)
+                    bump("smtp_messages")
+                    self.wfile.write(b"250 queued\r\n")
+                elif cmd == b"QUIT":
+                    self.wfile.write(b"221 bye\r\n")
+                    return
+                else:
+                    self.wfile.write(b"250 ok\r\n")
+
+    http = ThreadingHTTPServer(("127.0.0.1", 0), Webhook)
+    smtp = socketserver.ThreadingTCPServer(("127.0.0.1", 0), Smtp)
+    http.daemon_threads = smtp.daemon_threads = True
+    for server in (http, smtp):
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+    return http, smtp, counts
+
+
+def bench_alerts(args):
+    import smtplib
+    import tempfile
+    from email.message import EmailMessage
+
+    import requests
+    from Alerting import AlertDispatcher, SmtpChannel, WebhookChannel
+
+    http, smtp, counts = _standin_servers(args.delay_ms / 1e3, args.fail_rate)
+    url = f"http://127.0.0.1:{http.server_address[1]}/hook"
+    smtp_port = smtp.server_address[1]
+    n_mail = args.alerts // 10  # one alert in ten also goes out by email
+
+    # old path: the caller posts each alert and opens an SMTP connection per email
+    blocked = []
+    start = time.perf_counter()
+    for i in range(args.alerts):
+        t = time.perf_counter()
+        try:
+            requests.post(url, json={"text": f"alert {i}"}, timeout=5).raise_for_status()
+        except Exception:
+            pass
+        if i % 10 == 0:
+            msg = EmailMessage()
+            msg["Subject"], msg["From"], msg["To"] = f"alert {i}", "noreply@logbert.local", "ops@example.com"
+            msg.set_content("body")
+            with smtplib.SMTP("127.0.0.1", smtp_port) as s:
+                s.send_message(msg)
+        blocked.append(time.perf_counter() - t)
+    elapsed = time.perf_counter() - start
+    print(f"inline sends:  caller blocked p50 {1e3 * statistics.median(blocked):.2f} ms, "
+          f"p99 {1e3 * sorted(blocked)[int(0.99 * len(blocked))]:.2f} ms; {args.alerts / elapsed:,.0f} alerts/s; "
+          f"{counts['http_connections']} HTTP / {counts['smtp_connections']} SMTP connections")
+
+    for key in counts:
+        counts[key] = 0
+    with tempfile.TemporaryDirectory() as spool:
+        dispatcher = AlertDispatcher(
+            {"slack": WebhookChannel(url), "email": SmtpChannel("127.0.0.1", smtp_port, starttls=False, user="")},
+            queue_size=args.queue_size, backoff=0.05, backoff_max=1.0, spill_dir=spool,
+        )
+        start = time.perf_counter()
+        for i in range(args.alerts):
+            dispatcher.send("slack", {"text": f"alert {i}"})
+            if i % 10 == 0:
+                dispatcher.send("email", {"subject": f"alert {i}", "body": "body", "to": "ops@example.com"})
+        handed_off = time.perf_counter() - start
+        dispatcher.flush()
+        elapsed = time.perf_counter() - start
+        dispatcher.close()
+        print(f"dispatcher:    all {args.alerts + n_mail} alerts handed off in {1e3 * handed_off:.1f} ms, "
+              f"delivered in {elapsed:.2f} s ({args.alerts / elapsed:,.0f} alerts/s); "
+              f"{counts['http_connections']} HTTP / {counts['smtp_connections']} SMTP connections")
+        for name, st in dispatcher.stats().items():
+            print(f"  {name:6s} enqueue p50 {st['enqueue_p50_us']:.1f} us, p99 {st['enqueue_p99_us']:.1f} us | "
+                  f"delivery p50 {st['delivery_p50_ms']:.0f} ms, p99 {st['delivery_p99_ms']:.0f} ms | "
+                  f"sent {st['sent']}, failed attempts {st['failed_attempts']}, dropped {st['dropped']}")
+    http.shutdown()
+    smtp.shutdown()
+
+
+def bench_coalesce(args):
+    from Alerting import AlertAggregator
+
+    # simulated clock: background anomalies all along, an incident of `rate`/min over a few
+    # templates in the middle; the old path kept one timestamp per channel and dropped the rest
+    rng = random.Random(0)
+    minutes, incident = args.minutes, range(args.minutes // 4, args.minutes // 4 + args.incident_minutes)
+    hot = [(f"tids:hot{i}", f"web-{i % 2}") for i in range(args.hot_groups)]
+    events = []
+    for minute in range(minutes):
+        for _ in range(args.background):
+            events.append((minute * 60 + rng.random() * 60, f"tids:bg{rng.randrange(200)}", f"host-{rng.randrange(5)}"))
+        if minute in incident:
+            for _ in range(args.rate):
+                events.append((minute * 60 + rng.random() * 60, *rng.choice(hot)))
+    events.sort()
+
+    digests, messages = [], []
+    agg = AlertAggregator(lambda batch: (messages.append(batch), digests.extend(batch)), start=False)
+    old_sent, old_last = [], -1e9
+    next_tick = 1.0
+    start = time.perf_counter()
+    for ts, fingerprint, source in events:
+        while ts >= next_tick:
+            agg.tick(next_tick)
+            next_tick += 1.0
+        agg.add(fingerprint, source, rng.random(), f"{fingerprint} sample", now=ts)
+        if ts - old_last >= config.ALERT_DIGEST_SECONDS:
+            old_sent.append((fingerprint, source))
+            old_last = ts
+    agg.flush(minutes * 60)
+    per_event = (time.perf_counter() - start) / len(events)
+
+    groups = {(f, s) for _, f, s in events}
+    print(f"{len(events):,} anomalies in {minutes} min ({args.rate:,}/min for {args.incident_minutes} min), "
+          f"{len(groups)} template/source groups")
+    print(f"per-channel cooldown: {len(old_sent)} messages, {len(events) - len(old_sent):,} anomalies dropped, "
+          f"{len(groups - set(old_sent))} groups never reported")
+    spikes = sum(1 for batch in messages if batch[0]["reason"] == "spike")
+    print(f"aggregator:           {len(messages)} messages ({spikes} spike escalations) carrying {len(digests)} group digests, "
+          f"{sum(d['count'] for d in digests):,} anomalies counted, "
+          f"{len(groups - {(d['fingerprint'], d['source']) for d in digests})} groups never reported")
+    print(f"  {agg.stats()['groups']} groups tracked at the end (max {agg.max_groups}), "
+          f"{1e6 * per_event:.1f} us per anomaly")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("batch", help="windows/sec of infer_batch across batch sizes")
+    p.add_argument("--log-file", default="dynamic_logs.txt")
+    p.add_argument("--windows", type=int, default=256)
+    p.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32, 64])
+    p.add_argument("--score-only", action="store_true", help="skip the attention/explanation pass")
+    p.add_argument("--engine", choices=["bert", "embedding"], default="bert")
+    p.set_defaults(func=bench_batch)
+
+    p = sub.add_parser("precision", help="fp32 vs reduced precision: drift, decision flips, latency, memory")
+    p.add_argument("--mode", choices=["int8", "bf16"], default="int8")
+    p.add_argument("--log-file", default="dynamic_logs.txt")
+    p.add_argument("--windows", type=int, default=512)
+    p.add_argument("--batch-size", type=int, default=config.INFER_BATCH_SIZE)
+    p.add_argument("--threshold", type=float, default=config.ANOMALY_THRESHOLD)
+    p.set_defaults(func=bench_precision)
+
+    p = sub.add_parser("pool", help="windows/sec of the multi-process InferencePool across worker counts")
+    p.add_argument("--log-file", default="dynamic_logs.txt")
+    p.add_argument("--windows", type=int, default=1024)
+    p.add_argument("--batch-size", type=int, default=16)
+    p.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    p.set_defaults(func=bench_pool)
+
+    p = sub.add_parser("startup", help="cold import time per module and first-score latency")
+    p.add_argument("--modules", nargs="+",
+                   default=["config", "keyword_check", "store_feedback", "explainer", "infer", "embedding_engine"])
+    p.add_argument("--repeat", type=int, default=5)
+    p.set_defaults(func=bench_startup)
+
+    p = sub.add_parser("knn", help="k-NN normal-window index: build, persistence and query latency")
+    p.add_argument("--vectors", type=int, default=100000)
+    p.add_argument("--max-vectors", type=int, default=config.KNN_MAX_VECTORS)
+    p.add_argument("--dim", type=int, default=768)
+    p.add_argument("--clusters", type=int, default=500)
+    p.add_argument("--queries", type=int, default=1000)
+    p.add_argument("--seed-lines", type=int, default=200, help="feedback rows for the seeding check (needs a model), 0 skips")
+    p.set_defaults(func=bench_knn)
+
+    p = sub.add_parser("tail", help="FileTailer bulk lines/sec and append-to-yield latency")
+    p.add_argument("--lines", type=int, default=1000000)
+    p.add_argument("--probes", type=int, default=20)
+    p.set_defaults(func=bench_tail)
+
+    p = sub.add_parser("drain", help="template mining lines/sec with and without the masked exact-match cache")
+    p.add_argument("--log-file", default="", help="mine this file instead of a synthetic corpus")
+    p.add_argument("--lines", type=int, default=200000)
+    p.add_argument("--templates", type=int, default=500)
+    p.add_argument("--cache-size", type=int, default=config.TEMPLATE_CACHE_SIZE)
+    p.add_argument("--churn-lines", type=int, default=20000, help="lines of the equivalence corpus")
+    p.add_argument("--shards", type=int, nargs="*", default=[], help="also mine with DrainWrapper(shards=N)")
+    p.add_argument("--batch", type=int, default=4096, help="lines per add_log_lines call when sharded")
+    p.set_defaults(func=bench_drain)
+
+    p = sub.add_parser("snapshot", help="Drain state snapshot size, save and restore time")
+    p.add_argument("--clusters", type=int, default=20000)
+    p.set_defaults(func=bench_snapshot)
+
+    p = sub.add_parser("window", help="memory and time of count windows: list of tuples vs compact views")
+    p.add_argument("--lines", type=int, default=200000)
+    p.set_defaults(func=bench_window)
+
+    p = sub.add_parser("session", help="session windows: re-scoring and memory, unbounded vs bounded")
+    p.add_argument("--lines", type=int, default=500000)
+    p.add_argument("--sessions", type=int, default=20000)
+    p.add_argument("--idle", type=float, default=5.0, help="idle timeout in (simulated) seconds")
+    p.add_argument("--log-file", default="dynamic_logs.txt", help="lines for the full-segment inference check")
+    p.set_defaults(func=bench_session)
+
+    p = sub.add_parser("timewindow", help="event-time windows over a replayed, out-of-order day of logs")
+    p.add_argument("--hours", type=float, default=24)
+    p.add_argument("--rate", type=float, default=5, help="lines per second of log time")
+    p.add_argument("--jitter", type=float, default=3, help="max arrival delay in seconds")
+    p.add_argument("--window", type=float, default=config.TIME_WINDOW_SECONDS)
+    p.add_argument("--slide", type=float, default=config.TIME_WINDOW_SLIDE_SECONDS)
+    p.add_argument("--lateness", type=float, default=config.TIME_ALLOWED_LATENESS_SECONDS)
+    p.set_defaults(func=bench_timewindow)
+
+    p = sub.add_parser("parse", help="per-line cost of parsing in every stage vs one LogRecord per line")
+    p.add_argument("--lines", type=int, default=200000)
+    p.set_defaults(func=bench_parse)
+
+    p = sub.add_parser("threshold", help="Youden-J threshold: startup, recompute and cached read at 1M rows vs the old scan")
+    p.add_argument("--rows", type=int, default=1000000)
+    p.add_argument("--bins", type=int, default=config.FEEDBACK_SCORE_BINS)
+    p.add_argument("--updates", type=int, default=200, help="labelled inserts, each followed by a threshold read")
+    p.add_argument("--old-rows", type=int, default=3000, help="rows for timing the old O(n*d) computation")
+    p.add_argument("--templates", type=int, default=500, help="template IDs for the grouped run")
+    p.add_argument("--sources", type=int, default=10, help="sources for the grouped run")
+    p.set_defaults(func=bench_threshold)
+
+    p = sub.add_parser("feedback", help="feedback rows/sec: commit per row vs the write-behind writer")
+    p.add_argument("--rows", type=int, default=200000)
+    p.add_argument("--sync-rows", type=int, default=2000, help="rows for the commit-per-row baseline")
+    p.set_defaults(func=bench_feedback)
+
+    p = sub.add_parser("retention", help="feedback.db size and query latency over simulated weeks, with and without retention")
+    p.add_argument("--days", type=int, default=21)
+    p.add_argument("--rows-per-day", type=int, default=100000)
+    p.add_argument("--horizon-days", type=float, default=config.FEEDBACK_RETENTION_SECONDS / 86400)
+    p.add_argument("--labelled", type=float, default=0.01, help="fraction of rows with a label")
+    p.add_argument("--texts", type=int, default=2000, help="distinct window texts")
+    p.set_defaults(func=bench_retention)
+
+    p = sub.add_parser("alerts", help="caller-side and delivery latency: inline sends vs the alert dispatcher, on local stand-ins")
+    p.add_argument("--alerts", type=int, default=2000)
+    p.add_argument("--delay-ms", type=float, default=20.0, help="stand-in server time per request/message")
+    p.add_argument("--fail-rate", type=float, default=0.05, help="fraction of webhook calls answered 503")
+    p.add_argument("--queue-size", type=int, default=200, help="in-memory alerts per channel before spilling")
+    p.set_defaults(func=bench_alerts)
+
+    p = sub.add_parser("coalesce", help="alert messages during a simulated incident: per-channel cooldown vs digests")
+    p.add_argument("--minutes", type=int, default=20)
+    p.add_argument("--incident-minutes", type=int, default=10)
+    p.add_argument("--rate", type=int, default=10000, help="incident anomalies per minute")
+    p.add_argument("--hot-groups", type=int, default=4, help="template/source groups the incident is spread over")
+    p.add_argument("--background", type=int, default=20, help="background anomalies per minute")
+    p.set_defaults(func=bench_coalesce)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
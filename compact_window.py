@@ -0,0 +1,160 @@
+import array
+from typing import Iterator, List, Optional
+
+import numpy as np
+
+from config import WINDOW_BLOCK_LINES
+from log_record import NAN, LogRecord, to_epoch
+
+
+class TemplateInterner:
+    """
+    (template ID, template text) versions -> dense int32 indexes.
+
+    When Drain generalizes a template, its ID gets a new index, so a line keeps
+    the text it was mined with however the template changes later.
+    """
+
+    def __init__(self):
+        self.index = {}  # str(template ID) -> index of its latest version
+        self.tids: List = []
+        self.templates: List[str] = []
+
+    def intern(self, tid, template: str) -> int:
+        key = str(tid)
+        i = self.index.get(key)
+        if i is None or self.templates[i] != template:
+            i = self.index[key] = len(self.tids)
+            self.tids.append(tid)
+            self.templates.append(template)
+        return i
+
+
+# windows built by different SequenceWindows share one ID space
+default_interner = TemplateInterner()
+
+
+class _Block:
+    # array.array for cheap per-line writes, with a NumPy view over the same memory for readers
+    __slots__ = ("ids", "ts", "raw", "ids_np")
+
+    def __init__(self, size: int):
+        self.ids = array.array("i", bytes(4 * size))  # interned template version, -1 for a plain-text line
+        self.ts = [None] * size                       # timestamps as given (epoch floats for LogRecords)
+        self.raw = [None] * size                      # references to the raw line strings (or LogRecords)
+        self.ids_np = np.frombuffer(self.ids, dtype=np.int32)
+
+
+class WindowView:
+    """
+    Zero-copy window over a CompactLog block.
+
+    `ids` is a NumPy view of the template versions; `ts` converts the
+    timestamps to epoch seconds on access. Iterating yields the lines as they
+    were added: LogRecords, or the usual (ts, template, template_id, raw)
+    tuples with the template text the line was mined with, or the raw string
+    for plain-text lines, so the view can go wherever a list window went.
+    Pickling (e.g. to an InferencePool worker) sends that list.
+    """
+
+    __slots__ = ("_block", "_start", "_stop", "_interner")
+
+    def __init__(self, block: _Block, start: int, stop: int, interner: TemplateInterner):
+        self._block = block
+        self._start = start
+        self._stop = stop
+        self._interner = interner
+
+    @property
+    def ids(self) -> np.ndarray:
+        return self._block.ids_np[self._start:self._stop]
+
+    @property
+    def ts(self) -> np.ndarray:
+        stamps = self._block.ts[self._start:self._stop]
+        return np.fromiter((NAN if t is None else to_epoch(t) for t in stamps), np.float64, len(stamps))
+
+    def __len__(self):
+        return self._stop - self._start
+
+    def _item(self, i: int):
+        block = self._block
+        v, raw = block.ids[i], block.raw[i]
+        if v < 0 or raw.__class__ is LogRecord:
+            return raw
+        interner = self._interner
+        return block.ts[i], interner.templates[v], interner.tids[v], raw
+
+    def __iter__(self) -> Iterator:
+        for i in range(self._start, self._stop):
+            yield self._item(i)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return list(self)[i]
+        n = len(self)
+        if i < 0:
+            i += n
+        if not 0 <= i < n:
+            raise IndexError("window index out of range")
+        return self._item(self._start + i)
+
+    def __reduce__(self):
+        return list, (list(self),)
+
+    def __repr__(self):
+        return f"WindowView({list(self)!r})"
+
+
+class CompactLog:
+    """
+    Append-only line store for sliding windows.
+
+    Lines go into preallocated blocks of `block_size` slots (int32 template
+    version, timestamp and raw string references). When a block fills, the
+    last `window - 1` lines are copied to the start of a fresh block so every
+    window stays contiguous. Blocks are never overwritten, so views handed out
+    earlier stay valid; an old block is freed once no view references it.
+    """
+
+    def __init__(self, window: int, block_size: int = WINDOW_BLOCK_LINES,
+                 interner: Optional[TemplateInterner] = None):
+        self.window = window
+        self.block_size = max(block_size, 2 * window)
+        self.interner = interner or default_interner
+        self._block = _Block(self.block_size)
+        self._pos = 0
+
+    def append(self, log_line):
+        if self._pos == self.block_size:
+            self._roll()
+        b, i = self._block, self._pos
+        if isinstance(log_line, LogRecord):
+            tid = log_line.template_id
+            b.ids[i] = -1 if tid is None else self.interner.intern(tid, log_line.template)
+            b.ts[i] = log_line.timestamp
+            b.raw[i] = log_line
+        elif isinstance(log_line, tuple) and len(log_line) == 4:
+            ts, template, tid, raw = log_line
+            b.ids[i] = self.interner.intern(tid, template)
+            b.ts[i] = ts
+            b.raw[i] = raw
+        else:
+            b.ids[i] = -1
+            b.ts[i] = None
+            b.raw[i] = log_line
+        self._pos += 1
+
+    def _roll(self):
+        keep = self.window - 1
+        old, new = self._block, _Block(self.block_size)
+        if keep:
+            new.ids[:keep] = old.ids[self._pos - keep:self._pos]
+            new.ts[:keep] = old.ts[self._pos - keep:self._pos]
+            new.raw[:keep] = old.raw[self._pos - keep:self._pos]
+        self._block, self._pos = new, keep
+
+    def last(self, n: int) -> WindowView:
+        """View of the last `n` lines (n <= window)."""
+        n = min(n, self._pos)
+        return WindowView(self._block, self._pos - n, self._pos, self.interner)
@@ -1,18 +1,58 @@
 
 
 import os
-from transformers import AutoTokenizer, AutoModel
-AutoTokenizer.from_pretrained("bert-base-uncased")
-AutoModel.from_pretrained("bert-base-uncased")
 
 # Model & Inference
 LOGBERT_MODEL = os.getenv("LOGBERT_MODEL", "bert-base-uncased")  # Hugging Face Hub model ID
+LOGBERT_SNAPSHOT = os.getenv("LOGBERT_SNAPSHOT", "")  # Local safetensors snapshot dir (memory-mapped), used when present
+INFER_MAX_LENGTH = int(os.getenv("INFER_MAX_LENGTH", "512"))      # Tokens per window before truncation (clamped to the model's positions)
+INFER_BATCH_SIZE = int(os.getenv("INFER_BATCH_SIZE", "32"))       # Windows per forward pass in infer_batch
+INFER_BUCKET_WIDTH = int(os.getenv("INFER_BUCKET_WIDTH", "32"))   # Max token-length spread inside one batch
+INFER_PRECISION = os.getenv("INFER_PRECISION", "fp32").lower()     # "fp32", "int8" (dynamic, CPU) or "bf16"
+INFER_WORKERS = int(os.getenv("INFER_WORKERS", str(os.cpu_count() or 1)))  # Processes in worker_pool.InferencePool
+INFER_TASK_RETRIES = int(os.getenv("INFER_TASK_RETRIES", "2"))     # Re-queues of a task after a worker error/crash
+
+# Scoring engine: "bert" runs LogBERTInference on every window, "embedding" embeds each
+# template once and scores windows from the cached vectors (embedding_engine.py)
+SCORING_ENGINE = os.getenv("SCORING_ENGINE", "bert").lower()
+EMBED_CACHE_SIZE = int(os.getenv("EMBED_CACHE_SIZE", "50000"))   # Max cached template vectors
+
+# k-NN scorer used when the model has no classifier head (knn_scorer.py)
+KNN_INDEX_PATH = os.getenv("KNN_INDEX_PATH", "")                # .npy of normal-window CLS embeddings
+KNN_K = int(os.getenv("KNN_K", "5"))
+KNN_MAX_VECTORS = int(os.getenv("KNN_MAX_VECTORS", "200000"))   # compaction bound
+
+# Score cache (repeated template-ID windows skip the model)
+SCORE_CACHE_SIZE = int(os.getenv("SCORE_CACHE_SIZE", "10000"))            # Max cached windows, 0 disables
+SCORE_CACHE_TTL_SECONDS = float(os.getenv("SCORE_CACHE_TTL_SECONDS", "3600"))  # 0 = no expiry
 
 # Windowing
 WINDOW_TYPE = os.getenv("WINDOW_TYPE", "count")  # "count", "time", "session"
 SEQUENCE_LENGTH = int(os.getenv("SEQUENCE_LENGTH", "20"))     # Only for count-based or event-based
 SLIDING_STEP = int(os.getenv("SLIDING_STEP", "5"))            # Only for count-based
-TIME_WINDOW_x = int(os.getenv("TIME_WINDOW_SECONDS", "60"))  # Only for time-based
+TIME_WINDOW_SECONDS = float(os.getenv("TIME_WINDOW_SECONDS", "60"))  # Only for time-based (event time)
+TIME_WINDOW_SLIDE_SECONDS = float(os.getenv("TIME_WINDOW_SLIDE_SECONDS", "0"))          # 0 = tumbling (slide = window)
+TIME_ALLOWED_LATENESS_SECONDS = float(os.getenv("TIME_ALLOWED_LATENESS_SECONDS", "5"))  # How far the watermark trails the newest record
+TIME_WINDOW_MIN_LINES = int(os.getenv("TIME_WINDOW_MIN_LINES", "1"))                     # Emptier time windows are not scored
+WINDOW_BLOCK_LINES = int(os.getenv("WINDOW_BLOCK_LINES", "4096"))  # Lines per preallocated block in compact_window.CompactLog
+SESSION_MAX_LENGTH = int(os.getenv("SESSION_MAX_LENGTH", "24"))        # Session lines per scored segment; ~17 tokens per templated line, keep it within INFER_MAX_LENGTH
+SESSION_IDLE_SECONDS = float(os.getenv("SESSION_IDLE_SECONDS", "300"))  # A session closes after this long without a line
+SESSION_MAX_LIVE = int(os.getenv("SESSION_MAX_LIVE", "10000"))          # Open sessions kept; the least recently active is closed first
+SESSION_MIN_LENGTH = int(os.getenv("SESSION_MIN_LENGTH", "1"))          # Shorter closed sessions are not scored
+
+# Ingestion (fetch_logs.FileTailer)
+TAIL_CHUNK_BYTES = int(os.getenv("TAIL_CHUNK_BYTES", str(64 * 1024)))        # Bytes per read() syscall
+TAIL_CHECKPOINT_DIR = os.getenv("TAIL_CHECKPOINT_DIR", "")                     # Where byte offsets are persisted; "" = off
+TAIL_CHECKPOINT_INTERVAL = float(os.getenv("TAIL_CHECKPOINT_INTERVAL", "1"))  # Min seconds between offset writes
+
+# Async multi-source ingestion (ingest.py)
+INGEST_GLOB = os.getenv("INGEST_GLOB", "")                               # e.g. "/var/log/app/*.log"
+INGEST_UDP_HOST = os.getenv("INGEST_UDP_HOST", "127.0.0.1")
+INGEST_UDP_PORT = int(os.getenv("INGEST_UDP_PORT", "5140"))              # Local syslog/UDP listener
+INGEST_UDP = os.getenv("INGEST_UDP", "false").lower() == "true"          # Listen on INGEST_UDP_HOST:PORT in Ingestor.from_config()
+INGEST_QUEUE_SIZE = int(os.getenv("INGEST_QUEUE_SIZE", "64"))            # Buffered batches per source (file sources keep one in flight)
+INGEST_FAIR_QUANTUM = int(os.getenv("INGEST_FAIR_QUANTUM", "256"))       # Lines taken from a source per turn
+INGEST_RESCAN_SECONDS = float(os.getenv("INGEST_RESCAN_SECONDS", "10"))  # How often the glob is re-expanded
 
 # Anomaly detection
 ANOMALY_THRESHOLD = float(os.getenv("ANOMALY_THRESHOLD", "0.94"))  
@@ -20,6 +60,11 @@ ANOMALY_THRESHOLD = float(os.getenv("ANOMALY_THRESHOLD", "0.94"))
 # Drain3 Log Parser
 DRAIN_DEPTH = int(os.getenv("DRAIN_DEPTH", "4"))
 DRAIN_SIMILARITY = float(os.getenv("DRAIN_SIMILARITY", "0.5"))
+TEMPLATE_CACHE_SIZE = int(os.getenv("TEMPLATE_CACHE_SIZE", "100000"))  # Masked lines that skip Drain's tree search, 0 disables
+DRAIN_SNAPSHOT_PATH = os.getenv("DRAIN_SNAPSHOT_PATH", "")                # Miner state file restored at startup; "" = off
+DRAIN_SNAPSHOT_SECONDS = float(os.getenv("DRAIN_SNAPSHOT_SECONDS", "60"))  # Max age of an unsaved cluster change
+DRAIN_SNAPSHOT_CHANGES = int(os.getenv("DRAIN_SNAPSHOT_CHANGES", "1000"))  # Snapshot after this many cluster changes
+DRAIN_SHARDS = int(os.getenv("DRAIN_SHARDS", "1"))                          # Miner processes; >1 needs add_log_lines batches
 
 # Alerting
 ALERT_MODE = os.getenv("ALERT_MODE", "webhook").lower()  # "webhook" or "fastapi"
@@ -27,21 +72,53 @@ ALERT_MODE = os.getenv("ALERT_MODE", "webhook").lower()  # "webhook" or "fastapi
 # Webhook settings
 SLACK_WEBHOOK = os.getenv("SLACK_WEBHOOK", "")
 TEAMS_WEBHOOK = os.getenv("TEAMS_WEBHOOK", "")
-EMAIL_SMTP = os.getenv("EMAIL_SMTP", "noreply@logbert.local")
+EMAIL_SMTP = os.getenv("EMAIL_SMTP", "")  # From address, e.g. "noreply@logbert.local"; "" disables email
+SMTP_HOST = os.getenv("SMTP_HOST", "smtp.gmail.com")
+SMTP_PORT = int(os.getenv("SMTP_PORT", "587"))
+SMTP_USER = os.getenv("SMTP_USER", "")          # "" = no login
+SMTP_PASSWORD = os.getenv("SMTP_PASSWORD", "")
+SMTP_STARTTLS = os.getenv("SMTP_STARTTLS", "true").lower() == "true"
+
+# Alert delivery (background dispatcher)
+ALERT_QUEUE_SIZE = int(os.getenv("ALERT_QUEUE_SIZE", "1000"))              # In-memory alerts per channel before spilling to disk
+ALERT_SPILL_DIR = os.getenv("ALERT_SPILL_DIR", "alert_spool")               # One <channel>.jsonl of undelivered alerts per channel
+ALERT_SPILL_MAX = int(os.getenv("ALERT_SPILL_MAX", "10000"))                # Alerts kept on disk per channel; newer ones are dropped
+ALERT_RETRIES = int(os.getenv("ALERT_RETRIES", "5"))                        # Retries after the first failed send
+ALERT_BACKOFF_SECONDS = float(os.getenv("ALERT_BACKOFF_SECONDS", "1"))      # First retry delay, doubled per attempt
+ALERT_BACKOFF_MAX_SECONDS = float(os.getenv("ALERT_BACKOFF_MAX_SECONDS", "60"))
+ALERT_HTTP_TIMEOUT = float(os.getenv("ALERT_HTTP_TIMEOUT", "5"))           # Per-request timeout for webhooks and SMTP
+ALERT_CLOSE_TIMEOUT = float(os.getenv("ALERT_CLOSE_TIMEOUT", "10"))        # At close/exit, wait this long for queued alerts before spilling the rest
 
 # FastAPI settings
 FASTAPI_HOST = os.getenv("FASTAPI_HOST", "0.0.0.0")
 FASTAPI_PORT = int(os.getenv("FASTAPI_PORT", "8000"))
 
-# Alert cooldown to prevent spam
-ALERT_COOLDOWN_SECONDS = int(os.getenv("ALERT_COOLDOWN_SECONDS", "60"))
+# Alert coalescing: one digest per template fingerprint + source per interval
+ALERT_DIGEST_SECONDS = float(os.getenv("ALERT_DIGEST_SECONDS", os.getenv("ALERT_COOLDOWN_SECONDS", "60")))  # Min gap between digests of one group
+ALERT_WINDOW_SECONDS = float(os.getenv("ALERT_WINDOW_SECONDS", "60"))  # Sliding window for a group's recent count
+ALERT_MAX_GROUPS = int(os.getenv("ALERT_MAX_GROUPS", "1000"))          # Groups tracked; the least recently seen is flushed and evicted
+ALERT_SPIKE_FACTOR = float(os.getenv("ALERT_SPIKE_FACTOR", "5"))       # Escalate when the window count exceeds this x the group's usual count...
+ALERT_SPIKE_MIN = int(os.getenv("ALERT_SPIKE_MIN", "100"))             # ...and at least this many
+ALERT_EMAIL_TO = os.getenv("ALERT_EMAIL_TO", "")                       # Digest recipient; "" = digests go to Slack/Teams only
 
 # Explainable AI (optional LLM)
 EXPLAINER_MODEL = "gemini-1.5-flash"
 
 # Storage
 DB_PATH = os.getenv("DB_PATH", "/teamspace/studios/this_studio/feedback.db")  # SQLite DB path
+FEEDBACK_SCORE_BINS = int(os.getenv("FEEDBACK_SCORE_BINS", "0"))  # Threshold candidates per unit score; 0 = every distinct score
+FEEDBACK_QUEUE_SIZE = int(os.getenv("FEEDBACK_QUEUE_SIZE", "100000"))      # Rows waiting for the writer thread before add_feedback blocks
+FEEDBACK_BATCH_ROWS = int(os.getenv("FEEDBACK_BATCH_ROWS", "5000"))        # Max rows per write transaction
+FEEDBACK_FLUSH_SECONDS = float(os.getenv("FEEDBACK_FLUSH_SECONDS", "0.5"))  # Max time a row waits before its transaction commits
+FEEDBACK_GROUP_MIN_LABELS = int(os.getenv("FEEDBACK_GROUP_MIN_LABELS", "30"))  # Labels (of both kinds) before a template/source gets its own threshold
+FEEDBACK_RETENTION_SECONDS = float(os.getenv("FEEDBACK_RETENTION_SECONDS", str(7 * 86400)))  # Unlabelled rows older than this become per-minute histograms; 0 = keep all
+FEEDBACK_PRUNE_BATCH = int(os.getenv("FEEDBACK_PRUNE_BATCH", "2000"))            # Rows rolled up and deleted per write transaction
+FEEDBACK_PRUNE_INTERVAL = float(os.getenv("FEEDBACK_PRUNE_INTERVAL", "60"))      # Seconds between retention passes
+FEEDBACK_HISTOGRAM_BINS = int(os.getenv("FEEDBACK_HISTOGRAM_BINS", "20"))        # Score buckets per minute in feedback_rollup
 
 # Misc
 LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
 BATCH_MODE = os.getenv("BATCH_MODE", "false").lower() == "true"  # True = process file instantly
+BATCH_CHUNK_BYTES = int(os.getenv("BATCH_CHUNK_BYTES", str(8 * 1024 * 1024)))  # Byte range parsed per task in batch_replay.py
+BATCH_WORKERS = int(os.getenv("BATCH_WORKERS", str(os.cpu_count() or 1)))     # Parser processes in batch_replay.py
+BATCH_OUTPUT_DIR = os.getenv("BATCH_OUTPUT_DIR", "replay_out")               # Per-chunk scores + manifest.json
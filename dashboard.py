@@ -3,16 +3,29 @@ import time
 import pandas as pd
 from explainer import explain
 from store_feedback import FeedbackStore
-from infer import LogBERTInference
+from embedding_engine import create_engine
 from fetch_logs import tail_file
+from log_record import parse_line
 
 # --- Init ---
 st.set_page_config(page_title="🚨 Log Anomaly Dashboard", layout="wide")
 st.title("🚨 Real-Time Log Anomaly Dashboard")
 st.caption("Monitor logs, detect anomalies, and view remedies in real-time.")
 
-logbert = LogBERTInference()
-feedback_store = FeedbackStore("feedback.db")
+# st.rerun() re-executes this script for every line; cache_resource keeps one engine
+# and one store per process instead of reloading the model on every rerun
+@st.cache_resource
+def get_engine():
+    return create_engine()  # config.SCORING_ENGINE; weights load on the first score
+
+
+@st.cache_resource
+def get_feedback_store():
+    return FeedbackStore("feedback.db")
+
+
+logbert = get_engine()
+feedback_store = get_feedback_store()
 log_path = "/teamspace/studios/this_studio/dynamic_logs.txt"
 
 # --- Session State ---
@@ -27,7 +40,7 @@ if "total_logs" not in st.session_state:
 col1, col2, col3 = st.columns(3)
 col1.metric("Total Logs", st.session_state.total_logs)
 col2.metric("Anomalies", len(st.session_state.anomalies))
-col3.metric("Threshold", f"{feedback_store.compute_threshold():.2f}")
+col3.metric("Threshold", f"{feedback_store.threshold():.2f}")
 
 # --- Layout ---
 left, right = st.columns([2, 3])
@@ -36,10 +49,10 @@ left, right = st.columns([2, 3])
 with left:
     st.subheader("📜 Live Logs (last 20)")
     logs_display = ""
-    for log in st.session_state.logs:
-        if "CRITICAL" in log or "ERROR" in log:
+    for severity, log in st.session_state.logs:
+        if severity in ("CRITICAL", "ERROR", "FATAL"):
             logs_display += f"<span style='color:red;'>{log}</span><br>"
-        elif "WARN" in log:
+        elif severity in ("WARN", "WARNING"):
             logs_display += f"<span style='color:orange;'>{log}</span><br>"
         else:
             logs_display += f"<span style='color:gray;'>{log}</span><br>"
@@ -57,22 +70,26 @@ with right:
 # --- Stream new logs ---
 for line in tail_file(log_path, poll_interval=1):
     ts = int(time.time())
-    result = logbert.infer([line])
+    record = parse_line(line, source=log_path)
+    result = logbert.infer_batch([[record]], explain=False)[0]  # score-only pass; the embedding engine learns the line here
     score = result["score"]
 
     # Store feedback
-    feedback_store.add_feedback(ts, line, score, None)
-    threshold = feedback_store.compute_threshold()
+    feedback_store.add_feedback(ts, line, score, None, template_id=record.template_id, source=record.source)
+    # in-memory lookup: the template's or source's own threshold, else the global one
+    threshold = feedback_store.threshold_for(record.template_id, record.source)
+    logbert.set_threshold(feedback_store.threshold())  # the global value; the score cache does not depend on it
 
     # Update stats
     st.session_state.total_logs += 1
-    st.session_state.logs.append(f"{line} | score={score:.3f}")
+    st.session_state.logs.append((record.severity, f"{line} | score={score:.3f}"))
     st.session_state.logs = st.session_state.logs[-20:]
 
     # Anomaly handling
     if score > threshold:
+        result = logbert.infer([record])  # explanation pass, only for flagged lines
         explanation = explain(
-            sequence=[line],
+            sequence=[record.message],
             score=score,
             tokens=result["tokens"],
             token_importance=result["token_importance"]
@@ -0,0 +1,164 @@
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from config import EMBED_CACHE_SIZE, INFER_BATCH_SIZE, SCORING_ENGINE
+from infer import LogBERTInference
+from log_record import LogRecord, template_of
+
+
+class TemplateEmbeddingEngine:
+    """
+    Scoring engine that runs the transformer once per distinct template instead of once per window.
+
+    Every line is embedded by its template (Drain tuples) or its text (raw lines),
+    and the vector is cached by template ID. A window is then scored with a few
+    vector ops against the frequency-weighted centroid of the lines observed
+    before it: half the score is the cosine distance of the pooled window
+    vector, half the distance of its most unusual line. infer_batch() adds each
+    line to the centroid once, after scoring, however many overlapping windows
+    it shows up in; infer() only scores. Results use the same dict contract as
+    `LogBERTInference.infer`, with one "token" per line, so `explainer.explain`
+    and the dashboard work unchanged.
+    """
+
+    def __init__(self, encoder: Optional[LogBERTInference] = None, max_templates: int = EMBED_CACHE_SIZE):
+        self.encoder = encoder or LogBERTInference()
+        self.max_templates = max_templates
+        self._vectors = OrderedDict()  # key -> (template text, unit vector)
+        self._sum = None               # sum of the vectors of every line observed
+        self._count = 0
+        self._observed = OrderedDict() # id -> line object already in the centroid (held, so ids stay unique)
+        self._longest = 0              # longest window observed; bounds how far back overlaps can reach
+        self.embedded = 0              # transformer calls, for hit-rate accounting
+        self.lookups = 0
+
+    # the bits of the LogBERTInference interface the pipeline relies on
+    def sequence_to_text(self, sequence: List) -> str:
+        return self.encoder.sequence_to_text(sequence)
+
+    def set_threshold(self, threshold: float):
+        self.encoder.set_threshold(threshold)
+
+    @staticmethod
+    def _line_key(item):
+        # mined LogRecords and (ts, template, template_id, raw) tuples are keyed by template ID; anything else by text
+        mined = template_of(item)
+        if mined is not None:
+            tid, template = mined
+            return f"tid:{tid}", str(template), f"[TID:{tid}] {template}"
+        text = item.message if isinstance(item, LogRecord) else str(item)
+        return f"txt:{text}", text, text
+
+    def _embed_missing(self, keys: List[tuple], batch_size: int):
+        # one transformer pass for every template that is new, changed, or was evicted
+        missing = {}
+        for key, template, _ in keys:
+            cached = self._vectors.get(key)
+            if cached is None or cached[0] != template:
+                missing[key] = template
+        if missing:
+            vecs = self.encoder.embed_texts(list(missing.values()), batch_size=batch_size)
+            for (key, template), vec in zip(missing.items(), vecs):
+                self._vectors[key] = (template, vec)
+            self.embedded += len(missing)
+
+    def _rows(self, keys: List[tuple]) -> np.ndarray:
+        self.lookups += len(keys)
+        rows = []
+        for key, _, _ in keys:
+            self._vectors.move_to_end(key)
+            rows.append(self._vectors[key][1])
+        return np.stack(rows)
+
+    def _observe(self, sequence: List, vectors: np.ndarray):
+        # add the lines not already in the centroid. A line is recognised by the object that stays the
+        # same across overlapping windows: the raw string of a (ts, template, template_id, raw) tuple,
+        # which window views rebuild, else the item itself
+        observed = self._observed
+        refs = [item[3] if isinstance(item, tuple) and len(item) == 4 else item for item in sequence]
+        fresh = [i for i, ref in enumerate(refs) if id(ref) not in observed]
+        for i in fresh:
+            observed[id(refs[i])] = refs[i]
+        if fresh:
+            total = (vectors if len(fresh) == len(refs) else vectors[fresh]).sum(axis=0)
+            self._sum = total if self._sum is None else self._sum + total
+            self._count += len(fresh)
+        self._longest = max(self._longest, len(sequence))
+
+    def _centroid(self, dim: int) -> np.ndarray:
+        if self._sum is None:
+            return np.zeros(dim, dtype=np.float32)  # nothing observed yet: every distance is 0.5
+        return self._sum / (np.linalg.norm(self._sum) + 1e-12)
+
+    def infer(self, sequence: List, explain: bool = True) -> Dict[str, Any]:
+        """Score one window without adding its lines to the centroid."""
+        return self.infer_batch([sequence], explain=explain, observe=False)[0]
+
+    def infer_batch(self, sequences: List[List], batch_size: int = INFER_BATCH_SIZE,
+                    explain: bool = True, observe: bool = True) -> List[Dict[str, Any]]:
+        """
+        Score every window against the centroid as it was before this call, then (with
+        `observe`) add their lines to it. New templates are embedded `batch_size` at a time.
+        """
+        window_keys = [[self._line_key(item) for item in seq] for seq in sequences]
+        self._embed_missing([k for keys in window_keys for k in keys], batch_size)
+
+        results, rows, centroid = [], [], None
+        for seq, keys in zip(sequences, window_keys):
+            vectors = self._rows(keys)
+            rows.append(vectors)
+            if centroid is None:
+                centroid = self._centroid(vectors.shape[1])
+
+            # cosine distances mapped to 0-1
+            line_dist = (1.0 - vectors @ centroid) / 2.0
+            pooled = vectors.mean(axis=0)
+            pooled_dist = (1.0 - pooled @ centroid / (np.linalg.norm(pooled) + 1e-12)) / 2.0
+            score = float(0.5 * pooled_dist + 0.5 * line_dist.max())
+
+            token_importance = None
+            if explain:
+                spread = line_dist.max() - line_dist.min()
+                token_importance = ((line_dist - line_dist.min()) / (spread + 1e-12)).astype(np.float32)
+            results.append({
+                "score": max(0.0, min(1.0, score)),
+                "text": self.sequence_to_text(seq),
+                "attentions": None,
+                "token_importance": token_importance,
+                "tokens": [label for _, _, label in keys],
+            })
+
+        if observe:
+            for seq, vectors in zip(sequences, rows):
+                self._observe(seq, vectors)
+            # windows arrive in stream order, so a later one can only overlap the last few
+            while len(self._observed) > 2 * self._longest:
+                self._observed.popitem(last=False)
+        while len(self._vectors) > self.max_templates:
+            self._vectors.popitem(last=False)
+        return results
+
+    def infer_two_tier(self, sequences: List[List], threshold,
+                       batch_size: int = INFER_BATCH_SIZE) -> List[Dict[str, Any]]:
+        # importance costs nothing extra here, so one pass serves both tiers
+        if not callable(threshold):  # per-window thresholds (a callable) are not recorded
+            self.set_threshold(threshold)
+        return self.infer_batch(sequences, batch_size, explain=True)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "templates": len(self._vectors),
+            "lines": self._count,
+            "lookups": self.lookups,
+            "embedded": self.embedded,
+            "hit_rate": 1.0 - self.embedded / self.lookups if self.lookups else 0.0,
+        }
+
+
+def create_engine(name: str = SCORING_ENGINE):
+    """Build the scoring engine selected by config.SCORING_ENGINE ("bert" or "embedding")."""
+    if name == "embedding":
+        return TemplateEmbeddingEngine()
+    return LogBERTInference()
@@ -1,8 +1,7 @@
 import os
 import logging
+from functools import lru_cache
 from dotenv import load_dotenv
-from langchain.prompts import PromptTemplate
-import google.generativeai as genai
 from config import EXPLAINER_MODEL
 
 
@@ -16,25 +15,31 @@ load_dotenv(override=True)
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 
 
-# Initialize Gemini
-USE_GEMINI = False
-client = None
-if GEMINI_API_KEY:
+# Initialize Gemini lazily: langchain and google.generativeai are only imported
+# the first time an explanation is actually requested
+@lru_cache(maxsize=1)
+def gemini_client():
+    if not GEMINI_API_KEY:
+        logging.warning("⚠️ No GEMINI_API_KEY found in .env, falling back to local mode")
+        return None
     try:
+        import google.generativeai as genai
         genai.configure(api_key=GEMINI_API_KEY)
         client = genai.GenerativeModel(EXPLAINER_MODEL)
-        USE_GEMINI = True
         logging.info(f"✅ GEMINI client initialized with key: {GEMINI_API_KEY[:8]}…")
+        return client
     except Exception as e:
         logging.error(f"❌ Failed to init Gemini: {e}")
-else:
-    logging.warning("⚠️ No GEMINI_API_KEY found in .env, falling back to local mode")
+        return None
 
 
 # Prompt template
-explanation_template = PromptTemplate(
-    input_variables=["score", "top_tokens", "seq_text"],
-    template="""An anomaly detector flagged the following log sequence with anomaly score {score}.
+@lru_cache(maxsize=1)
+def explanation_template():
+    from langchain.prompts import PromptTemplate
+    return PromptTemplate(
+        input_variables=["score", "top_tokens", "seq_text"],
+        template="""An anomaly detector flagged the following log sequence with anomaly score {score}.
                 Provide a concise explanation of the most likely root cause, things to check (config/metrics), and a short remediation plan.
                 Highlight which tokens/parts of the sequence are important: {top_tokens}
 
@@ -43,7 +48,7 @@ explanation_template = PromptTemplate(
 
                 Answer in bullet points: cause, evidence, checks, remediation (2-3 lines each).
                 """
-                )
+    )
 
 
 # Helpers
@@ -60,7 +65,7 @@ def build_prompt(sequence, score, tokens, token_importance, max_tokens: int = 15
 
     seq_text = "\n".join([f"{i}. {t}" for i, t in enumerate(sequence[-20:])])
 
-    return explanation_template.format(
+    return explanation_template().format(
         score=f"{score:.3f}",
         top_tokens=token_str,
         seq_text=seq_text
@@ -68,7 +73,7 @@ def build_prompt(sequence, score, tokens, token_importance, max_tokens: int = 15
 
 def explain_with_GEMINI(prompt: str):
     try:
-        resp = client.generate_content(prompt)
+        resp = gemini_client().generate_content(prompt)
         return resp.text if resp and resp.text else "⚠️ Gemini returned empty response"
     except Exception as e:
         return f"⚠️ Gemini API error: {str(e)}"
@@ -76,8 +81,8 @@ def explain_with_GEMINI(prompt: str):
 
 # Main entry point
 def explain(sequence, score, tokens, token_importance):
-    prompt = build_prompt(sequence, score, tokens, token_importance)
-    if USE_GEMINI:
+    if gemini_client() is not None:
+        prompt = build_prompt(sequence, score, tokens, token_importance)
         return explain_with_GEMINI(prompt)
     else:
         # fallback: simple heuristic explanation
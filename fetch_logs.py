@@ -1,20 +1,212 @@
-
 import time
-from typing import Iterator
+from typing import Iterator, List, Optional
+import ctypes
+import ctypes.util
+import json
 import os
+import select
+import sys
+
+from config import TAIL_CHUNK_BYTES, TAIL_CHECKPOINT_DIR, TAIL_CHECKPOINT_INTERVAL
+
+# inotify flags (linux/inotify.h)
+_IN_MODIFY, _IN_MOVED_FROM, _IN_MOVED_TO, _IN_CREATE, _IN_DELETE = 0x2, 0x40, 0x80, 0x100, 0x200
+_IN_NONBLOCK, _IN_CLOEXEC = 0o4000, 0o2000000
+
+
+class _Inotify:
+    """Minimal ctypes inotify watch on a directory; wait() returns early on any change in it."""
+
+    def __init__(self, directory: str):
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.fd = libc.inotify_init1(_IN_NONBLOCK | _IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        mask = _IN_MODIFY | _IN_MOVED_FROM | _IN_MOVED_TO | _IN_CREATE | _IN_DELETE
+        if libc.inotify_add_watch(self.fd, os.fsencode(directory), mask) < 0:
+            os.close(self.fd)
+            raise OSError(ctypes.get_errno(), f"inotify_add_watch failed for {directory}")
+
+    def wait(self, timeout: float):
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if ready:
+            try:
+                while os.read(self.fd, 4096):  # drain; the tailer re-checks the file itself
+                    pass
+            except BlockingIOError:
+                pass
+
+    def close(self):
+        os.close(self.fd)
+
+
+class FileTailer:
+    """
+    Buffered, rotation-aware `tail -f`.
+
+    Reads `chunk_size` bytes per syscall and splits them into lines in bulk.
+    Follows logrotate renames (new inode at `path`) and truncation (size drops
+    below the read offset). With a checkpoint file, the byte offset of the last
+    line handed out is persisted (atomically, at most every
+    `checkpoint_interval` seconds) so a restart resumes exactly where the
+    previous run stopped instead of seeking to the end. `resume` (a previous
+    tailer's `position()`) does the same in memory when there is no checkpoint
+    file. On Linux it waits on inotify instead of sleeping for `poll_interval`.
+    """
+
+    def __init__(self, path: str, poll_interval: float = 0.5, chunk_size: int = TAIL_CHUNK_BYTES,
+                 checkpoint_path: Optional[str] = None, from_start: bool = False,
+                 checkpoint_interval: float = TAIL_CHECKPOINT_INTERVAL, resume: Optional[dict] = None):
+        self.path = path
+        self.poll_interval = poll_interval
+        self.chunk_size = chunk_size
+        self.checkpoint_path = checkpoint_path or default_checkpoint_path(path)
+        self.checkpoint_interval = checkpoint_interval
+        self.from_start = from_start
+        self.resume = resume
+        self.fd = None
+        self.inode = None
+        self.offset = 0          # byte offset of the end of the last complete line read
+        self._partial = b""
+        self._last_checkpoint = 0.0
+        self._watch = None
+        self._stopping = False
+
+    # --- checkpointing ---
+    def _load_checkpoint(self):
+        if not self.checkpoint_path or not os.path.exists(self.checkpoint_path):
+            return self.resume
+        try:
+            with open(self.checkpoint_path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def position(self) -> Optional[dict]:
+        """The checkpoint state (inode and offset of the last handled line), None before the file was opened."""
+        if self.inode is None:
+            return None
+        return {"path": self.path, "inode": self.inode, "offset": self.offset}
 
-def tail_file(path: str, poll_interval: float = 0.5) -> Iterator[str]:
+    def checkpoint(self, force: bool = False):
+        if not self.checkpoint_path or self.inode is None:
+            return
+        now = time.monotonic()
+        if not force and now - self._last_checkpoint < self.checkpoint_interval:
+            return
+        tmp = f"{self.checkpoint_path}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.position(), f)
+        os.replace(tmp, self.checkpoint_path)
+        self._last_checkpoint = now
+
+    # --- file handling ---
+    def _open(self, resume: bool):
+        self.fd = os.open(self.path, os.O_RDONLY)
+        st = os.fstat(self.fd)
+        self.inode = [st.st_dev, st.st_ino]
+        self._partial = b""
+        state = self._load_checkpoint() if resume else None
+        if state and state.get("inode") == self.inode and state.get("offset", 0) <= st.st_size:
+            self.offset = state["offset"]                      # same file: resume exactly
+        elif state or not resume or self.from_start:
+            self.offset = 0                                    # rotated while down, or a new file
+        else:
+            self.offset = st.st_size                           # first run: behave like tail -f
+        os.lseek(self.fd, self.offset, os.SEEK_SET)
+
+    def _check_rotation(self) -> Optional[str]:
+        """"rotated" when `path` now names a different file, "truncated" when it shrank below our offset."""
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None  # mid-rotation; keep the old descriptor until the new file appears
+        if [st.st_dev, st.st_ino] != self.inode:
+            return "rotated"
+        if st.st_size < self.offset:
+            return "truncated"
+        return None
+
+    def _wait(self):
+        if self._watch is None and sys.platform.startswith("linux"):
+            try:
+                self._watch = _Inotify(os.path.dirname(os.path.abspath(self.path)))
+            except OSError:
+                self._watch = False
+        if self._watch:
+            self._watch.wait(self.poll_interval)
+        else:
+            time.sleep(self.poll_interval)
+
+    def stop(self):
+        """Make batches() return within `poll_interval` (from any thread), writing a final checkpoint."""
+        self._stopping = True
+
+    def batches(self) -> Iterator[List[str]]:
+        """Yield lists of new lines; one list per read, as soon as data arrives."""
+        self._open(resume=True)
+        try:
+            while not self._stopping:
+                data = os.read(self.fd, self.chunk_size)
+                if data:
+                    data = self._partial + data
+                    end = data.rfind(b"\n")
+                    if end < 0:
+                        self._partial = data
+                        continue
+                    self._partial = data[end + 1:]
+                    lines = data[:end].decode("utf-8", errors="replace").split("\n")
+                    yield lines
+                    # the consumer came back for more, so these lines are handled
+                    self.offset += end + 1
+                    self.checkpoint()
+                    continue
+
+                change = self._check_rotation()
+                if change == "rotated":
+                    # the old file is fully drained; switch to the new one from its start
+                    os.close(self.fd)
+                    self._open(resume=False)
+                    self.checkpoint(force=True)
+                    continue
+                if change == "truncated":
+                    # copytruncate: same inode, start again from the top
+                    self.offset = 0
+                    self._partial = b""
+                    os.lseek(self.fd, 0, os.SEEK_SET)
+                    continue
+                self._wait()
+        finally:
+            if self.fd is not None:
+                os.close(self.fd)
+                self.fd = None
+            if self._watch:
+                self._watch.close()
+                self._watch = None
+            self.checkpoint(force=True)
+
+    def lines(self) -> Iterator[str]:
+        for batch in self.batches():
+            yield from batch
+
+
+def default_checkpoint_path(path: str) -> Optional[str]:
+    if not TAIL_CHECKPOINT_DIR:
+        return None
+    name = os.path.abspath(path).strip(os.sep).replace(os.sep, "__")
+    return os.path.join(TAIL_CHECKPOINT_DIR, f"{name}.offset")
+
+
+def tail_file(path: str, poll_interval: float = 0.5, checkpoint_path: Optional[str] = None) -> Iterator[str]:
     """Yield new lines appended to `path` (like tail -f)."""
-    with open(path, "r") as f:
-        # go to end
-        f.seek(0, os.SEEK_END)   #it's for when new logs are appending to the same file, if you want to read the whole log file from the start,
-                                # use f.seek(0)
-        while True:
-            line = f.readline()
-            if line:
-                yield line.rstrip("\n")
-            else:
-                time.sleep(poll_interval)
+    # starts at the end of the file, or at the checkpointed offset when one exists,
+    # pass FileTailer(path, from_start=True) to read the whole log file from the start
+    yield from FileTailer(path, poll_interval=poll_interval, checkpoint_path=checkpoint_path).lines()
+
+
+def tail_file_batches(path: str, poll_interval: float = 0.5, checkpoint_path: Optional[str] = None) -> Iterator[List[str]]:
+    """Like tail_file, but yields each chunk's lines as one list."""
+    yield from FileTailer(path, poll_interval=poll_interval, checkpoint_path=checkpoint_path).batches()
 
 # Example usage:
 # if __name__ == "__main__":
@@ -1,56 +1,193 @@
-from transformers import AutoTokenizer, AutoModelForSequenceClassification, AutoModel
-import torch
-import torch.nn.functional as F
 from typing import List, Dict, Any
+import os
 
 import numpy as np
-from fetch_logs import tail_file
-import json
 
-from dotenv import load_dotenv
-import os
+from config import LOGBERT_MODEL, LOGBERT_SNAPSHOT, INFER_BATCH_SIZE, INFER_BUCKET_WIDTH, INFER_MAX_LENGTH, SCORE_CACHE_SIZE, INFER_PRECISION, KNN_INDEX_PATH
+from score_cache import ScoreCache
+from knn_scorer import NormalWindowIndex
+from log_record import LogRecord
+
+# torch and transformers are imported inside the methods that need them, so importing
+# this module stays cheap and the model is only loaded on first use
+
 
-from config import LOGBERT_MODEL, DRAIN_DEPTH, DRAIN_SIMILARITY
+def cpu_supports_bf16() -> bool:
+    """True when the CPU has native bf16 matmul support (AVX512-BF16 / AMX)."""
+    try:
+        import torch
+        return bool(torch.ops.mkldnn._is_mkldnn_bf16_supported())
+    except Exception:
+        pass
+    try:
+        with open("/proc/cpuinfo") as f:
+            flags = f.read()
+        return "avx512_bf16" in flags or "amx_bf16" in flags
+    except OSError:
+        return False
 
 
 
 
 class LogBERTInference:
-    def __init__(self, model_name=LOGBERT_MODEL, device=None):
+    def __init__(self, model_name=LOGBERT_MODEL, device=None, precision=INFER_PRECISION, snapshot_dir=LOGBERT_SNAPSHOT):
+        self.model_name = model_name
+        self.snapshot_dir = snapshot_dir
+        self.device = device          # resolved when the model is loaded
+        self.precision = precision    # replaced by the precision actually applied
+        self._tokenizer = None
+        self._model = None
+        self._has_classifier = None
+        self._max_length = None
+
+        self.threshold = None
+        # set to DrainWrapper(tokenizer=self.tokenizer).vocab to skip per-window tokenization
+        self.vocab = None
+        # scores windows when the model has no classifier head (see knn_scorer.build_from_feedback)
+        self._knn_index = None
+        # repeated windows (same template versions) are answered from the cache
+        self.cache = ScoreCache() if SCORE_CACHE_SIZE > 0 else None
+        if self.cache is not None:
+            self.cache.bind(model=self.model_name, precision=self.precision)
+
+    @property
+    def knn_index(self):
+        return self._knn_index
+
+    @knn_index.setter
+    def knn_index(self, index):
+        # scores depend on the reference set, so cached ones are stale
+        self._knn_index = index
+        if self.cache is not None:
+            self.cache.clear()
+
+    def _source(self) -> str:
+        # a local safetensors snapshot is memory-mapped instead of read into the heap
+        if self.snapshot_dir and os.path.isfile(os.path.join(self.snapshot_dir, "model.safetensors")):
+            return self.snapshot_dir
+        return self.model_name
+
+    @property
+    def tokenizer(self):
+        if self._tokenizer is None:
+            from transformers import AutoTokenizer
+            self._tokenizer = AutoTokenizer.from_pretrained(self._source())
+        return self._tokenizer
+
+    @property
+    def model(self):
+        if self._model is None:
+            self._load_model()
+        return self._model
+
+    @model.setter
+    def model(self, value):
+        self._model = value
+        self._max_length = None
+
+    @property
+    def max_length(self) -> int:
+        """Tokens per window: INFER_MAX_LENGTH, clamped to the model's position embeddings and the tokenizer limit."""
+        if self._max_length is None:
+            positions = getattr(self.model.config, "max_position_embeddings", None) or INFER_MAX_LENGTH
+            self._max_length = min(INFER_MAX_LENGTH, positions, self.tokenizer.model_max_length)
+        return self._max_length
+
+    @property
+    def has_classifier(self) -> bool:
+        if self._model is None:
+            self._load_model()
+        return self._has_classifier
+
+    def _load_model(self):
+        import torch
+        from transformers import AutoModelForSequenceClassification, AutoModel
+
         # pick device
-        self.device = device or ("cuda" if torch.cuda.is_available() else "cpu")
+        self.device = self.device or ("cuda" if torch.cuda.is_available() else "cpu")
+        source = self._source()
+        kwargs = {
+            "attn_implementation": "eager",  # attentions are requested per call, only for the explanation pass
+            "device_map": "auto",  # <-- handles meta tensors safely
+        }
+        if source == self.snapshot_dir:
+            kwargs["use_safetensors"] = True
 
         try:
             # Try classification head
-            self.tokenizer = AutoTokenizer.from_pretrained(model_name)
-            self.model = AutoModelForSequenceClassification.from_pretrained(
-                model_name,
-                output_attentions=True,
-                device_map="auto"  # <-- handles meta tensors safely
+            self._model, info = AutoModelForSequenceClassification.from_pretrained(
+                source, output_loading_info=True, **kwargs
             )
-            self.has_classifier = True
+            prefix = self._model.base_model_prefix
+            if any(not key.startswith(prefix) for key in info["missing_keys"]):
+                # the head was freshly initialised (plain encoder checkpoint), its logits are noise
+                raise ValueError(f"{source} has no trained classification head")
+            self._has_classifier = True
         except Exception:
             # Fallback to base model
-            self.tokenizer = AutoTokenizer.from_pretrained(model_name)
-            self.model = AutoModel.from_pretrained(
-                model_name,
-                output_attentions=True,
-                device_map="auto"
+            self._model = AutoModel.from_pretrained(source, **kwargs)
+            self._has_classifier = False
+
+        self.precision = self._apply_precision(self.precision)
+        self._model.eval()
+        if not self._has_classifier and self.knn_index is None and KNN_INDEX_PATH and os.path.isfile(KNN_INDEX_PATH):
+            self.knn_index = NormalWindowIndex.load(KNN_INDEX_PATH)
+        print(f"✅ Model loaded from {source} on {self.device}, classifier head: {self._has_classifier}, "
+              f"precision: {self.precision}")
+        if self.cache is not None:
+            self.cache.bind(model=self.model_name, precision=self.precision)
+
+    def save_snapshot(self, path: str):
+        """Write tokenizer + fp32 weights as a safetensors snapshot that later starts can memory-map."""
+        if self.precision != "fp32":
+            raise ValueError("save the snapshot from an fp32 instance; precision is applied at load time")
+        self.model.save_pretrained(path, safe_serialization=True)
+        self.tokenizer.save_pretrained(path)
+
+    def _apply_precision(self, precision: str) -> str:
+        import torch
+
+        # reduced precision is meant for CPU-only nodes; anything unsupported stays fp32
+        precision = (precision or "fp32").lower()
+        if precision == "int8":
+            if self.device != "cpu":
+                print(f"⚠️ int8 dynamic quantization is CPU-only, keeping fp32 on {self.device}")
+                return "fp32"
+            # dynamic quantization: int8 weights for every nn.Linear, activations quantized on the fly
+            self._model = torch.ao.quantization.quantize_dynamic(
+                self._model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True
             )
-            self.has_classifier = False
+            return "int8"
+        if precision == "bf16":
+            if self.device == "cpu" and not cpu_supports_bf16():
+                print("⚠️ CPU has no native bf16 support, keeping fp32")
+                return "fp32"
+            self._model = self._model.to(torch.bfloat16)
+            return "bf16"
+        if precision != "fp32":
+            print(f"⚠️ Unknown precision {precision!r}, using fp32")
+        return "fp32"
 
-        print(f"✅ Model loaded on {self.device}, classifier head: {self.has_classifier}")
+    def set_threshold(self, threshold: float):
+        """Record the current anomaly threshold; cached scores don't depend on it, so the cache is kept."""
+        self.threshold = threshold
 
     def sequence_to_text(self, sequence: List) -> str:
         """
         Convert a sequence of logs into a single text string for LogBERT.
         Supports:
+        - LogRecords: by template once mined, else by message
         - Structured tuples: (ts, template, template_id, raw)
         - Raw strings
         """
         parts = []
         for item in sequence:
-            if isinstance(item, tuple):
+            if isinstance(item, LogRecord):
+                if item.template_id is not None:
+                    parts.append(f"[TID:{item.template_id}] {item.template}")
+                else:
+                    parts.append(item.message)
+            elif isinstance(item, tuple):
                 # Expect tuple format: (timestamp, template, template_id, raw)
                 try:
                     _, template, tid, _ = item
@@ -67,55 +204,209 @@ class LogBERTInference:
         return " <sep> ".join(parts)
 
 
-    def infer(self, sequence: List[tuple]) -> Dict[str, Any]:
-        text = self.sequence_to_text(sequence)
-        inputs = self.tokenizer(text, return_tensors="pt", truncation=True, max_length=1024).to(self.device)
-        # forward with attentions
-        with torch.no_grad():
-            outputs = self.model(**inputs, output_attentions=True)
-        # get attentions
-        attentions = None
-        if hasattr(outputs, "attentions"):
-            # attentions: tuple(layer: (batch, heads, seq_len, seq_len))
-            attentions = [a.detach().cpu().numpy() for a in outputs.attentions]
+    def infer(self, sequence: List[tuple], explain: bool = True, return_attentions: bool = False) -> Dict[str, Any]:
+        return self.infer_batch([sequence], batch_size=1, explain=explain, return_attentions=return_attentions)[0]
+
+    def infer_batch(self, sequences: List[List], batch_size: int = INFER_BATCH_SIZE,
+                    explain: bool = True, return_attentions: bool = False) -> List[Dict[str, Any]]:
+        """
+        Score many windows at once. Windows are tokenized together, sorted into
+        length buckets and padded only up to the longest window of their bucket,
+        so each bucket costs a single forward pass. Results come back in input
+        order and match what `infer` returns for each window.
+
+        explain=False is the score-only pass: no attentions are computed, and
+        `token_importance` is None. With explain=True the importance vector is
+        reduced from the last layer on-device and only that (seq,) vector is
+        copied to host; the full per-layer attentions are returned only when
+        `return_attentions` is set.
+
+        Windows already in the score cache skip the model, and repeats inside
+        one call are scored once.
+        """
+        if self.cache is None or return_attentions:
+            return self._run_model(sequences, batch_size, explain, return_attentions)
+
+        keys = [ScoreCache.fingerprint(seq) for seq in sequences]
+        results = [None] * len(sequences)
+        misses = {}  # key -> indexes waiting on it
+        for i, key in enumerate(keys):
+            if key in misses:
+                misses[key].append(i)
+                continue
+            cached = self.cache.get(key, need_importance=explain)
+            if cached is None:
+                misses[key] = [i]
+            else:
+                results[i] = cached
+
+        if misses:
+            scored = self._run_model([sequences[idxs[0]] for idxs in misses.values()], batch_size, explain, False)
+            for (key, idxs), res in zip(misses.items(), scored):
+                self.cache.put(key, res)
+                for i in idxs:
+                    results[i] = dict(res)
+        return results
+
+    def _run_model(self, sequences: List[List], batch_size: int, explain: bool,
+                   return_attentions: bool) -> List[Dict[str, Any]]:
+        import torch
+
+        model = self.model  # loads on first use
+        texts = [self.sequence_to_text(seq) for seq in sequences]
+        input_ids = self._window_ids(sequences, texts)
+        want_attentions = explain or return_attentions
+
+        results = [None] * len(texts)
+        for bucket in self._length_buckets(input_ids, batch_size):
+            batch = self._pad([input_ids[i] for i in bucket])
+            with torch.no_grad():
+                outputs = model(**batch, output_attentions=want_attentions)
+            scores = self._scores(outputs)
+            for row, idx in enumerate(bucket):
+                # strip the bucket padding so every window looks like it was scored on its own
+                length = len(input_ids[idx])
+                results[idx] = {
+                    "score": max(0.0, min(1.0, scores[row])),
+                    "text": texts[idx],
+                    "attentions": self._layer_attentions(outputs, row, length) if return_attentions else None,
+                    "token_importance": self._token_importance(outputs, row, length) if explain else None,
+                    "tokens": self.tokenizer.convert_ids_to_tokens(input_ids[idx])
+                }
+        return results
+
+    def infer_two_tier(self, sequences: List[List], threshold,
+                       batch_size: int = INFER_BATCH_SIZE) -> List[Dict[str, Any]]:
+        """
+        Score every window with the score-only pass, then run the explanation
+        pass only for windows whose score is above `threshold` (normally
+        `FeedbackStore.threshold()`). `threshold` may also be a callable that
+        returns each window's threshold, e.g.
+        `lambda seq: store.threshold_for(*group_keys(seq))` for per-template and
+        per-source thresholds.
+        """
+        if callable(threshold):
+            cuts = [threshold(seq) for seq in sequences]
+        else:
+            self.set_threshold(threshold)
+            cuts = [threshold] * len(sequences)
+        results = self.infer_batch(sequences, batch_size, explain=False)
+        flagged = [i for i, r in enumerate(results) if r["score"] > cuts[i]]
+        if flagged:
+            explained = self.infer_batch([sequences[i] for i in flagged], batch_size, explain=True)
+            for i, res in zip(flagged, explained):
+                results[i]["token_importance"] = res["token_importance"]
+        return results
+
+    def embed_texts(self, texts: List[str], batch_size: int = INFER_BATCH_SIZE, pooling: str = "mean") -> np.ndarray:
+        """L2-normalized last-layer embeddings, one row per text; pooling is "mean" or "cls"."""
+        import torch
+        import torch.nn.functional as F
+
+        model = self.model
+        input_ids = self.tokenizer(texts, truncation=True, max_length=self.max_length)["input_ids"]
+        vectors = None
+        for bucket in self._length_buckets(input_ids, batch_size):
+            batch = self._pad([input_ids[i] for i in bucket])
+            with torch.no_grad():
+                outputs = model(**batch, output_hidden_states=True)
+            hidden = outputs.hidden_states[-1].float()
+            mask = batch["attention_mask"].unsqueeze(-1).to(hidden.dtype)
+            if pooling == "cls":
+                pooled = hidden[:, 0]
+            else:
+                pooled = (hidden * mask).sum(dim=1) / mask.sum(dim=1)
+            pooled = F.normalize(pooled, dim=-1).cpu().numpy()
+            if vectors is None:
+                vectors = np.empty((len(texts), pooled.shape[1]), dtype=np.float32)
+            vectors[bucket] = pooled
+        return vectors
+
+    def _window_ids(self, sequences: List[List], texts: List[str]) -> List[List[int]]:
+        # windows of known Drain templates are assembled from pre-tokenized IDs,
+        # everything else goes through the tokenizer
+        input_ids = [None] * len(sequences)
+        pending = []
+        for i, seq in enumerate(sequences):
+            if self.vocab is not None and self.vocab.covers(seq):
+                input_ids[i] = self.vocab.window_ids(seq, self.max_length)
+            else:
+                pending.append(i)
+        if pending:
+            encoded = self.tokenizer([texts[i] for i in pending], truncation=True, max_length=self.max_length)["input_ids"]
+            for i, ids in zip(pending, encoded):
+                input_ids[i] = ids
+        return input_ids
+
+    def _pad(self, rows: List[List[int]]) -> Dict[str, Any]:
+        import torch
+
+        # copy the rows of one bucket into a preallocated, right-padded batch
+        width = max(len(r) for r in rows)
+        ids = np.full((len(rows), width), self.tokenizer.pad_token_id or 0, dtype=np.int64)
+        mask = np.zeros((len(rows), width), dtype=np.int64)
+        for row, r in enumerate(rows):
+            ids[row, :len(r)] = r
+            mask[row, :len(r)] = 1
+        return {
+            "input_ids": torch.from_numpy(ids).to(self.device),
+            "attention_mask": torch.from_numpy(mask).to(self.device),
+        }
+
+    @staticmethod
+    def _length_buckets(input_ids: List[List[int]], batch_size: int) -> List[List[int]]:
+        # sort by token count and cut into batches; a new bucket also starts once a window is
+        # more than INFER_BUCKET_WIDTH tokens longer than the shortest one, to keep padding small
+        order = sorted(range(len(input_ids)), key=lambda i: len(input_ids[i]))
+        buckets, current = [], []
+        for idx in order:
+            if current and (len(current) >= batch_size
+                            or len(input_ids[idx]) - len(input_ids[current[0]]) > INFER_BUCKET_WIDTH):
+                buckets.append(current)
+                current = []
+            current.append(idx)
+        if current:
+            buckets.append(current)
+        return buckets
+
+    def _scores(self, outputs) -> List[float]:
+        import torch
+        import torch.nn.functional as F
 
-        # get anomaly score
+        # get anomaly score for every row of the batch
         if self.has_classifier and hasattr(outputs, "logits"):
-            logits = outputs.logits.detach().cpu()
+            logits = outputs.logits.detach().float().cpu()
             # some logBERT variants use single output with sigmoid or 2-class
             if logits.shape[-1] == 1:
-                score = torch.sigmoid(logits).item()
+                scores = torch.sigmoid(logits)[:, 0]
             else:
-                probs = F.softmax(logits, dim=-1)
                 # assume class 1 is anomaly
-                score = probs[0, 1].item() if probs.shape[-1] > 1 else probs[0, 0].item()
-        else:
-            # fallback heuristic: use embedding norm or CLS token similarity
-            last_hidden = outputs.last_hidden_state.detach().cpu()  # (1, seq_len, dim)
-            # simple heuristic: mean of CLS token vector magnitude
-            score = float(last_hidden[0,0].norm().item())  # not normalized; map to 0-1
-            # normalize to 0-1 using a running min-max or a fixed scale; we'll clamp later
-            # for simplicity, map via tanh
-            score = float((np.tanh(score/10.0) + 1.0) / 2.0)
-
-        # produce token-level importance by aggregating attentions from last layer
-        token_importance = None
-        if attentions:
-            # average heads in last layer, aggregate over heads and tokens
-            last_layer = attentions[-1]  # shape (batch, heads, seq, seq)
-            avg_over_heads = last_layer.mean(axis=1)[0]  # (seq, seq)
-            # importance by sum of attention directed to each token
-            token_importance = avg_over_heads.sum(axis=0)  # shape (seq,)
-            # normalize to 0-1
-            token_importance = (token_importance - token_importance.min()) / (token_importance.ptp() + 1e-12)
+                scores = F.softmax(logits, dim=-1)[:, 1]
+            return scores.tolist()
 
-        return {
-            "score": max(0.0, min(1.0, score)),
-            "text": text,
-            "attentions": attentions,
-            "token_importance": token_importance,
-            "tokens": self.tokenizer.convert_ids_to_tokens(inputs["input_ids"][0].cpu().tolist())
-        }
+        cls = outputs.last_hidden_state[:, 0].detach().float().cpu()
+        if self.knn_index is not None and len(self.knn_index):
+            # distance to the nearest known-normal windows in embedding space
+            return self.knn_index.score(cls.numpy()).tolist()
+
+        # fallback heuristic: use embedding norm of the CLS token, mapped to 0-1 via tanh
+        cls_norms = cls.norm(dim=-1)
+        return [float((np.tanh(n / 10.0) + 1.0) / 2.0) for n in cls_norms.tolist()]
+
+    @staticmethod
+    def _token_importance(outputs, row: int, length: int) -> np.ndarray:
+        # average heads in last layer, then sum the attention directed to each token;
+        # all of it stays on-device and only the (seq,) vector is copied to host
+        last_layer = outputs.attentions[-1][row, :, :length, :length].float()  # (heads, seq, seq)
+        importance = last_layer.mean(dim=0).sum(dim=0)  # (seq,)
+        # normalize to 0-1
+        importance = (importance - importance.min()) / (importance.max() - importance.min() + 1e-12)
+        return importance.detach().cpu().numpy()
+
+    @staticmethod
+    def _layer_attentions(outputs, row: int, length: int) -> List[np.ndarray]:
+        # attentions: tuple(layer: (batch, heads, seq_len, seq_len))
+        return [a[row:row + 1, :, :length, :length].detach().float().cpu().numpy() for a in outputs.attentions]
 
 
 
@@ -125,4 +416,6 @@ class LogBERTInference:
 # Example usage:
 # inf = LogBERTInference()
 # res = inf.infer(sequence)
+# results = inf.infer_batch([seq_a, seq_b, seq_c])
+# results = inf.infer_two_tier(windows, threshold=store.threshold())
 # print(res['score'])
\ No newline at end of file
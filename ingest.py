@@ -0,0 +1,259 @@
+import asyncio
+import glob
+import threading
+from collections import deque
+from typing import AsyncIterator, Callable, Dict, Iterator, List, NamedTuple, Optional
+
+from config import (INGEST_GLOB, INGEST_QUEUE_SIZE, INGEST_FAIR_QUANTUM, INGEST_RESCAN_SECONDS,
+                    INGEST_UDP, INGEST_UDP_HOST, INGEST_UDP_PORT)
+from fetch_logs import FileTailer
+from log_record import LogRecord, parse_line
+
+
+class SourceLine(NamedTuple):
+    source: str
+    line: str
+
+
+class IteratorSource:
+    """
+    Adapter for any blocking generator of lines or line batches, e.g. `tail_file`.
+
+    The generator runs in a daemon thread and hands batches to the event loop.
+    It is only resumed once the consumer has taken every line of the previous
+    batch, so a generator that checkpoints on resume (FileTailer) never records
+    lines that are still buffered, and a slow consumer back-pressures the
+    producer instead of growing memory. `on_stop` is called (from the event
+    loop) when the source is cancelled, to wake a generator blocked waiting
+    for input; the generator is then closed so its cleanup runs.
+    """
+
+    def __init__(self, name: str, factory: Callable[[], Iterator], batched: bool = False,
+                 on_stop: Optional[Callable[[], None]] = None):
+        self.name = name
+        self.factory = factory
+        self.batched = batched
+        self.on_stop = on_stop
+        self._stop = threading.Event()
+
+    async def run(self, ingestor: "Ingestor"):
+        loop = asyncio.get_running_loop()
+        queue = ingestor.channel(self.name)
+
+        def pump():
+            items = self.factory()
+            try:
+                for item in items:
+                    if self._stop.is_set():
+                        break
+                    batch = item if self.batched else [item]
+                    consumed = threading.Event()
+                    fut = asyncio.run_coroutine_threadsafe(ingestor.put(self.name, queue, batch, consumed.set), loop)
+                    while not consumed.wait(0.5):
+                        if self._stop.is_set():
+                            fut.cancel()
+                            return
+            finally:
+                items.close()  # e.g. FileTailer writes its final checkpoint
+
+        thread = threading.Thread(target=pump, name=f"ingest:{self.name}", daemon=True)
+        thread.start()
+        try:
+            while thread.is_alive():
+                await asyncio.sleep(0.5)
+        finally:
+            self._stop.set()
+            if self.on_stop:
+                self.on_stop()
+            await asyncio.to_thread(thread.join, 5)
+
+
+class FileSource(IteratorSource):
+    """One tailed file; the source tag is its path."""
+
+    def __init__(self, path: str, poll_interval: float = 0.5, from_start: bool = False,
+                 resume: Optional[dict] = None):
+        self.tailer = FileTailer(path, poll_interval=poll_interval, from_start=from_start, resume=resume)
+        super().__init__(path, self.tailer.batches, batched=True, on_stop=self.tailer.stop)
+
+
+class GlobSource:
+    """
+    Tails every file matching `pattern`, picking up new matches every `rescan` seconds.
+
+    Files present at startup are tailed from their end (or their checkpoint).
+    Files that appear later are read from their first line, so lines written
+    before the next rescan are not lost. A tailer whose task ended is
+    restarted where it stopped.
+    """
+
+    def __init__(self, pattern: str, rescan: float = INGEST_RESCAN_SECONDS, poll_interval: float = 0.5):
+        self.pattern = pattern
+        self.rescan = rescan
+        self.poll_interval = poll_interval
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._sources: Dict[str, FileSource] = {}
+
+    async def run(self, ingestor: "Ingestor"):
+        startup = True
+        try:
+            while True:
+                for path in sorted(glob.glob(self.pattern)):
+                    task = self._tasks.get(path)
+                    if task is None or task.done():
+                        previous = self._sources.get(path)
+                        source = FileSource(path, self.poll_interval, from_start=not startup or previous is not None,
+                                            resume=previous.tailer.position() if previous else None)
+                        self._sources[path] = source
+                        self._tasks[path] = asyncio.create_task(source.run(ingestor))
+                startup = False
+                await asyncio.sleep(self.rescan)
+        finally:
+            for task in self._tasks.values():
+                task.cancel()
+            await asyncio.gather(*self._tasks.values(), return_exceptions=True)
+
+
+class UDPSyslogSource:
+    """
+    Local syslog/UDP listener. One datagram may hold several lines; a leading
+    syslog priority like "<13>" is kept as part of the line. UDP has no
+    back-pressure, so datagrams arriving while this source's buffer is full
+    are dropped and counted in `dropped`.
+    """
+
+    def __init__(self, host: str = INGEST_UDP_HOST, port: int = INGEST_UDP_PORT, name: Optional[str] = None):
+        self.host = host
+        self.port = port
+        self.name = name or f"udp:{host}:{port}"
+        self.dropped = 0
+
+    async def run(self, ingestor: "Ingestor"):
+        loop = asyncio.get_running_loop()
+        queue = ingestor.channel(self.name)
+        source = self
+
+        class Protocol(asyncio.DatagramProtocol):
+            def datagram_received(self, data, addr):
+                lines = data.decode("utf-8", errors="replace").splitlines()
+                if lines and not ingestor.put_nowait(source.name, queue, lines):
+                    source.dropped += 1
+
+        transport, _ = await loop.create_datagram_endpoint(Protocol, local_addr=(self.host, self.port))
+        try:
+            await asyncio.Event().wait()  # until cancelled
+        finally:
+            transport.close()
+
+
+class Ingestor:
+    """
+    Merges many sources into one async stream of SourceLine records.
+
+    Every source gets its own bounded buffer of `queue_size` batches. The merge
+    takes at most `quantum` lines from one source before moving to the next, so a
+    chatty source can't starve the rest. A batch counts as handled (and its
+    producer may move on) only when the consumer asks for the line after its
+    last one; close() stops every source and lets file tailers write their
+    final checkpoints.
+
+        ingestor = Ingestor().add(GlobSource("/var/log/app/*.log")).add(UDPSyslogSource())
+        async for rec in ingestor.stream():
+            print(rec.source, rec.line)
+    """
+
+    def __init__(self, queue_size: int = INGEST_QUEUE_SIZE, quantum: int = INGEST_FAIR_QUANTUM):
+        self.queue_size = queue_size
+        self.quantum = quantum
+        self._sources = []
+        self._tasks: List[asyncio.Task] = []
+        self._queues: Dict[str, asyncio.Queue] = {}
+        self._leftover: Dict[str, deque] = {}
+        self._acks: Dict[str, deque] = {}
+        self._wakeup = None
+
+    @classmethod
+    def from_config(cls, pattern: str = INGEST_GLOB, udp: bool = INGEST_UDP) -> "Ingestor":
+        """Tail INGEST_GLOB (when set) and listen on INGEST_UDP_HOST:PORT (when INGEST_UDP is true)."""
+        ingestor = cls()
+        if pattern:
+            ingestor.add(GlobSource(pattern))
+        if udp:
+            ingestor.add(UDPSyslogSource())
+        return ingestor
+
+    def add(self, source) -> "Ingestor":
+        self._sources.append(source)
+        return self
+
+    def channel(self, name: str) -> asyncio.Queue:
+        """The bounded buffer for one source tag (created on first use)."""
+        if name not in self._queues:
+            self._queues[name] = asyncio.Queue(maxsize=self.queue_size)
+            self._leftover[name] = deque()
+            self._acks[name] = deque()
+        return self._queues[name]
+
+    async def put(self, name: str, queue: asyncio.Queue, batch: List[str],
+                  ack: Optional[Callable[[], None]] = None):
+        """Buffer `batch`; `ack` is called once the consumer is past its last line."""
+        await queue.put((batch, ack))
+        self._wakeup.set()
+
+    def put_nowait(self, name: str, queue: asyncio.Queue, batch: List[str]) -> bool:
+        try:
+            queue.put_nowait((batch, None))
+        except asyncio.QueueFull:
+            return False
+        self._wakeup.set()
+        return True
+
+    async def stream(self) -> AsyncIterator[SourceLine]:
+        self._wakeup = asyncio.Event()
+        self._tasks = [asyncio.create_task(src.run(self)) for src in self._sources]
+        try:
+            while True:
+                self._wakeup.clear()
+                emitted = False
+                for name in list(self._queues):
+                    for line in self._take(name):
+                        emitted = True
+                        yield SourceLine(name, line)
+                        self._consumed(name)
+                if not emitted:
+                    await self._wakeup.wait()
+        finally:
+            await self.close()
+
+    async def records(self) -> AsyncIterator[LogRecord]:
+        """stream(), with every line parsed once into a LogRecord tagged with its source."""
+        async for rec in self.stream():
+            yield parse_line(rec.line, source=rec.source)
+
+    def _take(self, name: str) -> List[str]:
+        # up to `quantum` lines from one source; the rest of a large batch waits for its next turn
+        pending, acks, queue = self._leftover[name], self._acks[name], self._queues[name]
+        while len(pending) < self.quantum and not queue.empty():
+            batch, ack = queue.get_nowait()
+            if batch:
+                pending.extend(batch)
+                acks.append([len(batch), ack])
+            elif ack:
+                ack()
+        n = min(self.quantum, len(pending))
+        return [pending.popleft() for _ in range(n)]
+
+    def _consumed(self, name: str):
+        # one more line of the oldest unfinished batch is handled; ack the batch after its last line
+        head = self._acks[name][0]
+        head[0] -= 1
+        if head[0] == 0:
+            self._acks[name].popleft()
+            if head[1]:
+                head[1]()
+
+    async def close(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
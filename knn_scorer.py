@@ -0,0 +1,115 @@
+import os
+from typing import Optional
+
+import numpy as np
+
+from config import KNN_K, KNN_MAX_VECTORS
+from log_record import parse_line
+
+
+class NormalWindowIndex:
+    """
+    k-NN index over the CLS embeddings of known-normal windows.
+
+    Vectors are stored L2-normalized in one contiguous float32 matrix, so a batch
+    of queries is one matrix product plus a partial sort. A window's score is the
+    mean cosine distance to its k nearest normal windows, squashed to 0-1 with
+    d / (d + scale). `scale` is the 95th percentile of the same distance measured
+    inside the index, so a typical normal window scores at or below 0.5.
+    """
+
+    def __init__(self, k: int = KNN_K, max_vectors: int = KNN_MAX_VECTORS):
+        self.k = k
+        self.max_vectors = max_vectors
+        self.vectors = None   # (n, dim) float32, unit rows
+        self.scale = None
+
+    def __len__(self):
+        return 0 if self.vectors is None else len(self.vectors)
+
+    @property
+    def nbytes(self) -> int:
+        return 0 if self.vectors is None else self.vectors.nbytes
+
+    @staticmethod
+    def _normalize(vectors) -> np.ndarray:
+        vectors = np.asarray(vectors, dtype=np.float32)
+        return vectors / (np.linalg.norm(vectors, axis=1, keepdims=True) + 1e-12)
+
+    def add(self, vectors):
+        vectors = self._normalize(vectors)
+        self.vectors = vectors if self.vectors is None else np.concatenate([self.vectors, vectors])
+        if len(self.vectors) > self.max_vectors:
+            self.compact()
+        self.scale = None
+
+    def compact(self, target: Optional[int] = None, seed: int = 0):
+        """
+        Bound the index: drop near-identical vectors (equal after rounding to
+        float16), then sample down uniformly if it is still above `target`.
+        """
+        target = target or self.max_vectors
+        rounded = np.ascontiguousarray(self.vectors.astype(np.float16))
+        _, keep = np.unique(rounded.view(np.dtype((np.void, rounded.dtype.itemsize * rounded.shape[1]))),
+                            return_index=True)
+        keep.sort()
+        if len(keep) > target:
+            keep = np.sort(np.random.default_rng(seed).choice(keep, target, replace=False))
+        self.vectors = self.vectors[keep]
+        self.scale = None
+
+    def _knn_distance(self, queries: np.ndarray, exclude_self: bool = False) -> np.ndarray:
+        # chunk the queries so the (queries x index) similarity block stays around 64 MB
+        k = min(self.k + int(exclude_self), len(self))
+        step = max(1, (16 * 1024 * 1024) // max(1, len(self)))
+        out = np.empty(len(queries), dtype=np.float32)
+        for start in range(0, len(queries), step):
+            sims = queries[start:start + step] @ self.vectors.T
+            top = np.partition(sims, -k, axis=1)[:, -k:]
+            if exclude_self:
+                top = np.sort(top, axis=1)[:, :-1]  # the best match is the vector itself
+            out[start:start + step] = (1.0 - top.mean(axis=1)) / 2.0
+        return out
+
+    def calibrate(self, sample: int = 1000, seed: int = 0):
+        idx = np.random.default_rng(seed).choice(len(self), min(sample, len(self)), replace=False)
+        dist = self._knn_distance(self.vectors[idx], exclude_self=len(self) > 1)
+        self.scale = max(float(np.percentile(dist, 95)), 1e-6)
+
+    def score(self, vectors) -> np.ndarray:
+        """Anomaly score in 0-1 for each query vector."""
+        if self.scale is None:
+            self.calibrate()
+        dist = self._knn_distance(self._normalize(vectors))
+        return dist / (dist + self.scale)
+
+    def save(self, path: str):
+        """Atomic write of the vectors as .npy (scale is recomputed on load)."""
+        tmp = f"{path}.tmp"
+        with open(tmp, "wb") as f:
+            np.save(f, self.vectors)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = True, **kwargs) -> "NormalWindowIndex":
+        index = cls(**kwargs)
+        # memory-mapped until the first add() copies it
+        index.vectors = np.load(path, mmap_mode="r" if mmap else None)
+        return index
+
+
+def build_from_feedback(engine, store, limit: Optional[int] = None, batch_size: int = 64) -> NormalWindowIndex:
+    """
+    Seed an index from the CLS embeddings of FeedbackStore rows labelled normal.
+
+    Rows hold the raw line (a JSONL record, say), but windows are scored on
+    the parsed LogRecord, so each row is parsed and rendered the same way.
+    """
+    index = NormalWindowIndex()
+    texts = [engine.sequence_to_text([parse_line(text)])
+             for text in store.labelled_texts(is_anomaly=False, limit=limit) if text is not None]
+    for start in range(0, len(texts), 4096):
+        index.add(engine.embed_texts(texts[start:start + 4096], batch_size=batch_size, pooling="cls"))
+    if len(index):
+        index.calibrate()
+    return index
@@ -0,0 +1,144 @@
+import json
+import re
+from datetime import datetime
+from typing import Optional, Tuple
+
+NAN = float("nan")
+
+def to_epoch(ts) -> float:
+    """Timestamp as float epoch seconds; numbers pass through, ISO strings are parsed, anything else is NaN."""
+    if isinstance(ts, str):
+        try:
+            return datetime.fromisoformat(ts).timestamp()
+        except ValueError:
+            return NAN
+    if isinstance(ts, (int, float)):
+        return float(ts)
+    if isinstance(ts, datetime):
+        return ts.timestamp()
+    return NAN
+
+
+class LogRecord:
+    """
+    One log line, parsed once at ingestion and passed through every stage.
+
+    `timestamp` is epoch seconds (NaN when the line has none). `message` is what
+    Drain mines and what raw-text windows are scored on; `template` and
+    `template_id` are filled in by DrainWrapper.add_records.
+    """
+
+    __slots__ = ("timestamp", "severity", "session", "source", "message", "template", "template_id")
+
+    def __init__(self, timestamp: float, severity: str, session: Optional[str], source: str, message: str,
+                 template: Optional[str] = None, template_id: Optional[str] = None):
+        self.timestamp = timestamp
+        self.severity = severity
+        self.session = session
+        self.source = source
+        self.message = message
+        self.template = template
+        self.template_id = template_id
+
+    def __reduce__(self):
+        # positional args pickle much faster than the default slots state (batch_replay ships records between processes)
+        return LogRecord, (self.timestamp, self.severity, self.session, self.source, self.message,
+                           self.template, self.template_id)
+
+    def __eq__(self, other):
+        return isinstance(other, LogRecord) and self.__reduce__()[1] == other.__reduce__()[1]
+
+    def __repr__(self):
+        return (f"LogRecord(timestamp={self.timestamp!r}, severity={self.severity!r}, session={self.session!r}, "
+                f"source={self.source!r}, message={self.message!r}, template_id={self.template_id!r})")
+
+
+def template_of(item) -> Optional[Tuple[str, str]]:
+    """(template_id, template) of a mined LogRecord or a (ts, template, template_id, raw) tuple, else None."""
+    if isinstance(item, LogRecord):
+        return (item.template_id, item.template) if item.template_id is not None else None
+    if isinstance(item, tuple) and len(item) == 4:
+        return item[2], item[1]
+    return None
+
+
+# optional ISO timestamp, then an optional severity ("[ERROR] ...", "ERROR: ...", "WARN ...")
+PREFIX = re.compile(
+    r"\s*(?P<ts>\d{4}-\d{2}-\d{2}[T ]\d{2}:\d{2}:\d{2}(?:[.,]\d+)?(?:Z|[+-]\d{2}:?\d{2})?)?\s*"
+    r"(?:\[?(?P<level>TRACE|DEBUG|INFO|NOTICE|WARN(?:ING)?|ERROR|CRITICAL|FATAL)\]?:?(?=\s|$))?"
+)
+SESSION = re.compile(r"session[_=]([A-Za-z0-9_-]+)")
+LEVELS = {"TRACE", "DEBUG", "INFO", "NOTICE", "WARN", "WARNING", "ERROR", "CRITICAL", "FATAL"}
+TS_KEYS = ("timestamp", "ts", "time", "@timestamp")
+MESSAGE_KEYS = ("log", "message", "msg")
+
+
+def _first(obj: dict, keys):
+    for key in keys:
+        value = obj.get(key)
+        if value is not None:
+            return value
+    return None
+
+
+def _level(message: str) -> Optional[str]:
+    # "[LEVEL] ..." is the common shape; skip the regex for it, and for lines that can't start with a level
+    if message.startswith("["):
+        end = message.find("]", 1, 10)
+        if end > 0 and message[1:end] in LEVELS:
+            return message[1:end]
+    elif not message.lstrip()[:1].isupper():
+        return None
+    return PREFIX.match(message).group("level")
+
+
+def _session(message: str) -> Optional[str]:
+    if "session" not in message:  # substring test is much cheaper than the regex
+        return None
+    m = SESSION.search(message)
+    return m.group(1) if m else None
+
+
+def parse_line(line: str, source: str = "") -> LogRecord:
+    """
+    LogRecord for one JSONL record or plain-text line.
+
+    JSON records use their "timestamp"/"level"/"session_id"/"source"/"log" fields
+    (with a few common aliases); anything missing, and everything for plain text,
+    comes from the message: a leading ISO timestamp and severity, and a
+    "session=<id>" or "session_<id>" token.
+    """
+    line = line.rstrip("\r\n")
+    obj = None
+    if line.startswith("{"):
+        try:
+            obj = json.loads(line)
+        except json.JSONDecodeError:
+            pass
+    if isinstance(obj, dict):
+        # the usual keys first; the alias scan only runs when they are missing
+        message = obj.get("log")
+        if message is None:
+            message = _first(obj, MESSAGE_KEYS)
+        message = line if message is None else str(message)
+        ts = obj.get("timestamp")
+        if ts is None:
+            ts = _first(obj, TS_KEYS)
+        level = obj.get("level") or obj.get("severity")
+        session = obj.get("session_id") or obj.get("session")
+        source = str(obj.get("source") or obj.get("host") or source)
+    else:
+        message, ts, level, session = line, None, None, None
+
+    if ts is None:
+        m = PREFIX.match(message)
+        ts, level = m.group("ts"), level or m.group("level")
+    elif level is None:
+        level = _level(message)
+    return LogRecord(
+        to_epoch(ts) if ts is not None else NAN,
+        str(level).upper() if level else "",
+        str(session) if session else _session(message),
+        source,
+        message,
+    )
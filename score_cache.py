@@ -0,0 +1,118 @@
+import hashlib
+import sys
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+from config import SCORE_CACHE_SIZE, SCORE_CACHE_TTL_SECONDS
+from log_record import LogRecord, template_of
+
+
+class ScoreCache:
+    """
+    Bounded LRU/TTL cache of inference results, keyed by a fingerprint of the window.
+
+    Windows of mined LogRecords or Drain tuples are keyed by their sequence of
+    (template ID, template text), so a template Drain has since generalized
+    gets a new key; anything else is keyed by its text. Entries hold the score, tokens and (when the window went through
+    the explanation pass) the token importance; per-layer attentions are never cached.
+    """
+
+    def __init__(self, max_entries: int = SCORE_CACHE_SIZE, ttl_seconds: float = SCORE_CACHE_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()  # key -> (expires_at, size, result)
+        self._context = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+        self.bytes = 0
+
+    @staticmethod
+    def fingerprint(sequence: List, text: Optional[str] = None) -> str:
+        mined = [template_of(item) for item in sequence]
+        if mined and None not in mined:
+            key = "\x1f".join(f"{tid}\x1e{template}" for tid, template in mined)
+            prefix = "tid:"
+        else:
+            # normalized text: collapse whitespace so spacing differences still hit
+            if text is None:
+                text = "\n".join(item.message if isinstance(item, LogRecord) else str(item) for item in sequence)
+            key = " ".join(text.split())
+            prefix = "txt:"
+        return prefix + hashlib.blake2b(key.encode("utf-8"), digest_size=16).hexdigest()
+
+    def bind(self, **context):
+        """Clear the cache when the model it was filled under changes (scores don't depend on the threshold)."""
+        if context != self._context:
+            if self._context is not None:
+                self.invalidations += 1
+            self._context = context
+            self.clear()
+
+    def get(self, key: str, need_importance: bool = False) -> Optional[Dict[str, Any]]:
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        expires_at, size, result = entry
+        if expires_at and expires_at < time.monotonic():
+            self._drop(key, size)
+            self.expirations += 1
+            self.misses += 1
+            return None
+        if need_importance and result["token_importance"] is None:
+            # only the score-only pass has seen this window so far
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return dict(result)
+
+    def put(self, key: str, result: Dict[str, Any]):
+        if self.max_entries <= 0:
+            return
+        old = self._entries.get(key)
+        if old is not None:
+            self._drop(key, old[1])
+        result = dict(result, attentions=None)
+        size = self._entry_size(key, result)
+        expires_at = time.monotonic() + self.ttl_seconds if self.ttl_seconds > 0 else 0
+        self._entries[key] = (expires_at, size, result)
+        self.bytes += size
+        while len(self._entries) > self.max_entries:
+            old_key, (_, old_size, _) = self._entries.popitem(last=False)
+            self.bytes -= old_size
+            self.evictions += 1
+
+    def clear(self):
+        self._entries.clear()
+        self.bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "invalidations": self.invalidations,
+            "bytes": self.bytes,
+        }
+
+    def _drop(self, key: str, size: int):
+        del self._entries[key]
+        self.bytes -= size
+
+    @staticmethod
+    def _entry_size(key: str, result: Dict[str, Any]) -> int:
+        # rough accounting: strings plus the importance buffer, not interpreter overhead
+        size = sys.getsizeof(key) + sys.getsizeof(result["text"])
+        size += sum(sys.getsizeof(t) for t in result["tokens"])
+        if result["token_importance"] is not None:
+            size += result["token_importance"].nbytes
+        return size
@@ -1,59 +1,283 @@
 
 from datetime import datetime, timedelta
-from collections import deque, defaultdict
+from collections import deque, defaultdict, OrderedDict
 from drain3.file_persistence import FilePersistence
+from itertools import takewhile
+from typing import List, Optional
+import bisect
+import heapq
 import json
+import math
 import config 
 import re
+import time
+from compact_window import CompactLog, to_epoch
 from fetch_logs import tail_file
+from log_record import LogRecord, SESSION, parse_line
+
+
+class SessionWindows:
+    """
+    Bounded per-session windows.
+
+    A session's lines are scored once: when the session closes (no line for
+    `idle_seconds`, or evicted as least recently active beyond `max_live`
+    sessions), or in segments of `max_length` lines for sessions that never go
+    quiet. Idle deadlines sit in a heap with one entry per live session; an
+    entry whose session was active since it was pushed is re-armed, not closed.
+    An evicted session's entry is left behind empty and the heap is compacted
+    once such entries outnumber the live ones, so `max_live` bounds memory.
+    """
+
+    def __init__(self, max_length: int = config.SESSION_MAX_LENGTH, idle_seconds: float = config.SESSION_IDLE_SECONDS,
+                 max_live: int = config.SESSION_MAX_LIVE, min_length: int = config.SESSION_MIN_LENGTH):
+        self.max_length = max_length
+        self.idle_seconds = idle_seconds
+        self.max_live = max_live
+        self.min_length = min_length
+        self.live = OrderedDict()  # session_id -> [lines, last_seen], least recently active first
+        self._deadlines = []       # (deadline, seq, session_id, state)
+        self._seq = 0
+        self.closed = deque()      # windows of sessions closed since the last pop_closed()
+
+    def add(self, session_id: str, log_line, now: float) -> Optional[List]:
+        self.expire(now)
+        state = self.live.get(session_id)
+        if state is None:
+            state = self.live[session_id] = [[], now]
+            self._arm(now + self.idle_seconds, session_id, state)
+            if len(self.live) > self.max_live:
+                _, old = self.live.popitem(last=False)
+                self._close(old[0])
+                old[0] = None  # its heap entry stays until its deadline; don't let it pin the lines
+                if len(self._deadlines) > 2 * len(self.live):
+                    self._compact()
+        else:
+            self.live.move_to_end(session_id)
+            state[1] = now
+        lines = state[0]
+        lines.append(log_line)
+        if len(lines) >= self.max_length:
+            state[0] = []
+            return lines
+        return None
+
+    def _arm(self, deadline: float, session_id: str, state: list):
+        self._seq += 1
+        heapq.heappush(self._deadlines, (deadline, self._seq, session_id, state))
+
+    def _compact(self):
+        # drop the entries of evicted sessions, keep one per live session
+        live = self.live
+        self._deadlines = [e for e in self._deadlines if live.get(e[2]) is e[3]]
+        heapq.heapify(self._deadlines)
+
+    def expire(self, now: float):
+        deadlines = self._deadlines
+        while deadlines and deadlines[0][0] <= now:
+            _, _, session_id, state = heapq.heappop(deadlines)
+            if self.live.get(session_id) is not state:
+                continue  # closed by LRU eviction (and maybe reopened since)
+            deadline = state[1] + self.idle_seconds
+            if deadline > now:
+                self._arm(deadline, session_id, state)
+            else:
+                del self.live[session_id]
+                self._close(state[0])
+
+    def _close(self, lines: List):
+        if len(lines) >= self.min_length:
+            self.closed.append(lines)
+
+    def pop_closed(self) -> List[List]:
+        if not self.closed:
+            return []
+        out = list(self.closed)
+        self.closed.clear()
+        return out
+
+    def close_all(self) -> List[List]:
+        for lines, _ in self.live.values():
+            self._close(lines)
+        self.live.clear()
+        self._deadlines = []
+        return self.pop_closed()
+
+
+class EventTimeWindows:
+    """
+    Tumbling or sliding windows over the records' own timestamps.
+
+    Window k covers [k * slide, k * slide + size); slide == size is tumbling.
+    The watermark trails the newest timestamp seen by `lateness` seconds.
+    Records wait in a heap until the watermark passes them, so out-of-order
+    arrivals within the lateness are put back in order. A window is emitted
+    once the watermark passes its end. A record older than the oldest window
+    still open is dropped and counted in `late`.
+    """
+
+    def __init__(self, size: float = config.TIME_WINDOW_SECONDS, slide: float = config.TIME_WINDOW_SLIDE_SECONDS,
+                 lateness: float = config.TIME_ALLOWED_LATENESS_SECONDS, min_length: int = config.TIME_WINDOW_MIN_LINES):
+        self.size = size
+        self.slide = slide or size
+        self.lateness = lateness
+        self.min_length = min_length
+        self.pending = []          # heap of (ts, seq, line) above the watermark
+        self.released = []         # (ts, line) at or below the watermark, in event-time order
+        self.max_ts = -math.inf
+        self.next_start = None     # start of the oldest window not yet emitted
+        self.closed = deque()
+        self.late = 0
+        self._seq = 0
+
+    @property
+    def watermark(self) -> float:
+        return self.max_ts - self.lateness
+
+    def add(self, ts: float, log_line):
+        if self.next_start is not None and ts < self.next_start:
+            self.late += 1
+            return
+        if ts <= self.watermark:
+            # behind the watermark but its window is still open: slot it in among the released records
+            bisect.insort(self.released, (ts, log_line), key=lambda r: r[0])
+            return
+        self._seq += 1
+        heapq.heappush(self.pending, (ts, self._seq, log_line))
+        if ts > self.max_ts:
+            self.max_ts = ts
+            self._advance(self.watermark)
+
+    def _first_window(self, ts: float) -> float:
+        # start of the earliest window that contains ts
+        return (math.floor((ts - self.size) / self.slide) + 1) * self.slide
+
+    def _release(self, watermark: float):
+        pending = self.pending
+        while pending and pending[0][0] <= watermark:
+            ts, _, line = heapq.heappop(pending)
+            self.released.append((ts, line))
+        if self.next_start is None and self.released:
+            self.next_start = self._first_window(self.released[0][0])
+
+    def _emit(self):
+        end = self.next_start + self.size
+        window = [line for _, line in takewhile(lambda r: r[0] < end, self.released)]
+        if len(window) >= self.min_length:
+            self.closed.append(window)
+        self.next_start += self.slide
+        del self.released[:bisect.bisect_left(self.released, self.next_start, key=lambda r: r[0])]
+        # jump over stretches with no records instead of emitting empty windows one by one
+        if self.released:
+            self.next_start = max(self.next_start, self._first_window(self.released[0][0]))
+
+    def _advance(self, watermark: float):
+        self._release(watermark)
+        while self.next_start is not None and self.next_start + self.size <= watermark:
+            if not self.released:
+                # nothing left below the watermark: the next window that can still get records
+                self.next_start = max(self.next_start, self._first_window(watermark))
+                break
+            self._emit()
+
+    def flush(self) -> List[List]:
+        """Emit every remaining window, as if the watermark had moved past all records."""
+        self._release(math.inf)
+        while self.released:
+            self._emit()
+        return self.pop_closed()
+
+    def pop_closed(self) -> List[List]:
+        if not self.closed:
+            return []
+        out = list(self.closed)
+        self.closed.clear()
+        return out
 
 
 class SequenceWindow:
     def __init__(self):
-        self.buffer = deque()
-        self.timestamps = deque()
-        self.sessions = defaultdict(deque)
+        self.sessions = SessionWindows()
+        self.times = EventTimeWindows()
+        self._last_event = None  # timestamp of the last record that carried one
+        # count windows live in a compact block store and are handed out as zero-copy views
+        self.log = CompactLog(config.SEQUENCE_LENGTH)
+        self.fill = 0  # lines in the current count window
 
-    def add_log(self, log_line):
-        now = datetime.now()
+    def add_log(self, log_line, now: Optional[float] = None):
+        """
+        Add one line; returns a window when one is complete, else None. When one line
+        completes several windows (time mode), or closes sessions by idle timeout or
+        eviction (session mode), the others are collected by pop_closed().
+
+        Time and session modes run on event time: the timestamp of LogRecords and
+        (ts, template, template_id, raw) tuples, or `now`, or the wall clock for
+        lines without one.
+        """
 
         if config.WINDOW_TYPE == "count":
-            self.buffer.append(log_line)
-            if len(self.buffer) > config.SEQUENCE_LENGTH:
-                for _ in range(config.SLIDING_STEP):
-                    if self.buffer:
-                        self.buffer.popleft()
+            self.log.append(log_line)
+            self.fill += 1
+            if self.fill > config.SEQUENCE_LENGTH:
+                self.fill = max(0, self.fill - config.SLIDING_STEP)
 
-            if len(self.buffer) == config.SEQUENCE_LENGTH:
-                return list(self.buffer)
+            if self.fill == config.SEQUENCE_LENGTH:
+                return self.log.last(self.fill)
 
         elif config.WINDOW_TYPE == "time":
-            self.buffer.append(log_line)
-            self.timestamps.append(now)
-            while self.timestamps and (now - self.timestamps[0]).total_seconds() > config.TIME_WINDOW_SECONDS:
-                self.buffer.popleft()
-                self.timestamps.popleft()
-
-            if len(self.buffer) >= config.SEQUENCE_LENGTH:
-                return list(self.buffer)
+            self.times.add(self.event_time(log_line, now), log_line)
+            if self.times.closed:
+                return self.times.closed.popleft()
 
         elif config.WINDOW_TYPE == "session":
             session_id = self.extract_session_id(log_line)
-            self.sessions[session_id].append(log_line)
-            self.buffer = self.sessions[session_id]
-
-            if len(self.buffer) >= config.SEQUENCE_LENGTH:
-                return list(self.buffer)
+            self.session_id = session_id
+            return self.sessions.add(session_id, log_line, self.event_time(log_line, now))
 
         return None
 
+    def event_time(self, log_line, now: Optional[float] = None) -> float:
+        if now is not None:
+            return now
+        if isinstance(log_line, LogRecord):
+            ts = log_line.timestamp
+        elif isinstance(log_line, tuple) and len(log_line) == 4:
+            ts = to_epoch(log_line[0])
+        else:
+            ts = math.nan
+        if not math.isnan(ts):
+            self._last_event = ts
+            return ts
+        # no timestamp: stay on the event clock if the stream has one, else use the wall clock
+        return self._last_event if self._last_event is not None else time.time()
+
+    def pop_closed(self) -> List[List]:
+        """Windows completed or closed since the last call, beyond the ones add_log returned."""
+        return self.times.pop_closed() + self.sessions.pop_closed()
+
+    def close(self) -> List[List]:
+        """Emit every pending time window and close every live session (e.g. at end of input)."""
+        return self.times.flush() + self.sessions.close_all()
 
     def get_sequence(self):
-        return list(self.buffer)
+        if config.WINDOW_TYPE == "count":
+            return list(self.log.last(self.fill))
+        if config.WINDOW_TYPE == "session":
+            state = self.sessions.live.get(getattr(self, "session_id", None))
+            return list(state[0]) if state else []
+        return [line for _, line in self.times.released] + [line for _, _, line in sorted(self.times.pending)]
 
 
     @staticmethod
     def extract_session_id(log_line):
+        # LogRecords carry the session found when the line was parsed
+        if isinstance(log_line, LogRecord):
+            return log_line.session or "unknown"
+
+        # Drain tuples (ts, template, template_id, raw): look in the raw line
+        if isinstance(log_line, tuple) and len(log_line) == 4:
+            log_line = log_line[3]
+
         # If the log line is already parsed as a dictionary (e.g., from JSONL)
         if isinstance(log_line, dict):
             return log_line.get("session_id", "unknown")
@@ -67,7 +291,7 @@ class SequenceWindow:
                 pass  # Fall through to regex check
 
         # If none of the above, use regex to search for "session=<id>"
-        match = re.search(r"session[_=]([A-Za-z0-9_-]+)", log_line)
+        match = SESSION.search(log_line)
         return match.group(1) if match else "unknown"
 
         
@@ -76,12 +300,14 @@ if __name__ == "__main__":
     window = SequenceWindow()
 
     log_path = "/Users/akshitagrawal/Desktop/datasets/logproject/synthetic_logs.jsonl"
+    if config.BATCH_MODE:
+        # replay the whole file with parallel parsing instead of tailing it
+        from batch_replay import BatchReplay
+        stats = BatchReplay(log_path, config.BATCH_OUTPUT_DIR).run()
+        print(f"✅ Replayed {stats['lines']:,} lines ({stats['lines_per_s']:,.0f} lines/s)")
+        raise SystemExit(0)
     for line in tail_file(log_path):
-        try:
-            log_dict = json.loads(line)
-            log_msg = log_dict.get("log", line)  
-        except json.JSONDecodeError:
-            log_msg = line  
-        s = window.add_log(log_msg)
-
-        print(window.get_sequence())
+        s = window.add_log(parse_line(line, source=log_path))
+        # also drain windows closed by idle timeouts, eviction or the watermark, or they pile up
+        for seq in ([s] if s is not None else []) + window.pop_closed():
+            print(list(seq))
@@ -1,10 +1,380 @@
+import atexit
+import hashlib
+import math
+import queue
 import sqlite3
-from config import DB_PATH, ANOMALY_THRESHOLD
+import threading
+import time
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from config import (DB_PATH, ANOMALY_THRESHOLD, FEEDBACK_SCORE_BINS, FEEDBACK_QUEUE_SIZE,
+                    FEEDBACK_BATCH_ROWS, FEEDBACK_FLUSH_SECONDS, FEEDBACK_GROUP_MIN_LABELS,
+                    FEEDBACK_RETENTION_SECONDS, FEEDBACK_PRUNE_BATCH, FEEDBACK_PRUNE_INTERVAL,
+                    FEEDBACK_HISTOGRAM_BINS)
+from log_record import LogRecord, template_of
+
+INSERT_TEXT = "INSERT OR IGNORE INTO texts (hash, text) VALUES (?, ?)"
+INSERT_FEEDBACK = ("INSERT INTO feedback (timestamp, sequence_text, score, is_true_anomaly, template_id, source, text_hash) "
+                   "VALUES (?, ?, ?, ?, ?, ?, ?)")
+SAVE_GROUP_THRESHOLD = ("INSERT OR REPLACE INTO thresholds (scope, group_key, value, labelled, updated_at) "
+                        "VALUES (?, ?, ?, ?, ?)")
+
+
+def group_keys(sequence: List) -> Tuple[Optional[str], Optional[str]]:
+    """(template_id, source) a window is grouped under: those of its last line, when known."""
+    if not sequence:
+        return None, None
+    last = sequence[-1]
+    mined = template_of(last)
+    source = last.source if isinstance(last, LogRecord) else None
+    return (mined[0] if mined else None), (source or None)
+
+
+def connect(db_path: str, readonly: bool = False) -> sqlite3.Connection:
+    conn = sqlite3.connect(db_path, check_same_thread=False, timeout=30)
+    if not readonly:
+        conn.execute("PRAGMA journal_mode=WAL")  # readers never block the writer, and vice versa
+    conn.execute("PRAGMA synchronous=NORMAL")    # with WAL: commits stay atomic, fsync only at checkpoints
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("PRAGMA cache_size=-65536")     # 64 MiB page cache
+    if readonly:
+        conn.execute("PRAGMA query_only=ON")
+    return conn
+
+
+class WriteBehind:
+    """
+    Background writer for one SQLite database.
+
+    A single thread owns the write connection. Statements wait in a bounded
+    queue and are committed in one transaction per `batch_rows` items, or per
+    whatever arrived within `flush_seconds` of the first. Within a transaction
+    the items are grouped by SQL (in order of first appearance, and in queue
+    order within a statement), each group going through one executemany. An
+    item whose "SQL" is a callable is run as fn(conn, params) in its turn:
+    everything queued before it is written first, and nothing queued after it
+    is moved ahead of it. A tuple of statements with a tuple of params is one
+    item, so its statements always commit together.
+    Callers only block when the queue is full.
+    """
+
+    def __init__(self, conn: sqlite3.Connection, queue_size: int = FEEDBACK_QUEUE_SIZE,
+                 batch_rows: int = FEEDBACK_BATCH_ROWS, flush_seconds: float = FEEDBACK_FLUSH_SECONDS):
+        self.conn = conn
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.batch_rows = batch_rows
+        self.flush_seconds = flush_seconds
+        self.written = self.batches = self.errors = 0
+        self._thread = threading.Thread(target=self._run, name="feedback-writer", daemon=True)
+        self._thread.start()
+
+    def put(self, sql, params):
+        self.queue.put((sql, params))
+
+    def flush(self):
+        """Block until everything queued before this call is committed."""
+        if not self._thread.is_alive():
+            return
+        done = threading.Event()
+        self.queue.put((None, done))
+        done.wait()
+
+    def close(self):
+        if self._thread.is_alive():
+            self.queue.put(None)
+            self._thread.join()
+
+    def _run(self):
+        get = self.queue.get
+        while True:
+            item = get()
+            if item is None:
+                return
+            batch = [item]
+            deadline = time.monotonic() + self.flush_seconds
+            stop = False
+            while len(batch) < self.batch_rows and item[0] is not None:  # a flush marker commits right away
+                try:
+                    item = get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+            self._write(batch)
+            if stop:
+                return
+
+    def _write_groups(self, groups: Dict):
+        for sql, params in groups.items():
+            self.conn.executemany(sql, params)
+            self.written += len(params)
+        groups.clear()
+
+    def _write(self, batch):
+        waiters = [params for sql, params in batch if sql is None]
+        try:
+            groups: Dict = {}
+            with self.conn:  # one transaction for the whole batch
+                self.conn.execute("BEGIN")  # explicit, so callables' savepoints nest inside it
+                for sql, params in batch:
+                    if sql is None:
+                        continue
+                    if callable(sql):
+                        # statements queued before a job are written before it runs, never regrouped past it
+                        self._write_groups(groups)
+                        sql(self.conn, params)
+                        continue
+                    if isinstance(sql, tuple):  # statements that must land together
+                        for one, p in zip(sql, params):
+                            groups.setdefault(one, []).append(p)
+                        continue
+                    groups.setdefault(sql, []).append(params)
+                self._write_groups(groups)
+            self.batches += 1
+        except sqlite3.Error as e:
+            self.errors += 1
+            print(f"⚠️ Feedback writer dropped a batch of {len(batch) - len(waiters)} rows: {e}")
+        finally:
+            for done in waiters:
+                done.set()
+
+
+class Retention:
+    """
+    Keeps feedback.db from growing without bound.
+
+    Unlabelled rows older than `horizon` seconds are folded into per-minute,
+    per-source score histograms (feedback_rollup) and deleted, `batch_rows` at
+    a time. Each batch is one step on the write-behind queue, so it commits
+    between the writer's ordinary batches and never holds the database for
+    long. Texts no longer referenced by any row are dropped with them.
+    Labelled rows are kept forever.
+    """
+
+    def __init__(self, writer: WriteBehind, horizon: float = FEEDBACK_RETENTION_SECONDS,
+                 batch_rows: int = FEEDBACK_PRUNE_BATCH, interval: float = FEEDBACK_PRUNE_INTERVAL,
+                 bins: int = FEEDBACK_HISTOGRAM_BINS, start: bool = True):
+        self.writer = writer
+        self.horizon = horizon
+        self.batch_rows = batch_rows
+        self.interval = interval
+        self.bins = bins
+        self.rolled_up = self.texts_dropped = 0
+        self._stop = threading.Event()
+        self._thread = None
+        if start:
+            self._thread = threading.Thread(target=self._run, name="feedback-retention", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.run_once()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def run_once(self, now: Optional[float] = None) -> int:
+        """Roll up and delete everything past the horizon, one batch per write transaction. Returns rows removed."""
+        cutoff = (time.time() if now is None else now) - self.horizon
+        total = 0
+        while not self._stop.is_set():
+            job = {"cutoff": cutoff, "rows": 0, "done": threading.Event()}
+            self.writer.put(self._step, job)
+            self.writer.put(None, job["done"])  # flush marker: commit the step now, not after flush_seconds
+            if not job["done"].wait(60):
+                break  # writer closed or stuck; try again next pass
+            total += job["rows"]
+            if job["rows"] < self.batch_rows:
+                break
+        return total
+
+    def _step(self, conn: sqlite3.Connection, job: dict):
+        # runs on the writer thread, inside its transaction; a savepoint keeps a failure here
+        # from taking the batch's other writes down with it
+        conn.execute("SAVEPOINT retention")
+        try:
+            rows = conn.execute(
+                "SELECT id, timestamp, score, source, text_hash FROM feedback "
+                "WHERE is_true_anomaly IS NULL AND timestamp < ? ORDER BY timestamp LIMIT ?",
+                (job["cutoff"], self.batch_rows),
+            ).fetchall()
+            histogram = Counter()
+            for _, ts, score, source, _ in rows:
+                bucket = min(max(int((score or 0.0) * self.bins), 0), self.bins - 1)
+                histogram[(int(ts // 60), source or "", bucket)] += 1
+            conn.executemany(
+                "INSERT INTO feedback_rollup (minute, source, bucket, n) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (minute, source, bucket) DO UPDATE SET n = n + excluded.n",
+                [(*key, n) for key, n in histogram.items()],
+            )
+            conn.executemany("DELETE FROM feedback WHERE id = ?", [(row[0],) for row in rows])
+            hashes = {row[4] for row in rows if row[4] is not None}
+            before = conn.total_changes
+            conn.executemany(
+                "DELETE FROM texts WHERE hash = ? AND NOT EXISTS (SELECT 1 FROM feedback WHERE text_hash = ?)",
+                [(h, h) for h in hashes],
+            )
+            self.texts_dropped += conn.total_changes - before
+            conn.execute("RELEASE retention")
+            job["rows"] = len(rows)
+            self.rolled_up += len(rows)
+        except sqlite3.Error as e:
+            conn.execute("ROLLBACK TO retention")
+            conn.execute("RELEASE retention")
+            print(f"⚠️ Feedback retention step failed: {e}")
+
+
+class YoudenThreshold:
+    """
+    Youden's J cut over labelled scores, kept from per-score label counts.
+
+    Scores live in a sorted array with a positive and a negative count each, so
+    TP/FP at every cut are suffix sums and one recompute is O(d) in the number
+    of distinct scores (known scores are bumped in place, new ones inserted). With `bins` > 0
+    scores are floored to multiples of 1/bins and the cut is a bin edge, which
+    bounds memory at bins + 1 entries.
+    """
+
+    def __init__(self, bins: int = FEEDBACK_SCORE_BINS, default: float = ANOMALY_THRESHOLD):
+        self.bins = bins
+        self.default = default
+        self.scores = np.empty(0)               # distinct (binned) scores, ascending
+        self.counts = np.zeros((0, 2), np.int64)  # [negatives, positives] per score
+        self._pending = {}                      # score -> [negatives, positives] not merged yet
+        self.labels = [0, 0]                    # total negatives, positives
+        self.value = default
+        self.dirty = False
+
+    def key(self, score: float) -> float:
+        return math.floor(score * self.bins) / self.bins if self.bins else score
+
+    def add(self, score: float, label: int, n: int = 1):
+        if math.isnan(score):
+            return
+        counts = self._pending.get(self.key(score))
+        if counts is None:
+            counts = self._pending[self.key(score)] = [0, 0]
+        counts[label] += n
+        self.labels[label] += n
+        self.dirty = True
+
+    def add_many(self, scores: np.ndarray, labels: np.ndarray, n: Optional[np.ndarray] = None):
+        """Vectorized add (used at startup): arrays of scores, 0/1 labels and optional row counts."""
+        n = np.ones(len(scores), np.int64) if n is None else n
+        keep = ~np.isnan(scores)
+        scores, labels, n = scores[keep], labels[keep], n[keep]
+        if self.bins:
+            scores = np.floor(scores * self.bins) / self.bins
+        keys, inverse = np.unique(scores, return_inverse=True)
+        counts = np.zeros((len(keys), 2), np.int64)
+        np.add.at(counts, (inverse.ravel(), labels), n)
+        self._merge_arrays(keys, counts)
+        self.labels[0] += int(counts[:, 0].sum())
+        self.labels[1] += int(counts[:, 1].sum())
+        self.dirty = True
+
+    def _merge(self):
+        if not self._pending:
+            return
+        keys = np.fromiter(self._pending, float, len(self._pending))
+        counts = np.array(list(self._pending.values()), np.int64)
+        self._pending = {}
+        self._merge_arrays(keys, counts)
+
+    def _merge_arrays(self, keys: np.ndarray, counts: np.ndarray):
+        # keys are distinct; known scores are bumped in place, new ones inserted in order
+        pos = np.searchsorted(self.scores, keys)
+        known = pos < len(self.scores)
+        known[known] = self.scores[pos[known]] == keys[known]
+        self.counts[pos[known]] += counts[known]
+        if not known.all():
+            new = ~known
+            order = np.argsort(keys[new])
+            self.scores = np.insert(self.scores, pos[new][order], keys[new][order])
+            self.counts = np.insert(self.counts, pos[new][order], counts[new][order], axis=0)
+
+    def compute(self) -> float:
+        self._merge()
+        self.dirty = False
+        if not len(self.scores):
+            self.value = self.default
+            return self.value
+        # rows at or above each cut: suffix sums of the ascending counts
+        above = np.cumsum(self.counts[::-1], axis=0)[::-1]
+        fp, tp = above[:, 0], above[:, 1]
+        neg, pos = above[0]
+        # same arithmetic as the per-cut loop this replaces, so J values (and ties) are bit-identical
+        tpr = tp / pos if pos > 0 else np.zeros(len(tp))
+        fpr = fp / neg if neg > 0 else np.zeros(len(fp))
+        j = tpr - fpr
+        best_j = j.max()
+        if not best_j > -1.0:
+            self.value = self.default
+            return self.value
+        tied = np.flatnonzero(j == best_j)
+        if len(tied) == 1:
+            self.value = float(self.scores[tied[0]])
+        else:
+            # the old loop kept the first maximum in set() iteration order; ties are rare, so pay for the set only then
+            tied_scores = set(self.scores[tied].tolist())
+            self.value = next(s for s in set(self.scores.tolist()) if s in tied_scores)
+        return self.value
+
+    def __len__(self):
+        return len(self.scores) + len(self._pending)
+
 
 class FeedbackStore:
-    def __init__(self, db_path=DB_PATH):
-        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+    """
+    Feedback rows plus adaptive thresholds: a global one, and one per template
+    ID and per source once that group has FEEDBACK_GROUP_MIN_LABELS labels of
+    both kinds. threshold_for() looks them up from memory.
+    """
+
+    def __init__(self, db_path=DB_PATH, bins: int = FEEDBACK_SCORE_BINS, queue_size: int = FEEDBACK_QUEUE_SIZE,
+                 batch_rows: int = FEEDBACK_BATCH_ROWS, flush_seconds: float = FEEDBACK_FLUSH_SECONDS,
+                 group_min_labels: int = FEEDBACK_GROUP_MIN_LABELS, retention: float = FEEDBACK_RETENTION_SECONDS,
+                 prune_interval: float = FEEDBACK_PRUNE_INTERVAL):
+        self.db_path = db_path
+        self.conn = connect(db_path)  # write connection; owned by the writer thread once it starts
         self._init()
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.bins = bins
+        self.group_min_labels = group_min_labels
+        self.youden = YoudenThreshold(bins=bins)
+        self.groups = {}             # ("template" | "source", key) -> YoudenThreshold
+        self.group_thresholds = {}   # same keys -> threshold, only for groups with enough labels
+        self._dirty_groups = set()
+        self._load_counts()
+        # writes are queued and committed in batches by a background thread
+        self.writer = WriteBehind(self.conn, queue_size, batch_rows, flush_seconds)
+        # old unlabelled rows are rolled up into histograms and pruned in the background
+        self.retention = Retention(self.writer, horizon=retention, interval=prune_interval, start=retention > 0)
+        atexit.register(self.close)
+        self.refresh()
+
+    def reader(self) -> sqlite3.Connection:
+        """This thread's read-only connection (with WAL it reads while the writer commits)."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = connect(self.db_path, readonly=True)
+        return conn
+
+    def flush(self):
+        """Wait until every queued write is committed (e.g. before reading rows just added)."""
+        self.writer.flush()
+
+    def close(self):
+        self.retention.stop()
+        self.writer.close()
 
     def _init(self):
         cur = self.conn.cursor()
@@ -18,6 +388,46 @@ class FeedbackStore:
             is_true_anomaly INTEGER
         )
         """)
+        # columns added after the first schema: template and source of the window's last line
+        columns = {row[1] for row in cur.execute("PRAGMA table_info(feedback)")}
+        # and the content hash of its text, which lives once in `texts`
+        for column, kind in (("template_id", "TEXT"), ("source", "TEXT"), ("text_hash", "BLOB")):
+            if column not in columns:
+                cur.execute(f"ALTER TABLE feedback ADD COLUMN {column} {kind}")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_feedback_template ON feedback (template_id)")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_feedback_source ON feedback (source)")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_feedback_text ON feedback (text_hash)")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_feedback_time ON feedback (timestamp)")
+        # retention walks unlabelled rows oldest first without stepping over the labelled ones it keeps
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_feedback_unlabelled ON feedback (timestamp) WHERE is_true_anomaly IS NULL")
+        # Deduplicated window texts
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS texts (
+            hash BLOB PRIMARY KEY,
+            text TEXT
+        ) WITHOUT ROWID
+        """)
+        # Per-minute score histograms of pruned unlabelled rows
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS feedback_rollup (
+            minute INTEGER,
+            source TEXT,
+            bucket INTEGER,
+            n INTEGER,
+            PRIMARY KEY (minute, source, bucket)
+        ) WITHOUT ROWID
+        """)
+        # Per-group thresholds
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS thresholds (
+            scope TEXT,
+            group_key TEXT,
+            value REAL,
+            labelled INTEGER,
+            updated_at REAL,
+            PRIMARY KEY (scope, group_key)
+        )
+        """)
         # Settings table
         cur.execute("""
         CREATE TABLE IF NOT EXISTS settings (
@@ -27,49 +437,155 @@ class FeedbackStore:
         """)
         self.conn.commit()
 
-    def add_feedback(self, ts, log_text, score, is_true_anomaly: bool):
-        cur = self.conn.cursor()
-        cur.execute(
-            "INSERT INTO feedback (timestamp, sequence_text, score, is_true_anomaly) VALUES (?, ?, ?, ?)",
-            (ts, log_text, float(score), int(bool(is_true_anomaly)))
+    def _load_counts(self, chunk_rows: int = 200000):
+        # one scan at startup feeds the global and every group's counts, aggregated in NumPy a chunk at a time
+        # (cheaper than an SQL GROUP BY over four columns); after that the counts follow add_feedback
+        cur = self.conn.execute(
+            "SELECT score, is_true_anomaly, template_id, source FROM feedback "
+            "WHERE is_true_anomaly IS NOT NULL AND score IS NOT NULL"
         )
-        self.conn.commit()
+        while True:
+            rows = cur.fetchmany(chunk_rows)
+            if not rows:
+                break
+            scores, labels, template_ids, sources = zip(*rows)
+            scores = np.array(scores, float)
+            labels = (np.array(labels) != 0).astype(np.int64)
+            self.youden.add_many(scores, labels)
+            for scope, keys in (("template", template_ids), ("source", sources)):
+                keys = np.array(["" if k is None else str(k) for k in keys])
+                names, codes = np.unique(keys, return_inverse=True)
+                order = np.argsort(codes, kind="stable")
+                bounds = np.searchsorted(codes[order], np.arange(len(names) + 1))
+                for i, name in enumerate(names.tolist()):
+                    if not name:
+                        continue  # rows without a template / source only count globally
+                    rows_i = order[bounds[i]:bounds[i + 1]]
+                    key = (scope, name)
+                    group = self.groups.get(key)
+                    if group is None:
+                        group = self.groups[key] = YoudenThreshold(bins=self.bins)
+                    group.add_many(scores[rows_i], labels[rows_i])
+                    self._dirty_groups.add(key)
+
+    def _count(self, score: float, label: int, template_id: Optional[str], source: Optional[str], n: int = 1):
+        self.youden.add(score, label, n)
+        for key in (("template", template_id), ("source", source)):
+            if not key[1]:
+                continue
+            group = self.groups.get(key)
+            if group is None:
+                group = self.groups[key] = YoudenThreshold(bins=self.bins)
+            group.add(score, label, n)
+            self._dirty_groups.add(key)
+
+    def add_feedback(self, ts, log_text, score, is_true_anomaly: bool,
+                     template_id: Optional[str] = None, source: Optional[str] = None):
+        """
+        Queue one scored window for the writer thread. is_true_anomaly=None is
+        stored as NULL and does not move the thresholds; labelled rows count
+        towards them immediately, before they are committed. `template_id` and
+        `source` (see group_keys) place the row in its per-group thresholds.
+        """
+        label = None if is_true_anomaly is None else int(bool(is_true_anomaly))
+        template_id = None if template_id is None else str(template_id)
+        digest = None
+        if log_text is not None:
+            # the text is stored once per distinct content; rows keep its hash
+            digest = hashlib.blake2b(str(log_text).encode("utf-8"), digest_size=16).digest()
+        row = (ts, None, float(score), label, template_id, source, digest)
+        if digest is None:
+            self.writer.put(INSERT_FEEDBACK, row)
+        else:
+            # one queue item, so a retention step can't land between the text and the row referencing it
+            self.writer.put((INSERT_TEXT, INSERT_FEEDBACK), ((digest, str(log_text)), row))
+        if label is not None:
+            with self._lock:
+                self._count(float(score), label, template_id, source)
+
+    def labelled_texts(self, is_anomaly: bool, limit=None):
+        cur = self.reader().cursor()
+        # rows written before texts were deduplicated still carry sequence_text
+        query = ("SELECT COALESCE(f.sequence_text, t.text) FROM feedback f LEFT JOIN texts t ON t.hash = f.text_hash "
+                 "WHERE f.is_true_anomaly = ? ORDER BY f.id DESC")
+        params = [int(is_anomaly)]
+        if limit:
+            query += " LIMIT ?"
+            params.append(int(limit))
+        cur.execute(query, params)
+        return [row[0] for row in cur.fetchall()]
+
+    def score_histogram(self, start: float, end: float, source: Optional[str] = None) -> Dict[int, np.ndarray]:
+        """
+        Per-minute score histograms (FEEDBACK_HISTOGRAM_BINS buckets over [0, 1])
+        for timestamps in [start, end): rolled-up minutes plus the raw rows still
+        in the table. Keys are epoch minutes.
+        """
+        bins = self.retention.bins
+        where, params = "", []
+        if source is not None:
+            where, params = " AND source = ?", [source]
+        rows = self.reader().execute(
+            f"SELECT minute, bucket, SUM(n) FROM ("
+            f" SELECT minute, bucket, n FROM feedback_rollup WHERE minute >= ? AND minute < ?{where}"
+            f" UNION ALL"
+            f" SELECT CAST(timestamp / 60 AS INTEGER), MIN(MAX(CAST(COALESCE(score, 0) * ? AS INTEGER), 0), ?), 1"
+            f" FROM feedback WHERE timestamp >= ? AND timestamp < ?{where}"
+            f") GROUP BY 1, 2",
+            [int(start // 60), int(math.ceil(end / 60)), *params, bins, bins - 1, start, end, *params],
+        ).fetchall()
+        out = {}
+        for minute, bucket, n in rows:
+            out.setdefault(minute, np.zeros(bins, np.int64))[bucket] = n
+        return out
 
     def save_threshold(self, value: float):
-        cur = self.conn.cursor()
-        cur.execute(
-            "INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)",
-            ("anomaly_threshold", value)
-        )
-        self.conn.commit()
+        self.writer.put("INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)", ("anomaly_threshold", value))
 
     def load_threshold(self, default: float):
-        cur = self.conn.cursor()
+        cur = self.reader().cursor()
         cur.execute("SELECT value FROM settings WHERE key=?", ("anomaly_threshold",))
         row = cur.fetchone()
         return row[0] if row else default
 
+    def threshold(self) -> float:
+        """The current Youden-J threshold; recomputed (and saved) only after labelled feedback arrived."""
+        if self.youden.dirty:
+            return self.compute_threshold()
+        return self.youden.value
+
+    def refresh(self):
+        """Recompute the thresholds of the groups that received labels since the last refresh."""
+        with self._lock:
+            dirty, self._dirty_groups = self._dirty_groups, set()
+            now = time.time()
+            for key in dirty:
+                group = self.groups[key]
+                negatives, positives = group.labels
+                if min(negatives, positives) == 0 or negatives + positives < self.group_min_labels:
+                    continue  # too few labels to trust; the group falls back to the next scope
+                self.group_thresholds[key] = group.compute()
+                self.writer.put(SAVE_GROUP_THRESHOLD, (*key, group.value, negatives + positives, now))
+
+    def threshold_for(self, template_id: Optional[str] = None, source: Optional[str] = None) -> float:
+        """Threshold for a window: its template's, else its source's, else the global one."""
+        if self._dirty_groups:
+            self.refresh()
+        if template_id is not None:
+            value = self.group_thresholds.get(("template", str(template_id)))
+            if value is not None:
+                return value
+        if source is not None:
+            value = self.group_thresholds.get(("source", source))
+            if value is not None:
+                return value
+        return self.threshold()
+
     def compute_threshold(self):
-        cur = self.conn.cursor()
-        cur.execute("SELECT score, is_true_anomaly FROM feedback")
-        rows = cur.fetchall()
-        if not rows:
-            return ANOMALY_THRESHOLD
-        rows.sort()
-        best = ANOMALY_THRESHOLD
-        best_j = -1.0
-        scores = [r[0] for r in rows]
-        for cut in set(scores):
-            tp = sum(1 for s, l in rows if s >= cut and l == 1)
-            fn = sum(1 for s, l in rows if s < cut and l == 1)
-            fp = sum(1 for s, l in rows if s >= cut and l == 0)
-            tn = sum(1 for s, l in rows if s < cut and l == 0)
-            tpr = tp / (tp + fn) if (tp + fn) > 0 else 0.0
-            fpr = fp / (fp + tn) if (fp + tn) > 0 else 0.0
-            j = tpr - fpr
-            if j > best_j:
-                best_j = j
-                best = cut
-        print(f"Computed anomaly threshold: {best:.3f} (based on {len(rows)} feedback records)")
-        self.save_threshold(best)
+        with self._lock:
+            if not len(self.youden):
+                return ANOMALY_THRESHOLD
+            best = self.youden.compute()
+            self.save_threshold(best)
+        print(f"Computed anomaly threshold: {best:.3f} (based on {len(self.youden):,} distinct labelled scores)")
         return best
@@ -1,30 +1,577 @@
 from drain3 import TemplateMiner
+from drain3.file_persistence import FilePersistence
 from drain3.template_miner_config import TemplateMinerConfig
-from typing import Tuple
+from collections import OrderedDict, defaultdict
+from typing import Any, Dict, List, Optional, Tuple
 from fetch_logs import tail_file  
+from config import (TEMPLATE_CACHE_SIZE, DRAIN_SNAPSHOT_PATH, DRAIN_SNAPSHOT_SECONDS,
+                    DRAIN_SNAPSHOT_CHANGES, DRAIN_SHARDS)
 import json
+import multiprocessing as mp
+import os
+import pickle
+import re
+import time
+import zlib
+
+from log_record import LogRecord, template_of
+
+
+class TemplateVocab:
+    """
+    Token IDs for every Drain template, tokenized once per template version.
+
+    Windows of mined LogRecords or (ts, template, template_id, raw) tuples are then assembled by
+    concatenating the cached IDs with the `<sep>` IDs instead of re-tokenizing
+    the `sequence_to_text` string. For WordPiece tokenizers (BERT family) the
+    result is identical to tokenizing the joined text.
+    """
+
+    def __init__(self, tokenizer):
+        self.tokenizer = tokenizer
+        self.templates = {}   # template_id -> template text the IDs were built from
+        self.token_ids = {}   # template_id -> token IDs of "[TID:x] template"
+        self.sep_ids = tokenizer(" <sep> ", add_special_tokens=False)["input_ids"]
+        # locate the special tokens ([CLS] ... [SEP] for BERT) around a one-token probe
+        probe = tokenizer("a", add_special_tokens=False)["input_ids"]
+        full = tokenizer("a")["input_ids"]
+        start = full.index(probe[0])
+        self.prefix_ids, self.suffix_ids = full[:start], full[start + len(probe):]
+
+    def update(self, template_id: str, template: str):
+        # called for every mined line; only new or changed templates hit the tokenizer
+        if self.templates.get(template_id) != template:
+            self.templates[template_id] = template
+            self.token_ids[template_id] = self.tokenizer(
+                f"[TID:{template_id}] {template}", add_special_tokens=False
+            )["input_ids"]
+
+    def covers(self, sequence: List) -> bool:
+        # every item must be a mined line whose template is still the cached version
+        for item in sequence:
+            mined = template_of(item)
+            if mined is None:
+                return False
+            tid, template = mined
+            if self.templates.get(tid) != template:
+                return False
+        return bool(sequence)
+
+    def window_ids(self, sequence: List, max_length: int) -> List[int]:
+        budget = max_length - len(self.prefix_ids) - len(self.suffix_ids)
+        ids = []
+        for i, item in enumerate(sequence):
+            tid = template_of(item)[0]
+            if i:
+                ids.extend(self.sep_ids)
+            ids.extend(self.token_ids[tid])
+            if len(ids) >= budget:
+                break
+        return self.prefix_ids + ids[:budget] + self.suffix_ids
+
+
+class MaskedTemplateCache:
+    """
+    Exact-match lookup in front of Drain: masked line -> cluster ID.
+
+    Variable tokens (UUIDs, IPs, paths, hex, numbers) are replaced with
+    placeholders. A masked line is only cached when Drain would answer every
+    line with that mask from the same cluster: the lines take one path down
+    the tree, the cluster's template has `<*>` at every masked position, and no
+    other cluster in the leaf could score as high for any of them. Entries are
+    indexed by leaf and dropped whenever Drain creates or changes a cluster
+    there (or creates the tree node that a line used to miss and fall back to
+    `<*>` for), when their cluster's template changes, or when Drain evicts it.
+    Bounded LRU.
+    """
+
+    # alternatives are tried left to right at each position, so specific shapes come first
+    MASK = re.compile("|".join([
+        r"(?P<UUID>\b[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}\b)",
+        r"(?P<IP>\b\d{1,3}(?:\.\d{1,3}){3}(?::\d+)?\b)",
+        r"(?P<PATH>(?<![\w/])(?:/[\w.@%+-]+)+/?)",
+        r"(?P<HEX>\b0[xX][0-9a-fA-F]+\b|\b(?=[0-9a-fA-F]*\d)[0-9a-fA-F]{8,}\b)",
+        r"(?P<NUM>(?<!\w)[-+]?\d+(?:\.\d+)?)",
+    ]))
+    MASKABLE = re.compile(r"[\d/]")  # every pattern needs a digit or a slash
+    PLACEHOLDER = re.compile(r"<(?:UUID|IP|PATH|HEX|NUM)>")
+    DIGITLESS = re.compile(r"<(?:UUID|PATH)>")  # may stand for a token without digits, which Drain routes by value
+
+    def __init__(self, max_entries: int = TEMPLATE_CACHE_SIZE):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()        # masked line -> (cluster_id, leaf, fallbacks)
+        self.by_cluster = defaultdict(set)  # cluster_id -> masked lines, for invalidation
+        self.by_leaf = defaultdict(set)     # (token count, path) -> masked lines answered from that leaf
+        self.by_fallback = defaultdict(set) # (token count, path so far, token) -> masked lines that took `<*>` there
+        self.leaf_of = {}                   # cluster_id -> leaf it lives in, when known
+        self.hits = self.misses = self.evictions = self.invalidations = 0
+
+    def mask(self, line: str) -> str:
+        if not self.MASKABLE.search(line):
+            return line
+        return self.MASK.sub(lambda m: f"<{m.lastgroup}>", line)
+
+    def get(self, key: str, clusters) -> Optional[Any]:
+        """The live Drain cluster for `key`, or None. `clusters` is drain.id_to_cluster."""
+        entry = self.entries.get(key)
+        cluster = clusters.get(entry[0]) if entry is not None else None
+        if cluster is None:
+            if entry is not None:
+                self.invalidate(entry[0])  # Drain evicted the cluster
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return cluster
+
+    @staticmethod
+    def path(drain, tokens: List[str]):
+        """
+        The route tree_search takes for `tokens`: (leaf node, leaf key, fallbacks), or None
+        when there is no leaf. A fallback is a level where the token had no child of its own.
+        """
+        n = len(tokens)
+        node = drain.root_node.key_to_child_node.get(str(n))
+        if node is None:
+            return None
+        keys, fallbacks = [], []
+        for depth, token in enumerate(tokens, 1):
+            if depth >= drain.max_node_depth or depth == n:
+                break
+            child = node.key_to_child_node.get(token)
+            if child is None:
+                child = node.key_to_child_node.get(drain.param_str)
+                if child is None:
+                    return None
+                fallbacks.append((n, tuple(keys), token))
+                token = drain.param_str
+            keys.append(token)
+            node = child
+        return node, (n, tuple(keys)), fallbacks
+
+    def put(self, key: str, tokens: List[str], cluster, drain):
+        """Cache `key` -> `cluster`, which Drain just matched for a line with these raw `tokens`."""
+        if self.max_entries <= 0:
+            return
+        key_tokens = key.split()
+        template = cluster.log_template_tokens
+        if not key_tokens or len(key_tokens) != len(tokens) or not self.covers(key_tokens, template):
+            return
+        if any(self.DIGITLESS.search(tok) for tok in key_tokens[:drain.max_node_depth - 1]):
+            return  # lines with this mask could take different paths
+        route = self.path(drain, tokens)
+        if route is None:
+            return
+        node, leaf, fallbacks = route
+        self.leaf_of[cluster.cluster_id] = leaf
+        if not self._dominates(drain, node.cluster_ids, cluster, key_tokens):
+            return
+        old = self.entries.get(key)
+        if old is not None:
+            self._drop(key)
+        self.entries[key] = (cluster.cluster_id, leaf, fallbacks)
+        self.by_cluster[cluster.cluster_id].add(key)
+        self.by_leaf[leaf].add(key)
+        for fallback in fallbacks:
+            self.by_fallback[fallback].add(key)
+        while len(self.entries) > self.max_entries:
+            self._drop(next(iter(self.entries)))
+            self.evictions += 1
+
+    def covers(self, key_tokens: List[str], template_tokens: Tuple[str, ...]) -> bool:
+        if len(key_tokens) != len(template_tokens):
+            return False
+        for tok, tmpl in zip(key_tokens, template_tokens):
+            if tmpl != "<*>" and (tok != tmpl or self.PLACEHOLDER.search(tok)):
+                return False
+        return True
+
+    def _dominates(self, drain, cluster_ids, cluster, key_tokens: List[str]) -> bool:
+        # fast_match picks the highest (similarity, <*> count), the first one on a tie. The cached
+        # cluster's score is the same for every line with this mask; another cluster's is bounded
+        # by assuming each masked token could equal its literal there
+        n = len(key_tokens)
+        params = sum(t == drain.param_str for t in cluster.log_template_tokens)
+        sim = n - params
+        if sim / n < drain.sim_th:
+            return False
+        earlier = True
+        for cid in cluster_ids:
+            if cid == cluster.cluster_id:
+                earlier = False
+                continue
+            other = drain.id_to_cluster.get(cid)
+            if other is None:
+                continue
+            best = other_params = 0
+            for tmpl, tok in zip(other.log_template_tokens, key_tokens):
+                if tmpl == drain.param_str:
+                    other_params += 1
+                elif tmpl == tok or self.PLACEHOLDER.search(tok):
+                    best += 1
+            if best > sim or (best == sim and (other_params >= params if earlier else other_params > params)):
+                return False
+        return True
+
+    def changed(self, drain, cluster, created: bool):
+        """Drain created or re-templated `cluster`: drop every entry whose answer may now differ."""
+        if created:
+            route = self.path(drain, list(cluster.log_template_tokens))
+            if route is None:
+                return
+            leaf = self.leaf_of[cluster.cluster_id] = route[1]
+            # nodes this cluster added steer lines that used to fall back to <*> elsewhere
+            n, keys = leaf
+            for depth, token in enumerate(keys):
+                if token != drain.param_str:
+                    self._drop_all(self.by_fallback.get((n, keys[:depth], token)))
+        else:
+            self._drop_all(self.by_cluster.get(cluster.cluster_id))
+            leaf = self.leaf_of.get(cluster.cluster_id)
+            if leaf is None:
+                # not seen since a restart: its leaf is unknown, so clear its whole token-count group
+                n = len(cluster.log_template_tokens)
+                for other in [k for k in self.by_leaf if k[0] == n]:
+                    self._drop_all(self.by_leaf.get(other))
+                return
+        self._drop_all(self.by_leaf.get(leaf))
+
+    def invalidate(self, cluster_id: int):
+        self._drop_all(self.by_cluster.get(cluster_id))
+        self.leaf_of.pop(cluster_id, None)
+
+    def _drop_all(self, keys):
+        for key in list(keys or ()):
+            self._drop(key)
+            self.invalidations += 1
+
+    def _drop(self, key: str):
+        cluster_id, leaf, fallbacks = self.entries.pop(key)
+        for index, name in ((self.by_cluster, cluster_id), (self.by_leaf, leaf)):
+            keys = index[name]
+            keys.discard(key)
+            if not keys:
+                del index[name]
+        for fallback in fallbacks:
+            keys = self.by_fallback[fallback]
+            keys.discard(key)
+            if not keys:
+                del self.by_fallback[fallback]
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
+
+
+class AtomicFilePersistence(FilePersistence):
+    """FilePersistence that never leaves a half-written snapshot: write a temp file, fsync, rename."""
+
+    def save_state(self, state):
+        directory = os.path.dirname(os.path.abspath(self.file_path))
+        os.makedirs(directory, exist_ok=True)
+        tmp = f"{self.file_path}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(state)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.file_path)
+
+
+class SnapshottingTemplateMiner(TemplateMiner):
+    """
+    TemplateMiner with a cheaper snapshot policy and format.
+
+    Stock drain3 snapshots on every cluster change, which with thousands of
+    clusters means re-serializing the whole tree for most new lines. Here a
+    snapshot is taken after `every_changes` changes, or `every_seconds` after
+    the first unsaved change. State is pickled and zlib-compressed, several
+    times faster to write and read than drain3's jsonpickle + base64; snapshots
+    written by stock drain3 still load.
+    """
+
+    MAGIC = b"LBDRAIN1"
+
+    def __init__(self, persistence_handler=None, config=None,
+                 every_seconds: float = DRAIN_SNAPSHOT_SECONDS, every_changes: int = DRAIN_SNAPSHOT_CHANGES):
+        self.every_seconds = every_seconds
+        self.every_changes = every_changes
+        self.unsaved_changes = 0
+        self.first_unsaved = None
+        super().__init__(persistence_handler, config)
+
+    def get_snapshot_reason(self, change_type, cluster_id):
+        if change_type != "none":
+            self.unsaved_changes += 1
+            if self.first_unsaved is None:
+                self.first_unsaved = time.time()
+        if not self.unsaved_changes:
+            return None
+        if self.unsaved_changes >= self.every_changes:
+            return f"{self.unsaved_changes} changes"
+        if time.time() - self.first_unsaved >= self.every_seconds:
+            return "periodic"
+        return None
+
+    def save_if_due(self):
+        """The `every_seconds` check for lines that never reach Drain (template cache hits)."""
+        if self.first_unsaved is not None and self.persistence_handler is not None \
+                and time.time() - self.first_unsaved >= self.every_seconds:
+            self.save_state("periodic")
+            self.last_save_time = time.time()
+
+    def save_state(self, snapshot_reason):
+        drain = self.drain
+        state = pickle.dumps((drain.clusters_counter, drain.id_to_cluster, drain.root_node),
+                             protocol=pickle.HIGHEST_PROTOCOL)
+        self.persistence_handler.save_state(self.MAGIC + zlib.compress(state, 1))
+        self.unsaved_changes = 0
+        self.first_unsaved = None
+
+    def load_state(self):
+        state = self.persistence_handler.load_state()
+        if state is None or not state.startswith(self.MAGIC):
+            # nothing saved, or a stock drain3 snapshot (needs snapshot_compress_state to match how it was written)
+            return super().load_state() if state is not None else None
+        counter, id_to_cluster, root_node = pickle.loads(zlib.decompress(state[len(self.MAGIC):]))
+        self.drain.clusters_counter = counter
+        self.drain.id_to_cluster = id_to_cluster
+        self.drain.root_node = root_node
+
+    def flush(self):
+        """Write any unsaved changes now (e.g. at shutdown)."""
+        if self.persistence_handler is not None and self.unsaved_changes:
+            self.save_state("flush")
+            self.last_save_time = time.time()
+
+
+class TemplateRegistry:
+    """
+    Global template IDs for sharded mining.
+
+    Each shard's clusters are mapped to integer IDs issued in input order, so the
+    IDs don't depend on the number of shards or on which shard answers first.
+    IDs are keyed on (shard, local cluster id), so two clusters stay two
+    templates even when their text matches, as in a single miner. A restarted
+    shard starts a fresh map: its clusters get new IDs, never a dead cluster's.
+    """
+
+    def __init__(self, shards: int):
+        self.ids = [{} for _ in range(shards)]  # per shard: local cluster id -> global id
+        self.templates = {}                     # global id -> latest template text
+        self.next_id = 1
+
+    def resolve(self, shard: int, local_id: int, template: Optional[str] = None) -> int:
+        """Global ID of a shard's cluster; `template` records its text when it is new or changed."""
+        gid = self.ids[shard].get(local_id)
+        if gid is None:
+            gid = self.ids[shard][local_id] = self.next_id
+            self.next_id += 1
+        if template is not None:
+            self.templates[gid] = template
+        return gid
+
+    def reset_shard(self, shard: int):
+        self.ids[shard] = {}
+
+
+def _shard_main(conn, depth, sim_threshold, cache_size):
+    # one miner per process. A batch comes back as the local cluster id of every line, plus
+    # (position, cluster id, template) wherever a cluster's template differs from what was last sent
+    drain = DrainWrapper(depth, sim_threshold, cache_size=cache_size, snapshot_path="", shards=1)
+    sent = {}
+    while True:
+        lines = conn.recv()
+        if lines is None:
+            break
+        ids, changes = [], []
+        for pos, line in enumerate(lines):
+            template, tid = drain.add_log_line(line)
+            cid = int(tid)
+            ids.append(cid)
+            if sent.get(cid) != template:
+                sent[cid] = template
+                changes.append((pos, cid, template))
+        conn.send((ids, changes))
+    conn.close()
+
+
+def shard_key(line: str) -> int:
+    """
+    Drain's first tree level: the token count. Lines are only ever compared with lines of
+    the same length, but anything finer is unsafe: a line whose first token has no node of
+    its own falls back to the `<*>` branch and can join a cluster started by another token.
+    """
+    return len(line.split())
 
 
 class DrainWrapper:
-    def __init__(self, depth: int = 4, sim_threshold: float = 0.5):
+    def __init__(self, depth: int = 4, sim_threshold: float = 0.5, tokenizer=None,
+                 cache_size: int = TEMPLATE_CACHE_SIZE, snapshot_path: str = DRAIN_SNAPSHOT_PATH,
+                 shards: int = DRAIN_SHARDS):
+        # pass the LogBERT tokenizer to keep template token IDs ready for inference
+        self.vocab = TemplateVocab(tokenizer) if tokenizer is not None else None
+        self.shards = shards
+        if shards > 1:
+            # sharded mining: lines with the same token count, which Drain may compare, always go to
+            # the same process.
+            # Shard state is not snapshotted.
+            self.miner = self.cache = None
+            self.registry = TemplateRegistry(shards)
+            self._shard_args = (depth, sim_threshold, cache_size)
+            self._conns, self._procs = [None] * shards, [None] * shards
+            for shard in range(shards):
+                self._start_shard(shard)
+            return
+
         cfg = TemplateMinerConfig()
 
         cfg.profiling_enabled = False
         cfg.drain_depth = depth
         cfg.drain_sim_th = sim_threshold
 
-        self.miner = TemplateMiner(config=cfg)
+        # with a snapshot path, the miner restores its clusters at startup so template IDs survive restarts
+        persistence = AtomicFilePersistence(snapshot_path) if snapshot_path else None
+        self.miner = SnapshottingTemplateMiner(persistence, config=cfg)
+        # lines whose masked form was seen before skip Drain's tree search
+        self.cache = MaskedTemplateCache(cache_size) if cache_size > 0 else None
+        if self.vocab is not None:
+            for cluster in self.miner.drain.clusters:
+                self.vocab.update(str(cluster.cluster_id), cluster.get_template())
 
     def add_log_line(self, logline: str) -> Tuple[str, str]:
         """
         Add logline to the miner and return (template, template_id).
         Always returns the latest generalized template for the cluster.
+        With shards > 1 each call is a pipe round trip; use add_log_lines.
         """
+        if self.shards > 1:
+            return self.add_log_lines([logline])[0]
+        key = None
+        if self.cache is not None:
+            key = self.cache.mask(logline)
+            clusters = self.miner.drain.id_to_cluster
+            cluster = self.cache.get(key, clusters)
+            if cluster is not None:
+                clusters[cluster.cluster_id]  # touch, as Drain does on a match
+                cluster.size += 1
+                self.miner.save_if_due()  # a stream of hits must not hold back unsaved changes
+                return cluster.get_template(), str(cluster.cluster_id)
+
         result = self.miner.add_log_message(logline)
         cluster_id = result.get("cluster_id")
         template = result.get("template_mined", logline)
+        if self.cache is not None:
+            drain = self.miner.drain
+            cluster = drain.id_to_cluster.get(cluster_id)
+            if cluster is not None:
+                change = result.get("change_type")
+                if change != "none":
+                    self.cache.changed(drain, cluster, created=change == "cluster_created")
+                self.cache.put(key, drain.get_content_as_tokens(logline), cluster, drain)
+        if self.vocab is not None:
+            self.vocab.update(str(cluster_id), template)
         return template, str(cluster_id)
 
+    def _start_shard(self, shard: int):
+        ctx = mp.get_context("fork")
+        parent, child = ctx.Pipe()
+        proc = ctx.Process(target=_shard_main, args=(child, *self._shard_args), daemon=True)
+        proc.start()
+        child.close()
+        self._conns[shard], self._procs[shard] = parent, proc
+
+    def _mine_on_shard(self, shard: int, batch: List[str], sent: bool):
+        # one batch round trip; a shard that died is restarted once (empty, so its clusters get new IDs)
+        for attempt in range(2):
+            try:
+                if not sent:
+                    self._conns[shard].send(batch)
+                return self._conns[shard].recv()
+            except (EOFError, OSError):
+                proc = self._procs[shard]
+                proc.join(timeout=1)
+                if attempt:
+                    raise RuntimeError(f"Drain shard {shard} exited again (exit code {proc.exitcode}) "
+                                       f"while mining a batch of {len(batch)} lines")
+                print(f"⚠️ Drain shard {shard} exited (exit code {proc.exitcode}); restarting it empty, "
+                      f"its templates get new IDs")
+                self._conns[shard].close()
+                self._start_shard(shard)
+                self.registry.reset_shard(shard)
+                sent = False
+
+    def add_log_lines(self, loglines: List[str]) -> List[Tuple[str, str]]:
+        """add_log_line for a batch; with shards > 1 the shards mine their share of it in parallel."""
+        if self.shards <= 1:
+            return [self.add_log_line(line) for line in loglines]
+        n = self.shards
+        routes = [shard_key(line) % n for line in loglines]
+        batches = [[] for _ in range(n)]
+        for line, shard in zip(loglines, routes):
+            batches[shard].append(line)
+        sent = []
+        for shard, batch in enumerate(batches):
+            try:
+                if batch:
+                    self._conns[shard].send(batch)
+                sent.append(True)
+            except OSError:
+                sent.append(False)  # dead shard; _mine_on_shard restarts it
+        replies = [self._mine_on_shard(shard, batch, sent[shard]) if batch else ([], [])
+                   for shard, batch in enumerate(batches)]
+
+        # input order, so global IDs are issued deterministically
+        ids = [iter(r[0]) for r in replies]
+        changes = [iter(r[1]) for r in replies]
+        pending = [next(c, None) for c in changes]  # next (position, cluster id, template) per shard
+        positions = [0] * n
+        registry, templates, vocab = self.registry, self.registry.templates, self.vocab
+        out = []
+        for shard in routes:
+            local_id = next(ids[shard])
+            pos = positions[shard]
+            positions[shard] = pos + 1
+            change = pending[shard]
+            if change is not None and change[0] == pos:
+                gid = registry.resolve(shard, local_id, change[2])
+                pending[shard] = next(changes[shard], None)
+            else:
+                gid = registry.ids[shard][local_id]
+            template = templates[gid]
+            tid = str(gid)
+            if vocab is not None:
+                vocab.update(tid, template)
+            out.append((template, tid))
+        return out
+
+    def add_records(self, records: List[LogRecord]) -> List[LogRecord]:
+        """Mine each record's message and fill in its template and template_id."""
+        for record, (template, tid) in zip(records, self.add_log_lines([r.message for r in records])):
+            record.template, record.template_id = template, tid
+        return records
+
+    def save_snapshot(self):
+        if self.miner is not None:
+            self.miner.flush()
+
+    def close(self):
+        """Stop the shard processes (no-op for a single miner)."""
+        for conn in getattr(self, "_conns", ()):
+            try:
+                conn.send(None)
+            except OSError:
+                pass  # already gone
+        for proc in getattr(self, "_procs", ()):
+            proc.join(timeout=5)
+        self._conns, self._procs = [], []
+
 
 # if __name__ == "__main__":
 #     drain = DrainWrapper()
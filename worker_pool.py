@@ -0,0 +1,236 @@
+import itertools
+import multiprocessing as mp
+import os
+from collections import defaultdict, deque
+from multiprocessing.connection import wait
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from config import INFER_BATCH_SIZE, INFER_WORKERS, INFER_TASK_RETRIES
+from infer import LogBERTInference
+
+
+def _worker_main(model, tasks, results, cores, explain, batch_size):
+    import torch  # here, so importing this module stays cheap
+
+    # pin this worker to its core set and size torch's thread pool to match
+    if cores and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cores)
+    torch.set_num_threads(max(1, len(cores) if cores else 1))
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        task_id, windows = task
+        try:
+            res = model.infer_batch(windows, batch_size, explain=explain)
+            results.send((task_id, res, None))
+        except Exception as e:
+            results.send((task_id, None, repr(e)))
+
+
+class InferencePool:
+    """
+    N worker processes scoring windows with one copy of the model weights.
+
+    The model is loaded once in the parent, its tensors are moved to shared
+    memory, and workers are forked from it, so every worker (including ones
+    restarted after a crash) maps the same weights. Each worker has its own
+    task queue and result pipe, so a worker killed mid-read or mid-write can't
+    wedge the others. The parent hands each worker up to `prefetch` tasks and
+    remembers which; when a worker dies, everything it was handed and did not
+    answer is re-queued. Results are handed back in submission order per source.
+
+        pool = InferencePool(n_workers=4)
+        pool.submit("api.log", [window_a, window_b])
+        for source, result in pool.results(timeout=1.0):
+            ...
+        pool.close()
+    """
+
+    def __init__(self, n_workers: int = INFER_WORKERS, model: Optional[LogBERTInference] = None,
+                 explain: bool = False, batch_size: int = INFER_BATCH_SIZE, max_pending: int = 1024,
+                 prefetch: int = 2):
+        self.model = model or LogBERTInference()
+        self.model.cache = None  # workers share weights, not per-process caches
+        try:
+            self.model.model.share_memory()
+        except Exception:
+            # quantized modules can't always be moved; fork's copy-on-write still shares them
+            pass
+
+        self.n_workers = n_workers
+        self.explain = explain
+        self.batch_size = batch_size
+        self.max_pending = max_pending
+        self.prefetch = prefetch
+        self._ctx = mp.get_context("fork")
+        self._core_sets = self._split_cores(n_workers)
+        self._workers = [None] * n_workers
+        self._tasks = [None] * n_workers         # per-worker task queue
+        self._results = [None] * n_workers       # per-worker result pipe (read end)
+        self._assigned = [set() for _ in range(n_workers)]  # task ids handed to each worker, not yet answered
+        self._backlog = deque()                  # task ids not yet handed to a worker
+
+        self._task_ids = itertools.count()
+        self._pending = {}                       # task_id -> (source, seq_no, windows, attempts)
+        self._next_seq = defaultdict(int)        # source -> next seq_no to submit
+        self._next_out = defaultdict(int)        # source -> next seq_no to hand out
+        self._ready = defaultdict(dict)          # source -> {seq_no: [results]}
+        self.restarts = 0
+        self.failures = 0
+
+        for wid in range(n_workers):
+            self._start(wid)
+
+    @staticmethod
+    def _split_cores(n_workers: int) -> List[List[int]]:
+        if not hasattr(os, "sched_getaffinity"):
+            return [[] for _ in range(n_workers)]
+        cores = sorted(os.sched_getaffinity(0))
+        if len(cores) < n_workers:
+            # more workers than cores: let them share everything
+            return [cores for _ in range(n_workers)]
+        per_worker = len(cores) // n_workers
+        return [cores[i * per_worker:(i + 1) * per_worker] for i in range(n_workers)]
+
+    def _start(self, wid: int):
+        if self._tasks[wid] is not None:
+            # the old worker's channels may be mid-message; drop them with it
+            self._tasks[wid].cancel_join_thread()
+            self._tasks[wid].close()
+            self._results[wid].close()
+        tasks = self._ctx.Queue()
+        reader, writer = self._ctx.Pipe(duplex=False)
+        proc = self._ctx.Process(
+            target=_worker_main,
+            args=(self.model, tasks, writer, self._core_sets[wid], self.explain, self.batch_size),
+            daemon=True,
+        )
+        proc.start()
+        writer.close()  # only the worker holds the write end, so its death reads as EOF
+        self._workers[wid], self._tasks[wid], self._results[wid] = proc, tasks, reader
+        self._assigned[wid] = set()
+
+    def submit(self, source: str, windows: List[List]) -> int:
+        """Queue windows from `source` as one task; blocks while `max_pending` tasks wait for a worker."""
+        while len(self._backlog) >= self.max_pending:
+            self._collect(0.5)
+        task_id = next(self._task_ids)
+        seq_no = self._next_seq[source]
+        self._next_seq[source] += 1
+        self._pending[task_id] = (source, seq_no, windows, 0)
+        self._backlog.append(task_id)
+        self._dispatch()
+        return task_id
+
+    def _dispatch(self):
+        # hand backlog tasks to the least loaded workers, up to `prefetch` each
+        while self._backlog:
+            wid = min(range(self.n_workers), key=lambda w: len(self._assigned[w]))
+            if len(self._assigned[wid]) >= self.prefetch:
+                return
+            task_id = self._backlog.popleft()
+            self._assigned[wid].add(task_id)
+            self._tasks[wid].put((task_id, self._pending[task_id][2]))
+
+    def check_workers(self):
+        """Restart dead workers and re-queue every task they were handed but did not answer."""
+        for wid, proc in enumerate(self._workers):
+            if proc.is_alive():
+                continue
+            self._drain(wid)  # results it sent before dying still count
+            lost = sorted(self._assigned[wid])
+            print(f"⚠️ Inference worker {wid} exited with {proc.exitcode}, restarting")
+            self.restarts += 1
+            self._start(wid)
+            for task_id in reversed(lost):
+                if task_id in self._pending:
+                    self._retry(task_id, f"worker {wid} died")
+        self._dispatch()
+
+    def _retry(self, task_id: int, reason: str):
+        source, seq_no, windows, attempts = self._pending[task_id]
+        if attempts >= INFER_TASK_RETRIES:
+            # give up but keep the per-source order moving
+            print(f"❌ Task {task_id} from {source} failed after {attempts + 1} attempts: {reason}")
+            self.failures += 1
+            self._complete(task_id, [None] * len(windows))
+            return
+        self._pending[task_id] = (source, seq_no, windows, attempts + 1)
+        self._backlog.appendleft(task_id)
+
+    def _complete(self, task_id: int, res: List):
+        source, seq_no, _, _ = self._pending.pop(task_id)
+        self._ready[source][seq_no] = res
+
+    def _drain(self, wid: int):
+        # move this worker's finished tasks into the per-source reorder buffers
+        conn = self._results[wid]
+        while conn.poll():
+            try:
+                task_id, res, error = conn.recv()
+            except (EOFError, OSError):
+                return  # the worker is gone; check_workers re-queues what it held
+            self._assigned[wid].discard(task_id)
+            if task_id not in self._pending:
+                continue  # duplicate from a task that was re-queued after a crash
+            if error is not None:
+                self._retry(task_id, error)
+            else:
+                self._complete(task_id, res)
+
+    def _collect(self, timeout: float):
+        # wait up to `timeout` for any result or worker exit, then drain everything that is ready
+        self._dispatch()
+        wait(self._results + [proc.sentinel for proc in self._workers], timeout)
+        for wid in range(self.n_workers):
+            self._drain(wid)
+        self.check_workers()
+
+    def _pop_ready(self, source: str) -> List[Dict[str, Any]]:
+        out, ready = [], self._ready[source]
+        while self._next_out[source] in ready:
+            out.extend(ready.pop(self._next_out[source]))
+            self._next_out[source] += 1
+        return out
+
+    def results(self, timeout: float = 0.0) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        """
+        Yield (source, result) pairs that are ready, in submission order per source.
+        Waits up to `timeout` seconds for the first result to arrive.
+        """
+        self._collect(timeout)
+        for source in list(self._ready):
+            for result in self._pop_ready(source):
+                yield source, result
+
+    def map(self, source: str, windows: List[List], chunk_size: int = INFER_BATCH_SIZE) -> List[Dict[str, Any]]:
+        """Score `windows` across the pool and return results in input order."""
+        out = []
+        for i in range(0, len(windows), chunk_size):
+            self.submit(source, windows[i:i + chunk_size])
+        while len(out) < len(windows):
+            self._collect(0.5)
+            out.extend(self._pop_ready(source))
+        return out
+
+    @property
+    def pending(self) -> int:
+        return len(self._pending)
+
+    def close(self, timeout: float = 5.0):
+        for tasks in self._tasks:
+            tasks.put(None)
+        for wid, proc in enumerate(self._workers):
+            proc.join(timeout)
+            if proc.is_alive():
+                proc.terminate()
+            self._tasks[wid].cancel_join_thread()
+            self._tasks[wid].close()
+            self._results[wid].close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()